@@ -90,15 +90,19 @@ def get_maxes(a,b,n_maxes=1):
         sim_mat[b_ind,a_ind]=0.
     return sim_export
 
-def get_vectors(dcit,vector_type='d2v-d',return_recs=True):
+def get_vectors(dcit,vector_type='d2v-d',return_recs=True,store=None):
     '''Get vectors from an orange.docIterators.DocumentIter and pack them into a matrix
     
     Args:
-        dcit (orange.docIterators.DocumentIter) : the DocumentIter to stream documents from
+        dcit (orange.docIterators.DocumentIter) : the DocumentIter to stream documents from.
+            May be None if store is given, to get every vector in the store
     
     Kwargs:
         vector_type (str): the vector model to use. Default 'd2v-d' (doc2vec document vectors)
         return_recs (bool): returns the entire records from dcit in addition to vectors and dois
+        store (apple.vector_store.VectorStore): store to read the vectors from 
+            instead of the records (only the dois are streamed from dcit). Must 
+            hold vector_type vectors. Defaults to None, vectors are read from the records
     Returns:
         return_mat (numpy.2darray) : The vectors of documents in dcit, packed into matrices
         dois (list) : dois of the documents in the dcit
@@ -107,13 +111,32 @@ def get_vectors(dcit,vector_type='d2v-d',return_recs=True):
         recs (dict) : all the records in dcit, keys=dois, values=records. 
             only returned if return_recs flag is set toTrue
     
-    WARNING - not a memory friendly operation. Do not use if dcit streams a large number
-        of documents (dependent on system but >100 000 will probably crash)
+    WARNING - not a memory friendly operation without a store. Do not use if dcit 
+        streams a large number of documents (dependent on system but >100 000 will 
+        probably crash). With a store and no dcit, the matrix is memory mapped
     
-    The documents streamed by dcit must have precomputed vectors stored in them.
-    The document must have a key 'vectors' with a dictionary of vectors in it, 
-    containing vector_type kwarg argument as key
+    Without a store, the documents streamed by dcit must have precomputed vectors 
+    stored in them. The document must have a key 'vectors' with a dictionary of 
+    vectors in it, containing vector_type kwarg argument as key. With a store, 
+    documents not in the store are left out
     '''
+    if store is not None:
+        if store.vector_type!=vector_type:
+            raise ValueError('the store holds '+store.vector_type+' vectors, not '+vector_type)
+        if dcit is None:
+            return_mat,dois=store.get_matrix()
+        else:
+            iter_type=dcit.iter_type
+            dcit.iter_type='DOIS'
+            try:
+                return_mat,dois=store.get_matrix(list(dcit))
+            finally:
+                dcit.iter_type=iter_type
+        if return_recs:
+            recs={doi:{'vector':return_mat[:,i]} for i,doi in enumerate(dois)}
+            return return_mat,dois,recs
+        else:
+            return return_mat,dois
     dcit.iter_type='VECTORS'
     recs={}
     vecs=[]
@@ -129,17 +152,21 @@ def get_vectors(dcit,vector_type='d2v-d',return_recs=True):
     else:
         return return_mat,dois
 
-def get_doi_sims(a_vecs,a_dois,b_vecs,b_dois,n_maxes=5):
+def get_doi_sims(a_vecs,a_dois,b_vecs,b_dois,n_maxes=5,store=None):
     '''Wrapper for get_maxes. Returns most similar documents between sets a and b
     
     Args:
         a_vecs (numpy.2darray):(d-by-n) matrix of n d-dimensional vectors
+            (None to read the vectors of a_dois from store)
         a_dois (list): dois of documents in a_vecs
         b_vecs (numpy.2darray):(d-by-n) matrix of n d-dimensional vectors
+            (None to read the vectors of b_dois from store)
         b_dois (list): dois of documents in b_vecs
         
     Kwargs:
         n_maxes (int): number of highest similarities to return (default 5)
+        store (apple.vector_store.VectorStore): store to read missing vectors 
+            from (defaults to None). dois not in the store are left out
     
     Returns:
         export (dict): dictionary containing highest results.
@@ -157,6 +184,10 @@ def get_doi_sims(a_vecs,a_dois,b_vecs,b_dois,n_maxes=5):
     slightly different values: {'doi':doi in b with high similarity to document a
     'similarity':cosine similarity}
     '''
+    if a_vecs is None:
+        a_vecs,a_dois=store.get_matrix(a_dois)
+    if b_vecs is None:
+        b_vecs,b_dois=store.get_matrix(b_dois)
     if len(a_vecs.shape)==1:
         single_flag=True
         a_vecs=a_vecs.reshape(a_vecs.shape[0],1)
@@ -0,0 +1,214 @@
+'''
+.. module:: vector_store
+   :platform: Unix, OSX
+   :synopsis: on-disk stores of document vectors, one memory mapped float32
+       .npy matrix per vector type with a doi index
+
+.. moduleauthor:: Patrick Lewis
+'''
+import codecs
+import json
+import os
+import struct
+import numpy as np
+
+HEADER_LEN=128 #fixed .npy header length, so the shape can be rewritten in place
+
+def store_file_names(file_stub,vector_type):
+    '''get the names of the files a VectorStore is kept in
+
+    Args:
+        file_stub (str): stub of the store's file names
+        vector_type (str): the vector model the store holds (e.g. 'd2v-d')
+
+    Returns:
+        vec_file (str): name of the .npy file of vectors
+        doi_file (str): name of the json file of dois (one per row of vectors)
+    '''
+    vec_file=file_stub+'_'+vector_type+'.npy'
+    doi_file=file_stub+'_'+vector_type+'_dois.json'
+    return vec_file,doi_file
+
+def _write_header(f,n_rows,dim):
+    '''write a fixed length .npy header for an (n_rows,dim) float32 matrix
+    at the start of a file
+
+    Args:
+        f (file): the .npy file, opened for binary writing
+        n_rows (int): number of rows
+        dim (int): number of columns
+    '''
+    header="{'descr': '<f4', 'fortran_order': False, 'shape': (%d, %d), }"%(n_rows,dim)
+    header=header.ljust(HEADER_LEN-11)+'\n'
+    f.seek(0)
+    f.write(np.lib.format.magic(1,0)+struct.pack('<H',len(header))+header)
+
+class VectorStore(object):
+    '''Store of the vectors of one vector type (e.g. 'd2v-d') for a set of documents.
+
+    Vectors are kept as rows of a float32 .npy file that is memory mapped when
+    read, so opening a store costs only loading its doi index. Vectors are added
+    with :method: append, which writes straight to the end of the file.
+    '''
+    file_stub=''
+    vector_type=''
+    dim=0
+    size=0
+
+    def __init__(self,file_stub,vector_type='d2v-d',dim=None):
+        '''Open (or create) a VectorStore
+
+        Args:
+            file_stub (str): stub of the store's file names
+
+        Kwargs:
+            vector_type (str): the vector model to store (defaults to 'd2v-d')
+            dim (int): dimensionality of the vectors. Defaults to None, taken from
+                the existing store or the first vectors appended
+        '''
+        self.file_stub=file_stub
+        self.vector_type=vector_type
+        self.vec_file,self.doi_file=store_file_names(file_stub,vector_type)
+        self._vectors=None
+        if os.path.exists(self.vec_file):
+            with open(self.vec_file,'rb') as f:
+                np.lib.format.read_magic(f)
+                shape,fortran,dtype=np.lib.format.read_array_header_1_0(f)
+            self.size,self.dim=shape
+            if dim is not None and dim!=self.dim:
+                raise ValueError(self.vec_file+' holds '+str(self.dim)+'-dimensional vectors')
+            with codecs.open(self.doi_file,'r',encoding='utf8') as f:
+                self.dois=json.load(f)[:self.size]#ignore dois of a failed append
+        else:
+            self.size=0
+            self.dim=dim or 0
+            self.dois=[]
+        self.rows={doi:i for i,doi in enumerate(self.dois)}
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self,doi):
+        return doi in self.rows
+
+    @property
+    def vectors(self):
+        '''(n-by-d) memory mapped matrix of all the vectors in the store'''
+        if self._vectors is None:
+            if self.size:
+                self._vectors=np.load(self.vec_file,mmap_mode='r')
+            else:
+                self._vectors=np.zeros((0,self.dim),dtype=np.float32)
+        return self._vectors
+
+    def append(self,dois,vectors):
+        '''add vectors to the store. Vectors of dois already in the store are
+        overwritten in place, the rest are appended
+
+        Args:
+            dois (list): dois of the vectors
+            vectors (numpy.2darray): (n-by-d) matrix of the vectors, one row per doi
+        '''
+        vectors=np.asarray(vectors,dtype=np.float32).reshape(len(dois),-1)
+        if not self.dim:
+            self.dim=vectors.shape[1]
+        elif vectors.shape[1]!=self.dim:
+            raise ValueError('expected '+str(self.dim)+'-dimensional vectors')
+        new=[]
+        old=[]
+        seen=set()
+        for i,doi in enumerate(dois):
+            if doi in self.rows:
+                old.append(i)
+            elif doi not in seen:#append repeated dois once
+                seen.add(doi)
+                new.append(i)
+        new_dois=[dois[i] for i in new]
+        self._vectors=None #close the memory map before writing
+        mode='r+b' if os.path.exists(self.vec_file) else 'w+b'
+        with open(self.vec_file,mode) as f:
+            if self.size==0:
+                _write_header(f,0,self.dim)
+            if old:#overwrite rows in place
+                for i in old:
+                    f.seek(HEADER_LEN+4*self.dim*self.rows[dois[i]])
+                    f.write(vectors[i].tobytes())
+            f.seek(HEADER_LEN+4*self.dim*self.size)
+            f.write(np.ascontiguousarray(vectors[new]).tobytes())
+            self.dois.extend(new_dois)
+            with codecs.open(self.doi_file+'.part','w',encoding='utf8') as df:
+                json.dump(self.dois,df)
+            os.rename(self.doi_file+'.part',self.doi_file)
+            for doi in new_dois:
+                self.rows[doi]=self.size
+                self.size+=1
+            _write_header(f,self.size,self.dim)#commit the new rows
+
+    def get(self,doi):
+        '''get the vector of a single document
+
+        Args:
+            doi (str): doi of the document
+
+        Returns:
+            vector (numpy.array): the document's vector, None if it is not in the store
+        '''
+        row=self.rows.get(doi)
+        if row is None:
+            return None
+        vector=np.array(self.vectors[row])
+        return vector
+
+    def get_matrix(self,dois=None):
+        '''get the vectors of a set of documents as a matrix, in the (d-by-n) layout
+        used by :module: analysis_tools
+
+        Kwargs:
+            dois (list): dois of the documents. Defaults to None, all documents in
+                the store (the memory map itself, without copying)
+
+        Returns:
+            matrix (numpy.2darray): (d-by-n) matrix of the document vectors
+            found (list): the dois in matrix column order (dois not in the store are dropped)
+        '''
+        if dois is None:
+            return np.transpose(self.vectors),list(self.dois)
+        found=[doi for doi in dois if doi in self.rows]
+        rows=np.array([self.rows[doi] for doi in found],dtype=np.int64)
+        matrix=np.transpose(self.vectors[rows]) if len(rows) else np.zeros((self.dim,0),dtype=np.float32)
+        return matrix,found
+
+def store_vectors(doc_iter,file_stub,vector_types=('d2v-d',),batch_size=10000):
+    '''copy the vectors stored in the records of a DocumentIter into VectorStores
+
+    Args:
+        doc_iter (orange.docIterators.DocumentIter): iterator supporting the 'VECTORS'
+            iter_type, whose records have a 'vectors' dictionary
+        file_stub (str): stub of the stores' file names
+
+    Kwargs:
+        vector_types (list): the vector models to store (defaults to ('d2v-d',))
+        batch_size (int): number of records to buffer before appending (defaults to 10000)
+
+    Returns:
+        stores (dict): {vector_type (str): VectorStore} of the filled stores
+    '''
+    stores={vt:VectorStore(file_stub,vt) for vt in vector_types}
+    buffers={vt:([],[]) for vt in vector_types}
+    iter_type=doc_iter.iter_type
+    doc_iter.iter_type='VECTORS'
+    try:
+        for rec in doc_iter:
+            for vt in vector_types:
+                if vt in rec['vectors']:
+                    buffers[vt][0].append(rec['doi'])
+                    buffers[vt][1].append(rec['vectors'][vt])
+                    if len(buffers[vt][0])>=batch_size:
+                        stores[vt].append(*buffers[vt])
+                        buffers[vt]=([],[])
+    finally:
+        doc_iter.iter_type=iter_type
+    for vt in vector_types:
+        if buffers[vt][0]:
+            stores[vt].append(*buffers[vt])
+    return stores
@@ -7,6 +7,9 @@
 '''
 import json
 import codecs
+import operator
+
+OPERATORS={'$in':None,'$gt':operator.gt,'$gte':operator.ge,'$lt':operator.lt,'$lte':operator.le}
 
 
 class FakeMongo(object):
@@ -22,25 +25,88 @@ class FakeMongo(object):
             recs = json.load(f)
         self.recs=recs
     
-    def find(self,query=None):
+    def find(self,query=None,projection=None):
         '''perform query on file using mongodb query syntax (Only partially functional)
         
         Kwargs:
-            query (dict): MongoDB style query
+            query (dict): MongoDB style query. Supports equality, '$in' and
+                comparison conditions on any number of fields, and '$and'
+            projection (dict): MongoDB style projection of fields to return
+                (only inclusion projections are supported)
         
         Returns:
             fc (FakeCursor): iterator object for results of query'''
         if query==None:
-            fc=FakeCursor(self.recs)
+            retur = self.recs
         else:
-            retur = []
-            k = query.keys()[0]
-            v = query.values()[0]
-            for rec in self.recs:
-                if rec[k]==v:
-                    retur.append(rec)
-            fc=FakeCursor(retur)
+            retur = [rec for rec in self.recs if match(rec,query)]
+        if projection:
+            retur = [project(rec,projection) for rec in retur]
+        fc=FakeCursor(retur)
         return fc
+    
+    def find_one(self,query=None,projection=None,sort=None):
+        '''get the first result of a query (see :method: find)
+        
+        Kwargs:
+            query (dict): MongoDB style query
+            projection (dict): MongoDB style projection
+            sort (list): [(field, 1 or -1)] MongoDB style sort order (defaults to None)
+        
+        Returns:
+            rec (dict): first matching record, None if nothing matches
+        '''
+        recs=list(self.find(query,projection))
+        if sort:
+            for field,direction in reversed(sort):
+                recs=[r for r in recs if field in r]
+                recs.sort(key=lambda r:r[field],reverse=direction<0)
+        for rec in recs:
+            return rec
+        return None
+
+def match(rec,query):
+    '''test whether a record satisfies a MongoDB style query
+    
+    Args:
+        rec (dict): record to test
+        query (dict): query of {field: value}, {field: {'$in': values}} or 
+            {field: {'$gt'/'$gte'/'$lt'/'$lte': value}} conditions, or 
+            {'$and': [query, query...]}
+    
+    Returns:
+        matched (bool): True if every condition in query holds for rec
+    '''
+    for k,v in query.items():
+        if k=='$and':
+            if not all(match(rec,q) for q in v):
+                return False
+        elif isinstance(v,dict) and any(op in v for op in OPERATORS):
+            for op,arg in v.items():
+                if op=='$in':
+                    if rec.get(k) not in arg:
+                        return False
+                elif k not in rec or not OPERATORS[op](rec[k],arg):
+                    return False
+        elif rec.get(k)!=v:
+            return False
+    return True
+
+def project(rec,projection):
+    '''apply a MongoDB style inclusion projection to a record
+    
+    Args:
+        rec (dict): record to project
+        projection (dict): {field: 1} fields to keep ('_id' is kept unless set to 0)
+    
+    Returns:
+        projected (dict): record with only the projected fields
+    '''
+    keep=[k for k,v in projection.items() if v]
+    if projection.get('_id',1):
+        keep.append('_id')
+    projected={k:rec[k] for k in keep if k in rec}
+    return projected
 
 class FakeCursor(object):
     '''Iterator for results of a query to a FakeMongo Instance'''
@@ -13,8 +13,13 @@ import corpus_stats
 import codecs
 import docIterators
 import gensim
-import random
+import hashing
 import json
+import parallel_dictionary
+import pass_engine
+import sampling
+import sparse_matrix
+import tfidf_export
 
 class Corpus(object):
     '''A Corpus represents a manipulation interface for operations for a text corpus
@@ -25,42 +30,172 @@ class Corpus(object):
     name='UNNAMED_CORPUS'
     statistics =None
     tfidf_model=None
+    watermark=None
+    max_vocab=None
     
-    def __init__(self,name,doc_iter,dictionary=None,tfidf_model=None):
-    '''Create a Corpus Object
+    def __init__(self,name,doc_iter,dictionary=None,tfidf_model=None,processes=1,
+            id_range=None,sample_words=0,max_vocab=None,analyse=False,track_updates=False):
+        '''Create a Corpus Object
     
-    Args:
-        name (str): The desired name of the corpus (Appears in dumps)
-        doc_iter (docIterator): The :module:docIterator Object that streams the documents
-            that make up the corpus
+        Args:
+            name (str): The desired name of the corpus (Appears in dumps)
+            doc_iter (docIterator): The :module:docIterator Object that streams the documents
+                that make up the corpus
     
-    Kwargs:
-        dictionary (gensim.corpora.Dictionary): The tokenisation dictionary for the corpus. 
-            Defaults to None if not specified and the dictionary is built from iterating the documents
-        tfidf_model (gensim.models.tfidf_model): The tfidf model for the corpus. Defaults
-            to None if not specified. Call :method: get_tfidf_model to build a tfidf model for a corpus
-    '''
+        Kwargs:
+            dictionary (gensim.corpora.Dictionary): The tokenisation dictionary for the corpus. 
+                Defaults to None if not specified and the dictionary is built from iterating the documents
+            tfidf_model (gensim.models.tfidf_model): The tfidf model for the corpus. Defaults
+                to None if not specified. Call :method: get_tfidf_model to build a tfidf model for a corpus
+            processes (int): number of worker processes to build the dictionary with. 
+                Defaults to 1 (a single pass in this process). The dictionary is the 
+                same whatever the number of processes (see :module:parallel_dictionary)
+            id_range (int): size of the hashed id space. Defaults to None (a dictionary 
+                is built). If given, the corpus is in hashing mode: words are given 
+                ids by hashing (see :module:hashing), so no dictionary building pass 
+                is needed and memory is bounded, and inv_dict is None
+            sample_words (int): in hashing mode, number of words to remember for each 
+                id as a reverse lookup for debugging (defaults to 0)
+            max_vocab (int): vocabulary budget. Defaults to None (every word is kept).
+                If given, the dictionary is built in bounded memory and keeps the 
+                max_vocab most frequent words (see :func:parallel_dictionary.build_dictionary)
+            analyse (bool): whether to also generate statistics and the tfidf model 
+                in the pass that builds the dictionary (see :method: analyse). 
+                Defaults to False
+            track_updates (bool): whether to take a watermark of the data source, 
+                so :method: refresh can add the documents appended to it later 
+                (JsonDiskIter and MongoIter, not wrapped in filter, take... operators).
+                Defaults to False
+        '''
         self.doc_iter = doc_iter
-        print('Building Dictionary')
+        self.max_vocab=max_vocab
+        if track_updates:#mark the records the corpus is built from
+            if not docIterators.can_refresh(doc_iter):
+                raise ValueError('cannot track updates of a '+doc_iter.__class__.__name__)
+            self.watermark=doc_iter.watermark()
         if dictionary:
             self.dictionary=dictionary
+        elif id_range:#no pass needed
+            self.dictionary=hashing.HashingDictionary(id_range=id_range,sample_words=sample_words)
+        elif analyse:#built by analyse below
+            self.dictionary=None
+        elif processes>1 or max_vocab:
+            print('Building Dictionary')
+            self.dictionary=parallel_dictionary.build_dictionary(doc_iter,processes,max_vocab=max_vocab)
         else:#build a dictionary if one hasnt been provided
+            print('Building Dictionary')
             iter_type=doc_iter.iter_type
             self.doc_iter.iter_type='SIMPLE'#stream word-by-word
             self.dictionary = corpora.Dictionary(doc_iter)
             self.doc_iter.iter_type=iter_type #return to what the iter_type was before
-        #create an inverse dictionary to map from token to word
-        self.inv_dict = {v:k for k,v in self.dictionary.iteritems()} 
         self.name=name
+        if analyse and not dictionary:
+            self.analyse()
+        elif not self.hashing:#create an inverse dictionary to map from token to word
+            self.inv_dict = {v:k for k,v in self.dictionary.iteritems()} 
         if tfidf_model:
             self.tfidf_model=tfidf_model
     
+    @property
+    def hashing(self):
+        '''True if the corpus is in hashing mode (see :module:hashing)'''
+        return isinstance(self.dictionary,hashing.HashingDictionary)
+    
     def rebuild_dicts(self):
         '''rebuild the dictionaries if the document corpus has changed'''
+        if self.watermark is not None:#tracking updates
+            self.watermark=self.doc_iter.watermark()
         self.doc_iter.iter_type='SIMPLE'
-        self.dictionary = corpora.Dictionary(self.doc_iter)
-        self.inv_dict = {v:k for k,v in self.dictionary.iteritems()}
+        if self.hashing:#recount the document frequencies
+            self.dictionary = hashing.HashingDictionary(self.doc_iter,
+                id_range=self.dictionary.id_range,sample_words=self.dictionary.sample_words)
+        elif self.max_vocab:
+            self.dictionary = parallel_dictionary.build_dictionary(self.doc_iter,1,max_vocab=self.max_vocab)
+            self.inv_dict = {v:k for k,v in self.dictionary.iteritems()}
+        else:
+            self.dictionary = corpora.Dictionary(self.doc_iter)
+            self.inv_dict = {v:k for k,v in self.dictionary.iteritems()}
+    
+    def token_id(self,word):
+        '''get the token id of a word
+        
+        Args:
+            word (str): the word
+        
+        Returns:
+            token_id (int): the id of the word, None if it is not in the dictionary
+        '''
+        if self.hashing:
+            return self.dictionary.token_id(word)
+        token_id=self.inv_dict.get(word)
+        return token_id
+        
+    def add_documents(self,doc_iter):
+        '''merge documents into the dictionary and its document frequencies without
+        a pass over the rest of the corpus. inv_dict is extended with just the new
+        words, and the tfidf model (if built) is refreshed from the document 
+        frequencies
         
+        Args:
+            doc_iter (docIterator): iterator over the new documents
+        
+        Returns:
+            n_new (int): number of documents added
+        
+        The dictionary is not pruned while adding, so the ids of existing words 
+        never change. If the corpus has a max_vocab budget, the vocabulary is 
+        frozen: only the frequencies of words already in the dictionary are 
+        updated, until :method: rebuild_dicts is called.
+        '''
+        token2id=getattr(self.dictionary,'token2id',None)
+        new_words=set()
+        n_new=[0]
+        def new_docs():
+            for doc in doc_iter:
+                n_new[0]+=1
+                if self.max_vocab and token2id is not None:
+                    yield [w for w in doc if w in token2id]
+                    continue
+                if token2id is not None:#hashing mode has no inverse dictionary to extend
+                    new_words.update(w for w in doc if w not in token2id)
+                yield doc
+        iter_type=doc_iter.iter_type
+        doc_iter.iter_type='SIMPLE'#stream word-by-word
+        try:
+            if self.hashing:
+                self.dictionary.add_documents(new_docs())
+            else:
+                self.dictionary.add_documents(new_docs(),prune_at=None)
+        finally:
+            doc_iter.iter_type=iter_type
+        if not self.hashing:
+            for w in new_words:
+                self.inv_dict[w]=token2id[w]
+        if self.tfidf_model is not None:
+            self.tfidf_model=gensim.models.TfidfModel(dictionary=self.dictionary)
+        return n_new[0]
+    
+    def refresh(self):
+        '''update the dictionary (and tfidf model, if built) with the documents added
+        to the data source since the corpus was built or last refreshed. Only the
+        new documents are streamed (see JsonDiskIter.since and MongoIter.since).
+        The corpus must have been built with track_updates
+        
+        Returns:
+            n_new (int): number of new documents
+        '''
+        if self.watermark is None:
+            raise ValueError(self.name+' was not built with track_updates, so cannot be refreshed')
+        if not docIterators.can_refresh(self.doc_iter):
+            raise ValueError('cannot refresh a corpus streamed by a '+self.doc_iter.__class__.__name__)
+        print('Refreshing '+self.name)
+        delta=self.doc_iter.since(self.watermark)
+        n_new=self.add_documents(delta)
+        if n_new:#an empty MongoIter delta has no highest _id, keep the old mark
+            self.watermark=delta.watermark()
+        print('Added '+str(n_new)+' documents')
+        return n_new
+    
     def get_bow_doc(self,sent):
         '''get the bag-of-words representation of a document/sentence
         
@@ -74,12 +209,68 @@ class Corpus(object):
         repr = self.dictionary.doc2bow(sent)
         return repr
     
-    def generate_stats(self):
+    def generate_stats(self,processes=1,exact=True,plot=True):
         '''Generate statistics about the corpus.
+        
+        Kwargs:
+            processes (int): number of worker processes to count with (defaults to 1)
+            exact (bool): count every word exactly (defaults to True). If False, 
+                the vocabulary is sketched in bounded memory (see 
+                :class:corpus_stats.CorpusStatistics)
+            plot (bool): whether to save the Zipfian and document length plots 
+                (defaults to True)
         '''
-        self.statistics = corpus_stats(self.doc_iter,self.name)
+        statistics=corpus_stats.CorpusStatistics(exact=exact)
+        self.statistics = corpus_stats.get_corpus_stats(self.doc_iter,self.name,statistics,processes,plot)
+    
+    def analyse(self,sample_size=0,seed=None,sample_type='DOI'):
+        '''rebuild the dictionary (with the document frequencies of the tfidf 
+        model), generate statistics and draw a sample of the corpus, all in a 
+        single pass over the documents (see :module:pass_engine)
+        
+        Kwargs:
+            sample_size (int): number of documents to sample. Defaults to 0 (no sample)
+            seed (int): seed for the random number generator, so the sample can be 
+                reproduced. Defaults to None (unseeded)
+            sample_type (str): the iter_type of the sampled documents. Defaults to 'DOI'
+        
+        Returns:
+            sample (list): the sampled documents
+        '''
+        if self.watermark is not None:#tracking updates
+            self.watermark=self.doc_iter.watermark()
+        if self.hashing:
+            dictionary=hashing.HashingDictionary(id_range=self.dictionary.id_range,
+                sample_words=self.dictionary.sample_words)
+        else:
+            dictionary=None
+        engine=pass_engine.PassEngine(self.doc_iter,
+            [pass_engine.DictionaryAccumulator(dictionary,self.max_vocab),
+            corpus_stats.CorpusStatsAccumulator()],
+            iter_type=sample_type if sample_size else 'SIMPLE')
+        if sample_size:
+            engine.add(pass_engine.SampleAccumulator(sample_size,seed))
+        print('Analysing '+self.name)
+        results=engine.run()
+        self.dictionary=results['dictionary']
+        if not self.hashing:
+            self.inv_dict = {v:k for k,v in self.dictionary.iteritems()}
+        self.statistics=corpus_stats.report_corpus_stats(results['statistics'],self.name)
+        self.get_tfidf_model()
+        sample=results.get('sample',[])
+        return sample
     
     def get_tfidf_model(self):
+        '''build the tfidf model of the corpus from the dictionary's document 
+        frequencies. In hashing mode, the document frequencies are counted in a
+        pass over the corpus first if no documents have been added yet
+        
+        Returns:
+            mod (gensim.models.TfidfModel): the tfidf model
+        '''
+        if self.hashing and self.dictionary.num_docs==0:
+            print('Counting Document Frequencies')
+            self.add_documents(self.doc_iter)
         print('Creating TF-IDF Model')
         mod=gensim.models.TfidfModel(dictionary=self.dictionary)
         self.tfidf_model=mod
@@ -101,7 +292,7 @@ class Corpus(object):
         except:
             print('tfidf model must be built before representations can be generated')
         
-    def export2jsonfile(self,file_name=None,tfidf=False):
+    def export2jsonfile(self,file_name=None,tfidf=False,processes=1,merge=True):
         '''Export and save the corpus to disk as Json
         
         Kwargs:
@@ -109,41 +300,56 @@ class Corpus(object):
                 If filen_name is None, the produced file has the name of the corpus
             tfidf (bool): whether to export the corpus with tfidf weights
                 defaults to False (do not include tfidf weights)
+            processes (int): number of worker processes to export with. Defaults to 1
+                (export in this process). With more, shards of the corpus are written 
+                to part files file_name.00000, file_name.00001... 
+            merge (bool): whether to concatenate the part files into file_name 
+                (defaults to True)
+        
+        Returns:
+            files (list): names of the files written
         
         The Exported json file includes everything from the document store the corpus streams from.
         if tfidf is chosen ,it also includes 'doc_weights' and 'sent_weights' for
         document tfidf weightings and sentence-by-sentence tfidf weightings 
+        (see :class:tfidf_export.TfidfWeighter)
         '''
         if file_name is None:
             file_name = self.name+'.json'
+        weighter=None
         if tfidf:
             if self.tfidf_model is None:
                 self.tfidf_model=self.get_tfidf_model()
-        with codecs.open(file_name,'w',encoding='utf8') as f:
-            self.doc_iter.iter_type='EVERYTHING'
-            for doc in self.doc_iter:
-                if tfidf:
-                    doc_weights=[]
-                    sent_weights=[]
-                    sents=doc['doc']
-                    words=[word for sent in sents for word in sent]
-                    #get doc tfidf weights
-                    doc_tfidf=self.get_tfidf_doc(words)
-                    doc_tfdict={k[0]:k[1] for k in doc_tfidf}
-                    for i in range(len(doc['doc'])):
-                        doc_weights.append([doc_tfdict[self.inv_dict[j]] for j in doc['doc'][i]])
-                    #get sent tfidf weights
-                    for sent in sents:
-                        sent_tfidf=self.get_tfidf_doc(sent)
-                        sent_tfdict={k[0]:k[1] for k in sent_tfidf}
-                        weight=[sent_tfdict[self.inv_dict[word]] for word in sent]
-                        sent_weights.append(weight)
-                    doc['tfidf-weights']={'doc-weights':doc_weights,'sent-weights':sent_weights}
-                ex = json.dumps(doc)
-                f.write(ex+'\n')
+            weighter=tfidf_export.TfidfWeighter(self)
+        files=tfidf_export.export_corpus(self.doc_iter,file_name,weighter,processes,merge)
         print('EXPORT COMPLETE')
+        return files
     
-    def get_sample(self,sample_size,return_type='DOI',doc_iter=None):
+    def get_matrices(self,doc_iter=None):
+        '''build the bag-of-words and tfidf matrices of the corpus in a single pass,
+        as scipy.sparse CSR matrices with one row per document and a doi row index.
+        The tfidf model is built first if needed
+        
+        Kwargs:
+            doc_iter (docIterator): the docIterator to build the matrices from (must 
+                support the 'DOI' iter_type). Defaults to None, the Corpus object's docIterator
+        
+        Returns:
+            bow (sparse_matrix.CorpusMatrix): bag-of-words counts of each document
+            tfidf (sparse_matrix.CorpusMatrix): tfidf weights of each document
+        
+        Save the matrices with CorpusMatrix.save, and memory map them back with 
+        CorpusMatrix.load
+        '''
+        if doc_iter is None:
+            doc_iter=self.doc_iter
+        if self.tfidf_model is None:
+            self.get_tfidf_model()
+        print('Building Matrices')
+        bow,tfidf=sparse_matrix.build_matrices(doc_iter,tfidf_export.TfidfWeighter(self))
+        return bow,tfidf
+    
+    def get_sample(self,sample_size,return_type='DOI',doc_iter=None,seed=None,stratify=None):
         '''Get a random sample of documents from the corpus
         
         Args:
@@ -155,19 +361,25 @@ class Corpus(object):
                 which is {'doi':doi,'doc':list of sentence lists}
             doc_iter (docIterator): the docIterator to draw the sample from. Default to None.
                 if doc_iter is None, it uses the Corpus object's docIterator
+            seed (int): seed for the random number generator, so the sample can be 
+                reproduced. Defaults to None (unseeded)
+            stratify (str or function): record field (e.g. 'publisher') or function 
+                of a record to stratify the sample by, sampling from each stratum 
+                in proportion to its size. Defaults to None (no stratification)
                 
         Returns:
             sample (list): list of randomrecords from the corpus
+        
+        Data sources with a line index or in MongoDB are sampled by reading only the
+        sampled records, others in a single pass (see :module:sampling)
         '''
         print('Sampling '+str(sample_size)+' random documents')
-        randoms = random.sample(range(self.doc_iter.size), sample_size) #generate random integers
-        sample=[]
-        ind=0
         if doc_iter is None:#use own docIterator
-           self.doc_iter.iter_type=return_type
-           doc_iter=self.doc_iter
-        for record in doc_iter:
-            if ind in randoms:
-                sample.append(record)
-            ind+=1
+            doc_iter=self.doc_iter
+        iter_type=doc_iter.iter_type
+        doc_iter.iter_type=return_type
+        try:
+            sample=sampling.sample_documents(doc_iter,sample_size,seed=seed,stratify=stratify)
+        finally:
+            doc_iter.iter_type=iter_type
         return sample
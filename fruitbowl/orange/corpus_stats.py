@@ -8,24 +8,88 @@
 
 '''
 from collections import Counter
+import copy
+import csv
+import multiprocessing
 import matplotlib.pyplot as plt
 import numpy as np
+from gensim import utils
+import docIterators
+from iter_stats import IterStats
+import pass_engine
+import sketches
 
-def plot_zipfian(log_freqs,file_name):
+def zipf_table(ranked_word_freq):
+    '''tabulate the Zipf ranking of a corpus's words as arrays
+    
+    Args:
+        ranked_word_freq (list): list of (word, frequency) tuples, most frequent first
+    
+    Returns:
+        table (dict): {'words': list of words, 'ranks', 'log_ranks', 'freqs', 
+            'log_freqs': numpy arrays of the ranks and frequencies and their base 
+            10 logs}
+    '''
+    words=[w for w,f in ranked_word_freq]
+    freqs=np.array([f for w,f in ranked_word_freq],dtype=np.int64)
+    ranks=np.arange(1,len(freqs)+1)
+    table={'words':words,
+        'ranks':ranks,
+        'log_ranks':np.log10(ranks),
+        'freqs':freqs,
+        'log_freqs':np.log10(freqs)}
+    return table
+
+def fit_zipfian(log_freqs,log_ranks=None):
+    '''fit a straight line to a Zipfian plot. The line is fitted to a sample of 
+    ranks evenly spaced in log rank, so the long tail does not swamp the fit
+    
+    Args:
+        log_freqs (numpy.array): base 10 log of frequency of words in a text corpus
+            in decending order
+    
+    Kwargs:
+        log_ranks (numpy.array): base 10 log of the ranks (defaults to None, computed)
+    
+    Returns:
+        z_grad (float): gradient of the line of best fit (nan with fewer than 2 words)
+        z_c (float): intercept of the line of best fit (nan with fewer than 2 words)
+    '''
+    log_freqs=np.asarray(log_freqs,dtype=np.float64)
+    if log_ranks is None:
+        log_ranks=np.log10(np.arange(1,len(log_freqs)+1))
+    if len(log_ranks)<2:
+        return float('nan'),float('nan')
+    #index of the rank nearest each evenly spaced point (the lower one on ties)
+    points=np.arange(log_ranks[0],log_ranks[-1],log_ranks[1])
+    upper=np.clip(np.searchsorted(log_ranks,points),1,len(log_ranks)-1)
+    lower=upper-1
+    sample=np.where(points-log_ranks[lower]<=log_ranks[upper]-points,lower,upper)
+    if len(sample)<2:
+        sample=np.arange(len(log_ranks))
+    z_grad,z_c = np.polyfit(log_ranks[sample],log_freqs[sample],1)
+    return z_grad,z_c
+
+def plot_zipfian(log_freqs,file_name,log_ranks=None):
     ''' Plot a Zipfian plot and straight line of best fit and zipfian data
     
     Args:
-        log_freqs (list): base 10 log of frequency of words in a text corpus
+        log_freqs (numpy.array): base 10 log of frequency of words in a text corpus
             in decending order
         file_name (str): name of the png file to save the plot to
+    
+    Kwargs:
+        log_ranks (numpy.array): base 10 log of the ranks (defaults to None, computed)
+    
+    Returns:
+        z_grad (float): gradient of the line of best fit
+        z_c (float): intercept of the line of best fit
     '''
-    log_ranks = [math.log(x,10) for x in range(1,len(log_freqs)+1)]#generate x axis
-    sample = [] #create an evenly spaced interpolated sample to fit to 
-    for s in np.arange(log_ranks[0],log_ranks[-1],log_ranks[1]): 
-        sample.append(log_ranks.index(min(log_ranks,key=lambda x:abs(x-s))))
-    #perform fitting
-    z_grad,z_c = np.polyfit([log_ranks[s] for s in sample],[log_freqs[s]for s in sample],1)
-    line_freq = map(lambda x: z_grad*x+z_c,log_ranks)
+    log_freqs=np.asarray(log_freqs,dtype=np.float64)
+    if log_ranks is None:
+        log_ranks=np.log10(np.arange(1,len(log_freqs)+1))#generate x axis
+    z_grad,z_c=fit_zipfian(log_freqs,log_ranks)
+    line_freq = z_grad*log_ranks+z_c
     #plot the graph
     plt.close()
     plt.plot(log_ranks,log_freqs,'r')
@@ -35,6 +99,7 @@ def plot_zipfian(log_freqs,file_name):
     plt.savefig(file_name)
     print('Saved Ziphian Plot')
     plt.close()
+    return z_grad,z_c
     
 def plot_doc_length_distro(lens,freqs, file_name):
     '''Plot the distibution of document lengths in a corpus
@@ -46,7 +111,7 @@ def plot_doc_length_distro(lens,freqs, file_name):
     '''
     plt.plot(lens,freqs,'o')
     xs=np.linspace(min(lens),max(lens),1000)
-    ys=map(lambda x:doc_len_distro(x),xs)
+    ys=doc_len_distro(xs)
     plt.plot(xs,ys,'r')
     plt.xlabel('Document Word Count')
     plt.ylabel('Frequency')
@@ -58,72 +123,278 @@ def doc_len_distro(x):
     '''generate a predicted number of documents with a given word count
     
     Args:
-        x (int): document word count
+        x (int or numpy.array): document word count
     
     Returns:
-        y (int): predicted number of documents in corpus with x words
+        y (float or numpy.array): predicted number of documents in corpus with x words
         
     It was determined the document distribution of Delta6 followed a boltzman
     distribution of the functional form:
         5.991524457330881*x**2*math.exp(-0.00034375*x**2)
     '''
-    y= 5.991524457330881*x**2*math.exp(-0.00034375*x**2)
+    y= 5.991524457330881*x**2*np.exp(-0.00034375*x**2)
     return y
 
-def get_corpus_stats(doc_iter,outfile_name):
+class CorpusStatistics(utils.SaveLoad):
+    '''Mergeable word and document length counts of a corpus. Statistics of
+    shards counted in worker processes, or of separate crawl runs saved with
+    :method: save, are combined with :method: merge.
+    
+    Exact statistics keep a Counter of every word. Sketched statistics (exact=False) 
+    use bounded memory whatever the vocabulary: the number of unique words is 
+    estimated with a :class:sketches.HyperLogLog sketch, and the frequencies of 
+    the max_words most frequent words (the head of the Zipf ranking) with a 
+    :class:sketches.SpaceSaving heavy hitters sketch, tightened by a 
+    :class:sketches.CountMinSketch. Word and document counts and the document 
+    length distribution are always exact.
+    '''
+    exact=True
+    word_count=0
+    document_count=0
+    
+    def __init__(self,exact=True,max_words=100000,hll_precision=14,cm_width=1<<18,cm_depth=4):
+        '''Create empty CorpusStatistics
+        
+        Kwargs:
+            exact (bool): keep exact word counts (defaults to True)
+            max_words (int): number of most frequent words to keep when sketched
+                (defaults to 100000)
+            hll_precision (int): precision of the unique word sketch (defaults to 14)
+            cm_width (int): width of the word frequency sketch (defaults to 2**18)
+            cm_depth (int): depth of the word frequency sketch (defaults to 4)
+        '''
+        self.exact=exact
+        self.word_count=0
+        self.document_count=0
+        self.document_lengths=Counter()
+        if exact:
+            self.word_freq=Counter()
+        else:
+            self.heavy_hitters=sketches.SpaceSaving(max_words)
+            self.unique_words=sketches.HyperLogLog(hll_precision)
+            self.word_freq_sketch=sketches.CountMinSketch(cm_width,cm_depth)
+    
+    def add(self,words):
+        '''count a document
+        
+        Args:
+            words (list): the words of the document
+        '''
+        self.word_count+=len(words)
+        self.document_count+=1
+        self.document_lengths[len(words)]+=1
+        if self.exact:
+            self.word_freq.update(words)
+            return
+        counter=Counter(words)
+        hashes=[sketches.hash64(w) for w in counter]
+        self.unique_words.update_hashes(hashes)
+        self.word_freq_sketch.add_hashes(hashes,counter.values())
+        for w,f in counter.iteritems():
+            self.heavy_hitters.add(w,f)
+    
+    def merge(self,other):
+        '''merge in the statistics of another corpus (or shard of this one)
+        
+        Args:
+            other (CorpusStatistics): the other statistics, exact or sketched like these
+        '''
+        if other.exact!=self.exact:
+            raise ValueError('can only merge exact statistics with exact statistics')
+        self.word_count+=other.word_count
+        self.document_count+=other.document_count
+        self.document_lengths.update(other.document_lengths)
+        if self.exact:
+            self.word_freq.update(other.word_freq)
+        else:
+            self.heavy_hitters.merge(other.heavy_hitters)
+            self.unique_words.merge(other.unique_words)
+            self.word_freq_sketch.merge(other.word_freq_sketch)
+    
+    def empty_copy(self):
+        '''get empty statistics with the same settings, to count shards into
+        
+        Returns:
+            statistics (CorpusStatistics): the empty statistics
+        '''
+        if self.exact:
+            return CorpusStatistics()
+        statistics=CorpusStatistics(False,self.heavy_hitters.capacity,self.unique_words.precision,
+            self.word_freq_sketch.width,self.word_freq_sketch.depth)
+        return statistics
+    
+    @property
+    def unique_word_count(self):
+        '''number of unique words (an estimate when sketched)'''
+        if self.exact:
+            return len(self.word_freq)
+        return self.unique_words.count()
+    
+    def most_common(self,n=None):
+        '''get the most frequent words
+        
+        Kwargs:
+            n (int): number of words (defaults to None, every word counted, or 
+                max_words when sketched)
+        
+        Returns:
+            ranked_word_freq (list): list of (word, frequency) tuples, most 
+                frequent first. Frequencies are (over)estimates when sketched
+        '''
+        if self.exact:
+            return self.word_freq.most_common(n)
+        top=self.heavy_hitters.top(n)
+        estimates=self.word_freq_sketch.estimate([w for w,f in top])
+        #both sketches overestimate, so the smaller estimate is the better one
+        ranked_word_freq=[(w,min(f,int(e))) for (w,f),e in zip(top,estimates)]
+        ranked_word_freq.sort(key=lambda x:(-x[1],x[0]))
+        return ranked_word_freq
+
+class CorpusStatsAccumulator(pass_engine.Accumulator):
+    '''Counts the word frequencies and document lengths of a corpus into 
+    CorpusStatistics, in a :class:pass_engine.PassEngine pass 
+    (see :func:report_corpus_stats)
+    '''
+    name='statistics'
+    
+    def __init__(self,statistics=None):
+        '''Create a CorpusStatsAccumulator
+        
+        Kwargs:
+            statistics (CorpusStatistics): the statistics to add to (defaults to 
+                None, new exact statistics)
+        '''
+        if statistics is None:
+            statistics=CorpusStatistics()
+        self.statistics=statistics
+    
+    def add(self,record,words):
+        self.statistics.add(words)
+    
+    def result(self):
+        return self.statistics
+
+def _count_stats_shard(args):
+    '''count the statistics of one shard of a DocumentIter. Run in worker 
+    processes by :func:count_corpus_stats
+    
+    Args:
+        args (tuple): (doc_iter, index, n_shards, statistics) the iterator (set to 
+            the 'SIMPLE' iter_type), the shard to count and the empty statistics 
+            to count it into
+    
+    Returns:
+        statistics (CorpusStatistics): the statistics of the shard
+    '''
+    doc_iter,index,n_shards,statistics=args
+    doc_iter.stats=IterStats(verbose=False)
+    for words in doc_iter.shard(index,n_shards):
+        statistics.add(words)
+    docIterators.flush_sanitiser(getattr(doc_iter,'sanitiser',None))
+    return statistics
+
+def count_corpus_stats(doc_iter,statistics=None,processes=1):
+    '''count the word frequencies and document lengths of a collection of documents
+    
+    Args:
+        doc_iter (docIterator) : an iterator that streams the corpus documents
+    
+    Kwargs:
+        statistics (CorpusStatistics): the statistics to add the counts to. Defaults 
+            to None, new exact statistics
+        processes (int): number of worker processes (defaults to 1). Iterators 
+            that can seek to record positions are split into shards counted in 
+            parallel and merged, others are counted in this process
+    
+    Returns:
+        statistics (CorpusStatistics): the statistics
+    '''
+    if statistics is None:
+        statistics=CorpusStatistics()
+    if processes>1 and docIterators.can_seek(doc_iter):
+        shard_iter=copy.copy(doc_iter)
+        shard_iter.iter_type='SIMPLE'
+        shard_iter.stats=None #IterStats callbacks may not pickle
+        tasks=[(shard_iter,i,processes,statistics.empty_copy()) for i in range(processes)]
+        pool=multiprocessing.Pool(processes)
+        try:
+            for shard_statistics in pool.imap(_count_stats_shard,tasks):
+                statistics.merge(shard_statistics)
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        engine=pass_engine.PassEngine(doc_iter,[CorpusStatsAccumulator(statistics)])
+        engine.run()
+    print('Generated Counting Stats')
+    return statistics
+
+def get_corpus_stats(doc_iter,outfile_name,statistics=None,processes=1,plot=True):
     '''get statistics about a collection of documents
     
     Args:
         doc_iter (docIterator) : an iterator that streams the corpus documents
         outfile_name (str): filename to save plots as
     
+    Kwargs:
+        statistics (CorpusStatistics): the (empty) statistics to count into, exact 
+            or sketched. Defaults to None, exact statistics
+        processes (int): number of worker processes to count with (defaults to 1)
+        plot (bool): whether to save the plots (defaults to True)
+    
+    Returns:
+        statistics (dict): dictionary with generated corpus statistics 
+        
+    Counts the corpus with :func:count_corpus_stats and reports the counts
+    with :func:report_corpus_stats
+    '''
+    corpus_statistics=count_corpus_stats(doc_iter,statistics,processes)
+    statistics=report_corpus_stats(corpus_statistics,outfile_name,plot)
+    return statistics
+
+def report_corpus_stats(corpus_statistics,outfile_name,plot=True):
+    '''report statistics about a collection of documents from its counts
+    
+    Args:
+        corpus_statistics (CorpusStatistics): counts of the corpus (see :func:count_corpus_stats)
+        outfile_name (str): filename to save plots as
+    
+    Kwargs:
+        plot (bool): whether to save the plots (defaults to True)
+    
     Returns:
         statistics (dict): dictionary with generated corpus statistics 
         
-    This function produces two plots, a zipfian plot and document word count distribution
+    This function produces two plots (unless plot is False), a zipfian plot and document word count distribution
     The function also produces a csv file of ziphian data
     The function also produces a csv file of document word count data
     The function also produces a text document with a statistics summary
     '''
-    #counting statistics
-    doc_iter.iter_type='SIMPLE'
-    word_freq = Counter()
-    word_count = 0
-    document_count = 0
-    unique_word_count=0
-    document_lengths = Counter()
-    for doc in doc_iter:
-        word_count+=len(doc)
-        document_count+=1
-        document_lengths.update([len(doc)])
-        upd = []
-        word_freq.update(doc)
-    unique_word_count=len(word_freq)
+    document_lengths=corpus_statistics.document_lengths
+    word_count=corpus_statistics.word_count
+    document_count=corpus_statistics.document_count
+    unique_word_count=corpus_statistics.unique_word_count
     mean_doc_length = float(word_count)/float(document_count)
     mode_doc_length = document_lengths.most_common(1)[0]
-    print('Generated Counting Stats')
     
     #generating and plotting zipfian statistics 
-    ranked_word_freq = word_freq.most_common()
-    zipfian_table = []
-    for rank in range(unique_word_count):
-        w = ranked_word_freq[rank][0]
-        f = ranked_word_freq[rank][1]
-        log_r = math.log(rank+1,10)
-        log_f = math.log(f,10)
-        zipfian_table.append((w,r,log_r,f,log_f))
+    table = zipf_table(corpus_statistics.most_common())
     print('Generated Ziphian Data')
-    log_freqs = list(zip(*zt)[4])
-    plot_zipfian(log_freqs,outfile+'_zipfian_plot.png')
-    #plotting document lengths
-    doc_lens = counter.keys()
-    doc_len_freqs=counter.values()
-    plot_doc_lenth_distro(doc_lens,doc_len_freqs,outfile_name+'_document_word_lengths.png')
+    if plot:
+        z_grad,z_c=plot_zipfian(table['log_freqs'],outfile_name+'_zipfian_plot.png',table['log_ranks'])
+        #plotting document lengths
+        doc_lens = document_lengths.keys()
+        doc_len_freqs=document_lengths.values()
+        plot_doc_length_distro(doc_lens,doc_len_freqs,outfile_name+'_document_word_lengths.png')
+    else:
+        z_grad,z_c=fit_zipfian(table['log_freqs'],table['log_ranks'])
     #write zipfian data to disk
     with open(outfile_name+'_zipfian_data.csv', 'wb') as csvfile:
         writer = csv.writer(csvfile, delimiter=',',quotechar='|', quoting=csv.QUOTE_MINIMAL)
         writer.writerow(['word','rank','log rank','freqency','log_frequncy'])
-        writer.writerows(zipfian_table)
+        writer.writerows(zip([w.encode('utf8') for w in table['words']],table['ranks'].tolist(),
+            table['log_ranks'].tolist(),table['freqs'].tolist(),table['log_freqs'].tolist()))
     print('Writen Ziphian Data To file')
     #write document data to disk
     with open(outfile_name+'_document_lengths.csv', 'wb') as csvfile:
@@ -141,8 +412,8 @@ def get_corpus_stats(doc_iter,outfile_name):
         f.write('Ziphian gradient : '+str(z_grad)+'\n')
         f.write('Ziphian intercept : '+str(z_c)+'\n')
         f.write('most_frequent 10 words : '+'\n')
-        for w in zipfian_table[0:10]:
-            f.write('"'+w[0]+'" : '+str(w[3])+' occurances\n')
+        for w,freq in zip(table['words'][:10],table['freqs'][:10].tolist()):
+            f.write(('"'+w+'" : '+str(freq)+' occurances\n').encode('utf8'))
     print('Written stats report to file')
     #create statistics summary dictionary to return
     statistics={'word_count':word_count,
@@ -150,9 +421,7 @@ def get_corpus_stats(doc_iter,outfile_name):
         'document_count':document_count,
         'mean_doc_length':mean_doc_length,
         'mode_doc_length':mode_doc_length[0],
-        '10_most_common_words':list(zip(*zipfian_table[:10])[0])}
+        'zipfian_gradient':z_grad,
+        'zipfian_intercept':z_c,
+        '10_most_common_words':table['words'][:10]}
     return statistics
-        
-        
-        
-    
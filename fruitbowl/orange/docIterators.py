@@ -8,23 +8,197 @@
 '''
 from abc import ABCMeta, abstractmethod,abstractproperty
 import codecs
+import copy
+import cPickle
+import hashlib
+import itertools
 import json
+import multiprocessing
+import os
+import Queue
 import sys
+import tempfile
+import threading
+import time
+import bson.json_util
 import pymongo
 from pymongo import MongoClient
+import fruitbowl.cherry.fake_mongo
 import fruitbowl.strawberry.sanitisers
 import gensim
+import numpy as np
+import line_index
+from iter_stats import IterStats, progress
 
-def progress(ind,size):
-    '''Prints a Progress Bar for a Document Iterator to the command line
+def parse_json_line(line):
+    '''Decode one line of a json list file (one record per line)
+
+    Args:
+        line (unicode): raw line from the json list file
+
+    Returns:
+        record (dict): the decoded record
+    '''
+    if line[0]=='[':#first line in file
+        line=line[1:].strip(',')
+    if line[-1]==']':#last line in file
+        line=line[:-1]
+    else:
+        line=line[:-1].strip(',')#remove ending comma
+    record = json.loads(line)
+    return record
+
+def line_doi(line):
+    '''get the doi of the record on a line of a json list file
+
+    Args:
+        line (unicode): raw line from the json list file
+
+    Returns:
+        doi (str): the doi of the record
+    '''
+    doi=parse_json_line(line)['doi']
+    return doi
+    
+def save_watermark(watermark,file_name):
+    '''save a watermark (see JsonDiskIter.watermark and MongoIter.watermark) to disk
+    
+    Args:
+        watermark (dict): the watermark
+        file_name (str): name of the json file to write
+    '''
+    with codecs.open(file_name,'w',encoding='utf8') as f:
+        f.write(bson.json_util.dumps(watermark))
+
+def load_watermark(file_name):
+    '''load a watermark saved by :func:save_watermark
+    
+    Args:
+        file_name (str): name of the json file to read
+    
+    Returns:
+        watermark (dict): the watermark
+    '''
+    with codecs.open(file_name,'r',encoding='utf8') as f:
+        watermark=bson.json_util.loads(f.read())
+    return watermark
+
+MULTI_EXPORT_ITER_TYPES=('SENTENCES','LABELED_SENTENCES')
+
+TEXT_ITER_TYPES=('DOC','SIMPLE','SENTENCES','DOI','LABELED_SENTENCES','EVERYTHING')
+
+def record_doc(record,sanitiser,iter_type):
+    '''get the document of a record from a json or MongoDB data source as a list of
+    sentences, building and sanitising it from the title and abstract if needed
+    
+    Args:
+        record (dict): a decoded record from the data source
+        sanitiser (Stawberry.sanitiser.Sanitiser): the sanitiser used to build 
+            the 'doc' field if the record does not have one
+        iter_type (str): string specifying return type
+    
+    Returns:
+        doc (list): [[w,w...][w,w...],...] sentences of the record, None if
+            iter_type does not need the text
+    '''
+    if iter_type not in TEXT_ITER_TYPES:#skip building and sanitising the text
+        doc=None
+    elif record.has_key('doc'):#already has a doc field
+        doc=record['doc']
+    else: #create doc field
+        title = record['title']
+        abstract_sents = record['abstract'].split('. ')
+        doc =[]
+        doc.append(sanitiser.cached_sanitise(title).split())
+        for sent in abstract_sents:
+            doc.append(sanitiser.cached_sanitise(sent).split())
+    return doc
+
+def record_exports(record,doc,iter_type):
+    '''convert a record from a json or MongoDB data source into the export(s) for an iter_type
     
     Args:
-        ind (int): the index of the current record
-        size (int): the maximum possible record
+        record (dict): a decoded record from the data source
+        doc (list): the document of the record (see :func:record_doc)
+        iter_type (str): string specifying return type
+    
+    Yields:
+        export (list or dict): the record to return (dependent on iter_type)
     '''
-    percent = int(100*float(ind)/size)
-    sys.stdout.write('\r[{0}{1}] {2}% {3}'.format('#'*(percent/10),' '*(10-percent/10), percent, ind))
-    sys.stdout.flush()
+    doi=record['doi']
+    #yield result based on iter_type
+    if iter_type=='DOC':
+        export=doc
+        yield export
+    elif iter_type=='SIMPLE': 
+        export = [word for sent in doc for word in sent]
+        yield export
+    elif iter_type=='SENTENCES':
+        for sent in doc:
+            export=sent
+            yield export
+    elif iter_type=='DOI':
+        yield {'doi':record['doi'],'doc':doc}
+    elif iter_type=='LABELED_SENTENCES':
+        for sent in doc:
+            export = gensim.models.doc2vec.LabeledSentence(sent,tags=[doi])
+            yield export
+    elif iter_type=='VECTORS':
+        export= {'doi':record['doi'],'vectors':record['vectors']}
+        yield export
+    elif iter_type=='DOIS':
+        yield doi
+    elif iter_type=='EVERYTHING':
+        record['doc']=doc
+        export=record
+        yield export
+    else:
+        pass
+
+def flush_sanitiser(sanitiser):
+    '''write the pending entries of a sanitiser's cache to disk. Worker processes
+    call this at the end of each shard, as their copy of the cache is discarded
+    with the task
+    
+    Args:
+        sanitiser (Stawberry.sanitiser.Sanitiser): the sanitiser (or None)
+    '''
+    if sanitiser is not None and hasattr(sanitiser,'flush_cache'):
+        sanitiser.flush_cache()
+
+def _decode_shard(args):
+    '''decode and sanitise the records in one byte range shard of a json list file.
+    Run in worker processes by JsonDiskIter.
+    
+    Args:
+        args (tuple): (source (str), start (int), end (int), blocks (numpy.2darray),
+            sanitiser (Stawberry.sanitiser.Sanitiser), iter_type (str))
+    
+    Returns:
+        n_records (int): number of records in the shard
+        n_bytes (int): number of bytes in the shard
+        times (dict): seconds spent reading, decoding and sanitising the shard
+        exports (list): the exports of every record in the shard
+    '''
+    source,start,end,blocks,sanitiser,iter_type=args
+    exports=[]
+    n_records=0
+    times={'read':0.,'decode':0.,'sanitise':0.}
+    t=time.time()
+    for line in line_index.iter_byte_range(source,start,end,blocks,decode=False):
+        t1=time.time()
+        record=parse_json_line(line.decode('utf8'))
+        t2=time.time()
+        doc=record_doc(record,sanitiser,iter_type)
+        t3=time.time()
+        times['read']+=t1-t
+        times['decode']+=t2-t1
+        times['sanitise']+=t3-t2
+        exports.extend(record_exports(record,doc,iter_type))
+        n_records+=1
+        t=time.time()
+    flush_sanitiser(sanitiser)
+    return n_records,end-start,times,exports
     
 class DocumentIter(object):
     '''Abstract class for all DocumentIter objects to implement
@@ -56,6 +230,103 @@ class DocumentIter(object):
         '''The format to yield the records as''' 
         return 'SIMPLE'
     
+    stats=None
+    
+    def get_stats(self):
+        '''get the IterStats object the iterator reports its throughput and timings to.
+        A verbose IterStats (printing a progress bar) is created on first use; set
+        the stats attribute to an IterStats of your own to silence or customise it.
+        
+        Returns:
+            stats (orange.iter_stats.IterStats): statistics of the latest pass
+        '''
+        if self.stats is None:
+            self.stats=IterStats()
+        return self.stats
+    
+    def filter(self,pred=None,query=None):
+        '''lazily restrict the iterator to the records that pass a test
+        
+        Kwargs:
+            pred (function): function taking an export and returning True to keep it
+            query (dict): MongoDB style query the exports must match (dict iter_types
+                such as 'DOI' and 'EVERYTHING' only). Pushed down into the database
+                by MongoIter
+        
+        Returns:
+            filtered (DocumentIter): iterator over the exports that pass
+        '''
+        if pred is None and query is None:
+            raise ValueError('filter needs a predicate or a query')
+        if query is not None:
+            test=pred
+            match=fruitbowl.cherry.fake_mongo.match
+            pred=lambda export: match(export,query) and (test is None or test(export))
+        filtered=FilterIter(self,pred)
+        return filtered
+    
+    def map(self,func):
+        '''lazily apply a function to every export
+        
+        Args:
+            func (function): function taking an export and returning the new export
+        
+        Returns:
+            mapped (DocumentIter): iterator over the results of func
+        '''
+        mapped=MapIter(self,func)
+        return mapped
+    
+    def take(self,n):
+        '''lazily restrict the iterator to its first n exports
+        
+        Args:
+            n (int): number of exports to keep
+        
+        Returns:
+            taken (DocumentIter): iterator over the first n exports
+        '''
+        taken=SliceIter(self,0,n)
+        return taken
+    
+    def skip(self,n):
+        '''lazily drop the first n exports of the iterator
+        
+        Args:
+            n (int): number of exports to drop
+        
+        Returns:
+            skipped (DocumentIter): iterator over the exports after the first n
+        '''
+        skipped=SliceIter(self,n)
+        return skipped
+    
+    def shard(self,index,n_shards):
+        '''lazily restrict the iterator to one of n_shards disjoint parts, e.g.
+        for one of several worker processes
+        
+        Args:
+            index (int): the shard to keep (0<=index<n_shards)
+            n_shards (int): the number of shards
+        
+        Returns:
+            sharded (DocumentIter): iterator over the records of the shard
+        '''
+        sharded=ShardIter(self,index,n_shards)
+        return sharded
+    
+    def batch(self,batch_size):
+        '''lazily group the exports into lists
+        
+        Args:
+            batch_size (int): number of exports per list (the last list may be shorter)
+        
+        Returns:
+            batched (DocumentIter): iterator over lists of exports
+        '''
+        batched=BatchIter(self,batch_size)
+        return batched
+    
 class SimpleDiskIter(DocumentIter):
     '''Implements DocumentIter for file on disk, each line containing a document of words
     
@@ -66,26 +337,35 @@ class SimpleDiskIter(DocumentIter):
     source=''
     sanitiser=None
     iter_type='SIMPLE'
+    index=None
 
-    def __init__(self,txf,sanit=None):
+    def __init__(self,txf,sanit=None,use_index=True):
         '''Build a SimpleDiskIter
         
         Args:
-            txf (str): the text file data source
+            txf (str): the text file data source. Files ending .gz or .zst
+                are decompressed as they are streamed
             
         Kwargs:    
             sanit (Stawberry.sanitiser.Sanitiser): The sanitiser to use in streaming 
                 from data source. (Defaults to None, and uses a NullSanitiser )
+            use_index (bool): load (or build once) a sidecar line index of txf,
+                giving the size and random access to records. Defaults to True.
+                If False, the file is scanned to count the records.
         '''
         self.source=txf
         if sanit:
             self.sanitiser=sanit
         else: #if no sanitiser specified, use a NullSanitiser
-            self.sanitiser=sanitisers.NullSanitiser()
-        ind=0
-        for line in codecs.open(txf,'r',encoding='utf8'):#count the number of records
-            ind+=1
-        self.size=ind
+            self.sanitiser=fruitbowl.strawberry.sanitisers.NullSanitiser()
+        if use_index:
+            self.index=line_index.LineIndex(txf)
+            self.size=self.index.size
+        else:
+            ind=0
+            for line in line_index.iter_lines(txf):#count the number of records
+                ind+=1
+            self.size=ind
 
     def __iter__(self):
         '''Iterate over the DocumentIterator
@@ -93,11 +373,74 @@ class SimpleDiskIter(DocumentIter):
         Yields:
             doc (list or dict): the record to return (list of words)  
         '''
-        for line in codecs.open(self.source,'r',encoding='utf8'):
-            if ind%1000==0:
-                progress(ind,self.size)
-            doc = self.sanitiser.sanitise(line).split()
+        for doc in self.iter_range(0):
+            yield doc
+
+    def iter_range(self,start,stop=None):
+        '''Iterate over the records between two positions in the data source
+
+        Args:
+            start (int): position of the first record to yield
+
+        Kwargs:
+            stop (int): position to stop before (defaults to None, the end of the data source)
+
+        Yields:
+            doc (list): the record to return (list of words)
+        '''
+        stats=self.get_stats()
+        stats.start((self.size if stop is None else min(stop,self.size))-start)
+        timing=stats.timing
+        t=time.time()
+        for raw in line_index.iter_lines(self.source,self.index,start,stop,decode=False):
+            if timing:
+                t1=time.time()
+                stats.add_time('read',t1-t)
+            line=raw.decode('utf8')
+            if timing:
+                t2=time.time()
+                stats.add_time('decode',t2-t1)
+            doc = self.sanitiser.cached_sanitise(line).split()
+            if timing:
+                stats.add_time('sanitise',time.time()-t2)
+            stats.tick(len(raw))
+            yield doc
+            t=time.time()
+        stats.finish()
+
+    def iter_positions(self,positions):
+        '''Iterate over the records at a sequence of positions, seeking straight
+        to each one with the line index
+
+        Args:
+            positions (list): positions of the records to yield (fastest sorted)
+
+        Yields:
+            doc (list): the record to return (list of words)
+        '''
+        if self.index is None:
+            self.index=line_index.LineIndex(self.source)
+        stats=self.get_stats()
+        stats.start(len(positions))
+        for line in self.index.iter_lines_at(positions,decode=False):
+            stats.tick(len(line))
+            doc = self.sanitiser.cached_sanitise(line.decode('utf8')).split()
             yield doc
+        stats.finish()
+
+    def get_record_at(self,pos):
+        '''get single record by its position in the data source
+
+        Args:
+            pos (int): position of the record
+
+        Returns:
+            doc (list): the record (list of words)
+        '''
+        if self.index is None:
+            self.index=line_index.LineIndex(self.source)
+        doc = self.sanitiser.cached_sanitise(self.index.read_line(pos)).split()
+        return doc
             
 class JsonDiskIter(DocumentIter):
     '''Implements DocumentIter for a json file on disk containing a list of records.
@@ -110,23 +453,45 @@ class JsonDiskIter(DocumentIter):
             each sentence in each record
         'VECTORS': yields {'doi':doi,'vectors':vectors} for each record. Vectors
             is usually a dictionary of different vector representations.
+        'DOIS': yields doi for each record
         'EVERTYTHING': yields dict with everything found in the datasource per record
+    
+    Only the text iter_types build and sanitise the 'doc' of each record, 
+    'VECTORS' and 'DOIS' passes skip text processing.
     '''
     size=0
     source=''
     sanitiser=None
     iter_type='SIMPLE'
+    index=None
+    
+    processes=1
+    ordered=True
     
-    def __init__(self,txf,sanit=None,iter_type='SIMPLE'):
+    def __init__(self,txf,sanit=None,iter_type='SIMPLE',use_index=True,
+            processes=1,ordered=True,shard_bytes=1<<23):
         '''build a JsonDiskIter
         
         Args:
-            txf (str): the json list file data source
+            txf (str): the json list file data source. Files ending .gz or .zst
+                are decompressed as they are streamed
             
         Kwargs:
             sanit (Stawberry.sanitiser.Sanitiser): The sanitiser to use in streaming 
                 from data source. (Defaults to None, and uses a NullSanitiser)
             iter_type (str): defaults to 'SIMPLE', string specifying return type
+            use_index (bool): load (or build once) a sidecar index of line offsets
+                and dois for txf, giving the size, random access by position or doi 
+                and range iteration without scanning the file. Defaults to True.
+                If False, the file is scanned to count the records.
+            processes (int): number of worker processes to decode and sanitise
+                records with (defaults to 1, decoding in the consuming process).
+                With more than 1, the file is split into byte-range shards aligned
+                to line boundaries and each shard is handled by a process pool
+            ordered (bool): when using processes, yield records in file order
+                (defaults to True). If False, shards are yielded as they finish
+            shard_bytes (int): approximate size in bytes of each shard handed to
+                a worker process (defaults to 8MB)
             
         the textfile txf json list requires each entry to hav keys:
             1) 'doc' OR 'title' and 'abstract'
@@ -138,11 +503,18 @@ class JsonDiskIter(DocumentIter):
             self.sanitiser=sanit
         else: #if no sanitiser specified, use a NullSanitiser
             self.sanitiser=fruitbowl.strawberry.sanitisers.NullSanitiser()
-        ind=0
-        for line in codecs.open(txf,'r',encoding='utf8'): #count the number of records
-            ind+=1
-        self.size=ind
+        if use_index:
+            self.index=line_index.LineIndex(txf,doi_func=line_doi)
+            self.size=self.index.size
+        else:
+            ind=0
+            for line in line_index.iter_lines(txf): #count the number of records
+                ind+=1
+            self.size=ind
         self.iter_type=iter_type
+        self.processes=processes
+        self.ordered=ordered
+        self.shard_bytes=shard_bytes
         
     def __iter__(self):
         '''Iterate over the DocumentIterator
@@ -150,56 +522,181 @@ class JsonDiskIter(DocumentIter):
         Yields:
             export (list or dict): the record to return (dependent on iter_type) 
         '''
-        ind=0
-        for line in codecs.open(self.source,'r',encoding='utf8'):
-            if line[0]=='[':#first line in file
-                line=line[1:].strip(',')
-            if line[-1]==']':#last line in file
-                line=line[:-1]
+        if self.processes>1:
+            iterator=self._iter_parallel()
+        else:
+            iterator=self.iter_range(0,self.size)
+        for export in iterator:
+            yield export
+
+    def _iter_parallel(self):
+        '''Iterate over the DocumentIterator, decoding and sanitising shards
+        of the data source in a pool of worker processes
+        
+        Yields:
+            export (list or dict): the record to return (dependent on iter_type) 
+        '''
+        index=self.index
+        if index is None and line_index.codec_of(self.source) is not None:
+            index=self._get_index()#compressed sources need the block table to seek
+        if index is not None:
+            n_bytes=int(index.offsets[-1])
+            blocks=index.blocks
+        else:
+            n_bytes=os.path.getsize(self.source)
+            blocks=None
+        n_shards=max(self.processes,n_bytes//self.shard_bytes)
+        tasks=[(self.source,start,end,blocks,self.sanitiser,self.iter_type) 
+            for start,end in line_index.shard_ranges(self.source,n_shards,index)]
+        pool=multiprocessing.Pool(self.processes)
+        try:
+            if self.ordered:
+                results=pool.imap(_decode_shard,tasks)
             else:
-                line=line[:-1].strip(',')#remove ending comma
-            record = json.loads(line)
-            if record.has_key('doc'):#already has a doc field
-                doc=record['doc']
-            else: #create doc field
-                title = record['title']
-                abstract_sents = record['abstract'].split('. ')
-                doc =[]
-                doc.append(self.sanitiser.sanitise(title).split())
-                san_abs=[]
-                for sent in abstract_sents:
-                    doc.append(self.sanitiser.sanitise(sent).split())
-            ind+=1
-            doi=record['doi']
-            if ind%1000==0:
-                progress(ind,self.size)
-            #yield result based on iter_type
-            if self.iter_type=='DOC':
-                export=doc
-                yield export
-            elif self.iter_type=='SIMPLE': 
-                export = [word for sent in doc for word in sent]
-                yield export
-            elif self.iter_type=='SENTENCES':
-                for sent in doc:
-                    export=sent
-                    yield export
-            elif self.iter_type=='DOI':
-                yield {'doi':record['doi'],'doc':doc}
-            elif self.iter_type=='LABELED_SENTENCES':
-                for sent in doc:
-                    export = gensim.models.doc2vec.LabeledSentence(sent,tags=[doi])
+                results=pool.imap_unordered(_decode_shard,tasks)
+            stats=self.get_stats()
+            stats.start(self.size)
+            for n_records,n_bytes,times,exports in results:
+                for stage,seconds in times.items():
+                    stats.add_time(stage,seconds)
+                stats.tick(n_bytes,n_records)
+                for export in exports:
                     yield export
-            elif self.iter_type=='VECTORS':
-                export= {'doi':record['doi'],'vectors':record['vectors']}
+            pool.close()
+        finally:
+            pool.terminate()#also stops the workers if the consumer stops early
+            pool.join()
+        stats.finish()
+
+    def iter_range(self,start,stop=None):
+        '''Iterate over the records between two positions in the data source.
+        With an index, iteration seeks straight to start.
+
+        Args:
+            start (int): position of the first record to yield
+
+        Kwargs:
+            stop (int): position to stop before (defaults to None, the end of the data source)
+
+        Yields:
+            export (list or dict): the record to return (dependent on iter_type)
+        '''
+        if self.iter_type=='DOIS' and self.index is not None and len(self.index.dois)==self.size:
+            for doi in self.index.doi_list()[start:stop]:#no need to read the file
+                yield doi
+            return
+        stats=self.get_stats()
+        stats.start((self.size if stop is None else min(stop,self.size))-start)
+        timing=stats.timing
+        t=time.time()
+        for line in line_index.iter_lines(self.source,self.index,start,stop,decode=False):
+            if timing:
+                t1=time.time()
+                stats.add_time('read',t1-t)
+            record = parse_json_line(line.decode('utf8'))
+            if timing:
+                t2=time.time()
+                stats.add_time('decode',t2-t1)
+            doc=record_doc(record,self.sanitiser,self.iter_type)
+            if timing:
+                stats.add_time('sanitise',time.time()-t2)
+            stats.tick(len(line))
+            for export in record_exports(record,doc,self.iter_type):
                 yield export
-            elif self.iter_type=='EVERYTHING':
-                record['doc']=doc
-                export=record
+            t=time.time()
+        stats.finish()
+
+    def _get_index(self):
+        '''get the index of the data source, building it if use_index was False
+
+        Returns:
+            index (line_index.LineIndex): the line index of the data source
+        '''
+        if self.index is None:
+            self.index=line_index.LineIndex(self.source,doi_func=line_doi)
+        return self.index
+
+    def iter_positions(self,positions):
+        '''Iterate over the records at a sequence of positions, seeking straight
+        to each one with the line index
+
+        Args:
+            positions (list): positions of the records to yield (fastest sorted)
+
+        Yields:
+            export (list or dict): the record to return (dependent on iter_type)
+        '''
+        index=self._get_index()
+        stats=self.get_stats()
+        stats.start(len(positions))
+        for line in index.iter_lines_at(positions,decode=False):
+            stats.tick(len(line))
+            record = parse_json_line(line.decode('utf8'))
+            doc=record_doc(record,self.sanitiser,self.iter_type)
+            for export in record_exports(record,doc,self.iter_type):
                 yield export
-            else:
-                pass
-        print('\n')
+        stats.finish()
+
+    def watermark(self):
+        '''get a high-water mark of the records the iterator streams, to pass to
+        :method: since once more records have been appended to the data source
+        
+        Returns:
+            watermark (dict): {'records': number of records, 'offset': byte offset
+                of the last record, 'doi': doi of the last record}
+        '''
+        index=self._get_index()
+        n=self.size
+        watermark={'records':n,'offset':0,'doi':None}
+        if n:
+            watermark['offset']=int(index.offsets[n-1])
+            watermark['doi']=line_doi(index.read_line(n-1))
+        return watermark
+    
+    def since(self,watermark):
+        '''get an iterator over only the records appended to the data source since 
+        a watermark was taken. The line index (and size) of this iterator is 
+        brought up to date, scanning only the appended records
+        
+        Args:
+            watermark (dict): watermark from :method: watermark
+        
+        Returns:
+            delta (RangeIter): iterator over the new records
+        '''
+        self.index=line_index.LineIndex(self.source,doi_func=line_doi)
+        self.size=self.index.size
+        n=watermark['records']
+        if n>self.size or (n and line_doi(self.index.read_line(n-1))!=watermark['doi']):
+            raise ValueError(self.source+' has been rewritten since the watermark was taken')
+        delta=RangeIter(self,n,self.size)
+        return delta
+
+    def get_record_at(self,pos):
+        '''get single record by its position in the data source
+
+        Args:
+            pos (int): position of the record
+
+        Returns:
+            record (dict): the decoded record
+        '''
+        record = parse_json_line(self._get_index().read_line(pos))
+        return record
+
+    def get_record(self,doi):
+        '''get single record
+        Args:
+            doi (str): doi of record to return
+        
+        Returns:
+            export (dict): the decoded record of requested doi (None if not found)
+        '''
+        pos=self._get_index().position(doi)
+        if pos is None:
+            return None
+        export = self.get_record_at(pos)
+        return export
             
 class MemoryIter(DocumentIter):
     '''Implements DocumentIter for data store list in memory
@@ -213,7 +710,7 @@ class MemoryIter(DocumentIter):
     iter_type="SIMPLE"
     
     def __init__(self,source,sanit=None):
-         '''Build a MemoryIter
+        '''Build a MemoryIter
         
         Args:
             txf (str): the list in memory to iterate over
@@ -227,7 +724,7 @@ class MemoryIter(DocumentIter):
         if sanit:
             self.sanitiser=sanit
         else: 
-            self.sanitiser=sanitisers.NullSanitiser()
+            self.sanitiser=fruitbowl.strawberry.sanitisers.NullSanitiser()
         
     def __iter__(self):
         '''Iterate over the DocumentIterator
@@ -235,15 +732,36 @@ class MemoryIter(DocumentIter):
         Yields:
             export (list or dict): the record to return (dependent on iter_type) 
         '''
-        ind=0
+        stats=self.get_stats()
+        stats.start(self.size)
+        timing=stats.timing
         for record in self.source:
-            ind+=1
-            if ind%1000==0:
-                progress(ind,self.size)
-            export = [self.sanitiser(record).split()]
+            t=time.time()
+            export = [self.sanitiser.cached_sanitise(record).split()]
+            if timing:
+                stats.add_time('sanitise',time.time()-t)
+            stats.tick()
             yield export
-        print('\n')
+        stats.finish()
         
+def and_query(*queries):
+    '''combine MongoDB queries so records must match all of them
+    
+    Args:
+        queries (dict): the queries to combine (None queries are ignored)
+    
+    Returns:
+        query (dict): the combined query, None if there are no queries
+    '''
+    queries=[q for q in queries if q]
+    if not queries:
+        query=None
+    elif len(queries)==1:
+        query=queries[0]
+    else:
+        query={'$and':queries}
+    return query
+
 class MongoIter(DocumentIter):
     '''Implements DocumentIter for a MongoDB database collection.
     
@@ -255,18 +773,27 @@ class MongoIter(DocumentIter):
             each sentence in each record
         'VECTORS': yields {'doi':doi,'vectors':vectors} for each record. Vectors
             is usually a dictionary of different vector representations.
+        'DOIS': yields doi for each record
         'EVERTYTHING': yields dict with everything found in the datasource per record
+    
+    Only the text iter_types build and sanitise the 'doc' of each record, 
+    'VECTORS' and 'DOIS' passes skip text processing.
     '''
     size=0
     source=''
     sanitiser=None
     iter_type='SIMPLE'
+    batch_size=1000
+    preserve_order=True
     
-    def __init__(self,db_conn,query=None,sanit=None,iter_type='SIMPLE',from_list=None):
+    def __init__(self,db_conn,query=None,sanit=None,iter_type='SIMPLE',from_list=None,
+            batch_size=1000,preserve_order=True):
         '''build a MongoIter
         
         Args:
             db_conn (list): [mongourl (str),database_name(str),collection_name(str)]
+                or a collection object to use directly (e.g. a pymongo Collection
+                or a cherry.fake_mongo.FakeMongo)
             
         Kwargs:
             query (dict): MonogDB query (defaults to None, resulting in whole dataset
@@ -276,6 +803,11 @@ class MongoIter(DocumentIter):
             iter_type (str): defaults to 'SIMPLE', string specifying return type
             from_list (list): list of dois to stream data from (alternative to query)
                 defaults to None (query  keyword is used)
+            batch_size (int): number of dois from from_list fetched per '$in' query
+                (defaults to 1000)
+            preserve_order (bool): yield records in the order of from_list
+                (defaults to True). If False, records in each batch are yielded
+                in the order the database returns them
             
         the MongnoDb document must have fields:
             1) 'doc'
@@ -285,66 +817,149 @@ class MongoIter(DocumentIter):
         if sanit:
             self.sanitiser=sanit
         else:
-            self.sanitiser=sanitisers.NullSanitiser()
-        self.source=MongoClient(db_conn[0])[db_conn[1]][db_conn[2]]
+            self.sanitiser=fruitbowl.strawberry.sanitisers.NullSanitiser()
+        if isinstance(db_conn,(list,tuple)):
+            self.source=MongoClient(db_conn[0])[db_conn[1]][db_conn[2]]
+        else:
+            self.source=db_conn
         self.query=query
-        self.size=self.source.find(query).count()
+        if from_list is None:
+            self.size=self.source.find(query).count()
+        else:
+            self.size=len(from_list)
         self.iter_type=iter_type
         self.from_list=from_list
-    
-    def __iter__(self):
-        ind=0
+        self.batch_size=batch_size
+        self.preserve_order=preserve_order
+
+    def projection(self):
+        '''get the fields to fetch from the database for the current iter_type
+
+        Returns:
+            fields (dict): MongoDB projection, None if whole documents are needed
+        '''
+        if self.iter_type=='VECTORS':
+            fields={'doi':1,'vectors':1}
+        elif self.iter_type=='DOIS':
+            fields={'doi':1}
+        elif self.iter_type=='EVERYTHING':
+            fields=None
+        else:#text iter_types
+            fields={'doi':1,'doc':1}
+        return fields
+
+    def _iter_records(self):
+        '''stream the records from the database, batching from_list lookups
+        into '$in' queries
+
+        Yields:
+            record (dict): mongodb document, restricted to the projection fields
+        '''
+        fields=self.projection()
         if self.from_list is None: #use query
-            for record in self.source.find(self.query):
-                doc = record['doc']
-                doi = record['doi']
-                ind+=1
-                if ind%1000==0:
-                    progress(ind,self.size)
-                if self.iter_type=='DOC':
-                    yield doc
-                elif self.iter_type=='SIMPLE': 
-                    yield [word for sent in doc for word in sent]
-                elif self.iter_type=='SENTENCES':
-                    for sent in doc:
-                        yield sent
-                elif self.iter_type=='DOI':
-                    yield {'doi':record['doi'],'doc':doc}
-                elif self.iter_type=='LABELED_SENTENCES':
-                    for sent in doc:
-                        yield gensim.models.doc2vec.LabeledSentence(sent,tags=[doi])
-                elif self.iter_type=='VECTORS':
-                    yield {'doi':doi,'vectors':record['vectors']}
-                else:
-                    pass
+            for record in self.source.find(self.query,fields):
+                yield record
         else: #use list of requested dois
-            for doi in self.from_list:
-                record=self.source.find_one({'doi':doi})
-                if record is not None:
-					doc=record['doc']
-					ind+=1
-					if ind%10==0:
-						progress(ind,len(self.from_list))
-					if self.iter_type=='DOC':
-						yield doc
-					elif self.iter_type=='SIMPLE': 
-						yield [word for sent in doc for word in sent]
-					elif self.iter_type=='SENTENCES':
-						for sent in doc:
-							yield sent
-					elif self.iter_type=='DOI':
-						yield {'doi':record['doi'],'doc':doc}
-					elif self.iter_type=='LABELED_SENTENCES':
-						for sent in doc:
-							yield gensim.models.doc2vec.LabeledSentence(sent,tags=[doi])
-					elif self.iter_type=='VECTORS':
-						yield {'doi':doi,'vectors':record['vectors']}
-					elif self.iter_type=='EVERYTHING':
-					    yield record
-					else:
-						pass
-        print('\n')
+            for i in xrange(0,len(self.from_list),self.batch_size):
+                batch=self.from_list[i:i+self.batch_size]
+                cursor=self.source.find(and_query(self.query,{'doi':{'$in':batch}}),fields)
+                if self.preserve_order:
+                    found={record['doi']:record for record in cursor}
+                    for doi in batch:
+                        if doi in found:
+                            yield found[doi]
+                else:
+                    for record in cursor:
+                        yield record
+    
+    def __iter__(self):
+        '''Iterate over the DocumentIterator
+        
+        Yields:
+            export (list or dict): the record to return (dependent on iter_type) 
+        '''
+        stats=self.get_stats()
+        stats.start(self.size)
+        timing=stats.timing
+        records=self._iter_records()
+        while True:
+            t=time.time()
+            try:
+                record=next(records)#waiting on the cursor is counted as read time
+            except StopIteration:
+                break
+            if timing:
+                t1=time.time()
+                stats.add_time('read',t1-t)
+            doc=record_doc(record,self.sanitiser,self.iter_type)
+            if timing:
+                stats.add_time('sanitise',time.time()-t1)
+            stats.tick()
+            for export in record_exports(record,doc,self.iter_type):
+                yield export
+        stats.finish()
 
+    def watermark(self):
+        '''get a high-water mark of the records the iterator streams (the highest
+        '_id'), to pass to :method: since once more records have been inserted
+        
+        Returns:
+            watermark (dict): {'_id': highest _id matching the query, None if none}
+        '''
+        last=self.source.find_one(self.query,{'_id':1},sort=[('_id',-1)])
+        watermark={'_id':last.get('_id') if last else None}
+        return watermark
+    
+    def since(self,watermark):
+        '''get an iterator over only the records inserted since a watermark was
+        taken, up to the current watermark (MongoDB ObjectIds increase with 
+        insertion time)
+        
+        Args:
+            watermark (dict): watermark from :method: watermark
+        
+        Returns:
+            delta (MongoIter): iterator over the new records
+        '''
+        current=self.watermark()['_id']
+        if current is None:
+            bounds={'$in':[]}
+        else:
+            bounds={'$lte':current}
+            if watermark['_id'] is not None:
+                bounds['$gt']=watermark['_id']
+        delta=self.filter(query={'_id':bounds})
+        return delta
+    
+    def doi_list(self):
+        '''get the dois of the records the iterator streams, in order
+        
+        Returns:
+            dois (list): list of dois
+        '''
+        if self.from_list is not None:
+            return list(self.from_list)
+        dois=[record['doi'] for record in self.source.find(self.query,{'doi':1})]
+        return dois
+    
+    def iter_positions(self,positions):
+        '''Iterate over the records at a sequence of positions, fetching only
+        those records from the database
+        
+        Args:
+            positions (list): positions of the records to yield
+        
+        Yields:
+            export (list or dict): the record to return (dependent on iter_type)
+        '''
+        dois=self.doi_list()
+        picked=copy.copy(self)
+        picked.from_list=[dois[pos] for pos in positions]
+        picked.size=len(picked.from_list)
+        picked.preserve_order=True
+        for export in picked:
+            yield export
+    
     def get_record(self,doi):
         '''get single record
         Args:
@@ -354,4 +969,896 @@ class MongoIter(DocumentIter):
             export (dict): mongodb document of requested doi
         '''
         export= self.source.find_one({'doi':doi})  
-        return export
\ No newline at end of file
+        return export
+    
+    def filter(self,pred=None,query=None):
+        '''lazily restrict the iterator to the records that pass a test. A query is
+        added to the MongoIter's own query so the database does the filtering
+        
+        Kwargs:
+            pred (function): function taking an export and returning True to keep it
+            query (dict): MongoDB query the records must match
+        
+        Returns:
+            filtered (DocumentIter): iterator over the exports that pass
+        '''
+        if query is None:
+            return DocumentIter.filter(self,pred)
+        filtered=copy.copy(self)
+        filtered.query=and_query(self.query,query)
+        if self.from_list is None:
+            filtered.size=filtered.source.find(filtered.query).count()
+        else:
+            filtered.size=filtered.source.find(and_query(filtered.query,
+                {'doi':{'$in':self.from_list}})).count()
+        if pred is not None:
+            filtered=FilterIter(filtered,pred)
+        return filtered
+
+def compile_corpus(doc_iter,dictionary,file_stub,buffer_size=1000000):
+    '''Compile the documents streamed by a DocumentIter into the binary format
+    read by CompiledIter, so later passes need no decoding or sanitising.
+    
+    Args:
+        doc_iter (DocumentIter): iterator supporting the 'DOI' iter_type 
+            (JsonDiskIter, MongoIter or CompiledIter)
+        dictionary (gensim.corpora.Dictionary): dictionary used to map words to
+            token ids, usually Corpus.dictionary. Words not in the dictionary are dropped
+        file_stub (str): stub of the file names to write
+    
+    Kwargs:
+        buffer_size (int): number of token ids to buffer before writing to disk
+            (defaults to 1000000)
+    
+    Produces the files:
+        file_stub+'_tokens.bin': flat int32 array of the token ids of every sentence
+        file_stub+'_sents.bin': int64 array of sentence start offsets into the tokens
+        file_stub+'_docs.bin': int64 array of document start offsets into the sentences
+        file_stub+'.dict': the dictionary
+        file_stub+'.json': header with the array lengths and the doi table
+    '''
+    print('Compiling corpus to '+file_stub)
+    token2id=dictionary.token2id
+    iter_type=doc_iter.iter_type
+    doc_iter.iter_type='DOI'
+    dois=[]
+    n_tokens=0
+    n_sents=0
+    tok_buf=[]
+    sent_buf=[0]
+    doc_buf=[0]
+    try:
+        with open(file_stub+'_tokens.bin','wb') as tf, \
+                open(file_stub+'_sents.bin','wb') as sf, \
+                open(file_stub+'_docs.bin','wb') as df:
+            for rec in doc_iter:
+                for sent in rec['doc']:
+                    ids=[token2id[w] for w in sent if w in token2id]
+                    tok_buf.extend(ids)
+                    n_tokens+=len(ids)
+                    n_sents+=1
+                    sent_buf.append(n_tokens)
+                doc_buf.append(n_sents)
+                dois.append(rec['doi'])
+                if len(tok_buf)>=buffer_size:#flush buffers to disk
+                    np.array(tok_buf,dtype=np.int32).tofile(tf)
+                    np.array(sent_buf,dtype=np.int64).tofile(sf)
+                    np.array(doc_buf,dtype=np.int64).tofile(df)
+                    tok_buf,sent_buf,doc_buf=[],[],[]
+            np.array(tok_buf,dtype=np.int32).tofile(tf)
+            np.array(sent_buf,dtype=np.int64).tofile(sf)
+            np.array(doc_buf,dtype=np.int64).tofile(df)
+    finally:
+        doc_iter.iter_type=iter_type
+    dictionary.save(file_stub+'.dict')
+    header={'n_tokens':n_tokens,'n_sents':n_sents,'n_docs':len(dois),'dois':dois}
+    with codecs.open(file_stub+'.json','w',encoding='utf8') as f:
+        json.dump(header,f)
+    print('Compiled '+str(len(dois))+' documents')
+
+class CompiledIter(DocumentIter):
+    '''Implements DocumentIter for a corpus compiled to disk by :func:compile_corpus.
+    The token id arrays are memory mapped, so passes over the corpus do no parsing
+    or sanitising.
+    
+    Implemented iter_types:
+        'SIMPLE': yields [word, word, word...] for each record
+        'SENTENCES': yields [word, word,...] for each sentence in each record
+        'DOI': yields {'doi':doi,'doc':[[w,w...][w,w...],...]} for each record
+        'LABELED_SENTENCES': yields a gensim.models.doc2vec.LabeledSentence for
+            each sentence in each record
+    '''
+    size=0
+    source=''
+    sanitiser=None
+    iter_type='SIMPLE'
+    
+    def __init__(self,file_stub,iter_type='SIMPLE',dictionary=None):
+        '''build a CompiledIter
+        
+        Args:
+            file_stub (str): the file stub the corpus was compiled to
+        
+        Kwargs:
+            iter_type (str): defaults to 'SIMPLE', string specifying return type
+            dictionary (gensim.corpora.Dictionary): dictionary the corpus was compiled
+                with. Defaults to None, loading the dictionary saved alongside the corpus
+        '''
+        self.source=file_stub
+        self.sanitiser=fruitbowl.strawberry.sanitisers.NullSanitiser()#already sanitised
+        self.iter_type=iter_type
+        with codecs.open(file_stub+'.json','r',encoding='utf8') as f:
+            header=json.load(f)
+        self.dois=header['dois']
+        self.size=header['n_docs']
+        self.tokens=np.memmap(file_stub+'_tokens.bin',dtype=np.int32,mode='r',shape=(header['n_tokens'],)) if header['n_tokens'] else np.zeros(0,dtype=np.int32)
+        self.sent_offsets=np.memmap(file_stub+'_sents.bin',dtype=np.int64,mode='r',shape=(header['n_sents']+1,))
+        self.doc_offsets=np.memmap(file_stub+'_docs.bin',dtype=np.int64,mode='r',shape=(header['n_docs']+1,))
+        if dictionary is None:
+            dictionary=gensim.corpora.Dictionary.load(file_stub+'.dict')
+        self.dictionary=dictionary
+        self.vocab=[None]*(max(dictionary.token2id.values())+1 if len(dictionary) else 0)
+        for w,i in dictionary.token2id.iteritems():#id -> word lookup table
+            self.vocab[i]=w
+    
+    def get_doc(self,pos):
+        '''get the sentences of a single document by position
+        
+        Args:
+            pos (int): position of the document in the corpus
+        
+        Returns:
+            doc (list): [[w,w...][w,w...],...] sentences of the document
+        '''
+        vocab=self.vocab
+        s_start,s_end=self.doc_offsets[pos],self.doc_offsets[pos+1]
+        bounds=self.sent_offsets[s_start:s_end+1].tolist()
+        toks=self.tokens[bounds[0]:bounds[-1]].tolist()
+        base=bounds[0]
+        doc=[[vocab[t] for t in toks[bounds[i]-base:bounds[i+1]-base]] for i in range(len(bounds)-1)]
+        return doc
+    
+    def __iter__(self):
+        '''Iterate over the DocumentIterator
+        
+        Yields:
+            export (list or dict): the record to return (dependent on iter_type) 
+        '''
+        for export in self.iter_range(0):
+            yield export
+    
+    def iter_range(self,start,stop=None):
+        '''Iterate over the records between two positions in the corpus
+        
+        Args:
+            start (int): position of the first record to yield
+        
+        Kwargs:
+            stop (int): position to stop before (defaults to None, the end of the corpus)
+        
+        Yields:
+            export (list or dict): the record to return (dependent on iter_type)
+        '''
+        stop=self.size if stop is None else min(stop,self.size)
+        for export in self.iter_positions(xrange(start,stop)):
+            yield export
+    
+    def iter_positions(self,positions):
+        '''Iterate over the records at a sequence of positions
+        
+        Args:
+            positions (list): positions of the records to yield
+        
+        Yields:
+            export (list or dict): the record to return (dependent on iter_type)
+        '''
+        stats=self.get_stats()
+        stats.start(len(positions))
+        timing=stats.timing
+        for ind in positions:
+            t=time.time()
+            doc=self.get_doc(ind)
+            if timing:
+                stats.add_time('read',time.time()-t)
+            doi=self.dois[ind]
+            stats.tick(4*int(self.sent_offsets[self.doc_offsets[ind+1]]-self.sent_offsets[self.doc_offsets[ind]]))
+            if self.iter_type=='DOC':
+                yield doc
+            elif self.iter_type=='SIMPLE':
+                yield [word for sent in doc for word in sent]
+            elif self.iter_type=='SENTENCES':
+                for sent in doc:
+                    yield sent
+            elif self.iter_type=='DOI':
+                yield {'doi':doi,'doc':doc}
+            elif self.iter_type=='LABELED_SENTENCES':
+                for sent in doc:
+                    yield gensim.models.doc2vec.LabeledSentence(sent,tags=[doi])
+            else:
+                pass
+        stats.finish()
+
+class WrapperIter(DocumentIter):
+    '''Base class for DocumentIters that wrap another DocumentIter.
+    
+    source, size, sanitiser and iter_type are those of the wrapped iterator
+    (setting iter_type sets it on the wrapped iterator), and any other attribute,
+    such as get_record, is looked up on the wrapped iterator.
+    '''
+    doc_iter=None
+    
+    @property
+    def source(self):
+        '''The data source of the wrapped iterator'''
+        return self.doc_iter.source
+    
+    @property
+    def size(self):
+        '''Number of records in the wrapped iterator'''
+        return self.doc_iter.size
+    
+    @property
+    def sanitiser(self):
+        '''The sanitiser of the wrapped iterator'''
+        return self.doc_iter.sanitiser
+    
+    @property
+    def iter_type(self):
+        '''The iter_type of the wrapped iterator'''
+        return self.doc_iter.iter_type
+    
+    @iter_type.setter
+    def iter_type(self,value):
+        self.doc_iter.iter_type=value
+    
+    def __getattr__(self,name):
+        if name=='doc_iter':
+            raise AttributeError(name)
+        return getattr(self.doc_iter,name)
+    
+    @abstractmethod
+    def __iter__():
+        '''yield the records one-by-one'''
+        yield None
+
+def _n_exports(doc_iter):
+    '''get the number of exports an iterator yields, if it can be known without a pass
+    
+    Args:
+        doc_iter (DocumentIter): the iterator
+    
+    Returns:
+        n (int): number of exports, None if unknown
+    '''
+    if isinstance(doc_iter,PipelineIter) or doc_iter.iter_type not in MULTI_EXPORT_ITER_TYPES:
+        return doc_iter.size
+    return None
+
+def can_seek(doc_iter):
+    '''test whether an iterator can seek straight to record positions with
+    iter_range or iter_positions (wrappers such as CacheIter are excluded, as 
+    seeking would bypass them)
+    
+    Args:
+        doc_iter (DocumentIter): the iterator
+    
+    Returns:
+        seekable (bool): True if doc_iter.iter_range can be used
+    '''
+    seekable=not isinstance(doc_iter,WrapperIter) and hasattr(doc_iter,'iter_range')
+    return seekable
+
+def can_refresh(doc_iter):
+    '''test whether an iterator can stream the records added to its data source
+    since a watermark with watermark and since (pipeline operators such as 
+    filter and take are excluded, as since would bypass them)
+    
+    Args:
+        doc_iter (DocumentIter): the iterator
+    
+    Returns:
+        refreshable (bool): True if doc_iter.since can be used
+    '''
+    while isinstance(doc_iter,WrapperIter):
+        if isinstance(doc_iter,PipelineIter):
+            return False
+        doc_iter=doc_iter.doc_iter
+    refreshable=hasattr(doc_iter,'watermark') and hasattr(doc_iter,'since')
+    return refreshable
+
+class PipelineIter(WrapperIter):
+    '''Base class for the lazy operators returned by DocumentIter.filter, map, 
+    take, skip, shard and batch. The size of a PipelineIter is the number of 
+    exports it yields, or None if that cannot be known without a pass.
+    '''
+    
+    @property
+    def size(self):
+        '''Number of exports, None if unknown'''
+        return None
+
+class FilterIter(PipelineIter):
+    '''Yields the exports of a DocumentIter that pass a predicate (see DocumentIter.filter)'''
+    
+    def __init__(self,doc_iter,pred):
+        '''build a FilterIter
+        
+        Args:
+            doc_iter (DocumentIter): the iterator to filter
+            pred (function): function taking an export and returning True to keep it
+        '''
+        self.doc_iter=doc_iter
+        self.pred=pred
+    
+    def __iter__(self):
+        '''Iterate over the DocumentIterator
+        
+        Yields:
+            export (list or dict): the exports of doc_iter that pass pred
+        '''
+        pred=self.pred
+        for export in self.doc_iter:
+            if pred(export):
+                yield export
+
+class MapIter(PipelineIter):
+    '''Applies a function to the exports of a DocumentIter (see DocumentIter.map)'''
+    
+    def __init__(self,doc_iter,func):
+        '''build a MapIter
+        
+        Args:
+            doc_iter (DocumentIter): the iterator to map over
+            func (function): function taking an export and returning the new export
+        '''
+        self.doc_iter=doc_iter
+        self.func=func
+    
+    @property
+    def size(self):
+        '''Number of exports, None if unknown'''
+        return _n_exports(self.doc_iter)
+    
+    def __iter__(self):
+        '''Iterate over the DocumentIterator
+        
+        Yields:
+            export (object): func applied to each export of doc_iter
+        '''
+        func=self.func
+        for export in self.doc_iter:
+            yield func(export)
+
+class SliceIter(PipelineIter):
+    '''Yields a contiguous run of the exports of a DocumentIter (see DocumentIter.take 
+    and DocumentIter.skip). Iterators with one export per record and an 
+    iter_range method seek straight to the start rather than reading past it.
+    '''
+    
+    def __init__(self,doc_iter,start=0,stop=None):
+        '''build a SliceIter
+        
+        Args:
+            doc_iter (DocumentIter): the iterator to slice
+        
+        Kwargs:
+            start (int): number of exports to skip (defaults to 0)
+            stop (int): number of exports to stop after (defaults to None, all of them)
+        '''
+        self.doc_iter=doc_iter
+        self.start=start
+        self.stop=stop
+    
+    @property
+    def size(self):
+        '''Number of exports, None if unknown'''
+        n=_n_exports(self.doc_iter)
+        if n is None:
+            return None
+        if self.stop is not None:
+            n=min(n,self.stop)
+        return max(n-self.start,0)
+    
+    def take(self,n):
+        '''narrow the slice to its first n exports (see DocumentIter.take)'''
+        stop=self.start+n if self.stop is None else min(self.stop,self.start+n)
+        return SliceIter(self.doc_iter,self.start,stop)
+    
+    def skip(self,n):
+        '''drop the first n exports of the slice (see DocumentIter.skip)'''
+        return SliceIter(self.doc_iter,self.start+n,self.stop)
+    
+    def __iter__(self):
+        '''Iterate over the DocumentIterator
+        
+        Yields:
+            export (list or dict): the exports of doc_iter from start to stop
+        '''
+        if self.stop is not None and self.stop<=self.start:
+            return
+        if can_seek(self.doc_iter) and self.doc_iter.iter_type not in MULTI_EXPORT_ITER_TYPES:
+            exports=self.doc_iter.iter_range(self.start,self.stop)
+        else:
+            exports=itertools.islice(self.doc_iter,self.start,self.stop)
+        for export in exports:
+            yield export
+
+class RangeIter(PipelineIter):
+    '''Yields the records between two positions of a DocumentIter with an
+    iter_range method (see JsonDiskIter.since)'''
+    
+    def __init__(self,doc_iter,start,stop):
+        '''build a RangeIter
+        
+        Args:
+            doc_iter (DocumentIter): the iterator to read from
+            start (int): position of the first record
+            stop (int): position to stop before
+        '''
+        self.doc_iter=doc_iter
+        self.start=start
+        self.stop=stop
+    
+    @property
+    def size(self):
+        '''Number of exports, None if unknown'''
+        if self.doc_iter.iter_type in MULTI_EXPORT_ITER_TYPES:
+            return None
+        return self.stop-self.start
+    
+    def __iter__(self):
+        '''Iterate over the DocumentIterator
+        
+        Yields:
+            export (list or dict): the exports of the records from start to stop
+        '''
+        for export in self.doc_iter.iter_range(self.start,self.stop):
+            yield export
+
+class ShardIter(PipelineIter):
+    '''Yields one of n_shards disjoint parts of a DocumentIter (see DocumentIter.shard).
+    Iterators with an iter_range method are split into contiguous blocks of
+    records, each read by seeking straight to its start. Other iterators are
+    split round-robin, export i going to shard i%n_shards.
+    '''
+    
+    def __init__(self,doc_iter,index,n_shards):
+        '''build a ShardIter
+        
+        Args:
+            doc_iter (DocumentIter): the iterator to shard
+            index (int): the shard to keep (0<=index<n_shards)
+            n_shards (int): the number of shards
+        '''
+        if not 0<=index<n_shards:
+            raise ValueError('shard index must be in [0,'+str(n_shards)+')')
+        self.doc_iter=doc_iter
+        self.index=index
+        self.n_shards=n_shards
+    
+    def bounds(self):
+        '''get the record positions of the shard, for iterators with iter_range
+        
+        Returns:
+            start (int): position of the first record of the shard
+            stop (int): position to stop before
+        '''
+        size=self.doc_iter.size
+        start=size*self.index//self.n_shards
+        stop=size*(self.index+1)//self.n_shards
+        return start,stop
+    
+    @property
+    def size(self):
+        '''Number of exports, None if unknown'''
+        if can_seek(self.doc_iter):
+            if self.doc_iter.iter_type in MULTI_EXPORT_ITER_TYPES:
+                return None
+            start,stop=self.bounds()
+            return stop-start
+        n=_n_exports(self.doc_iter)
+        if n is None:
+            return None
+        return len(xrange(self.index,n,self.n_shards))
+    
+    def __iter__(self):
+        '''Iterate over the DocumentIterator
+        
+        Yields:
+            export (list or dict): the exports of the records in the shard
+        '''
+        if can_seek(self.doc_iter):
+            start,stop=self.bounds()
+            exports=self.doc_iter.iter_range(start,stop)
+        else:
+            exports=itertools.islice(self.doc_iter,self.index,None,self.n_shards)
+        for export in exports:
+            yield export
+
+class BatchIter(PipelineIter):
+    '''Groups the exports of a DocumentIter into lists (see DocumentIter.batch)'''
+    
+    def __init__(self,doc_iter,batch_size):
+        '''build a BatchIter
+        
+        Args:
+            doc_iter (DocumentIter): the iterator to batch
+            batch_size (int): number of exports per list
+        '''
+        self.doc_iter=doc_iter
+        self.batch_size=batch_size
+    
+    @property
+    def size(self):
+        '''Number of batches, None if unknown'''
+        n=_n_exports(self.doc_iter)
+        if n is None:
+            return None
+        return (n+self.batch_size-1)//self.batch_size
+    
+    def __iter__(self):
+        '''Iterate over the DocumentIterator
+        
+        Yields:
+            batch (list): up to batch_size consecutive exports of doc_iter
+        '''
+        exports=iter(self.doc_iter)
+        while True:
+            batch=list(itertools.islice(exports,self.batch_size))
+            if not batch:
+                break
+            yield batch
+
+def _prefetch_put(queue,item,stop):
+    '''put an item on a bounded queue, giving up if the consumer has stopped
+    
+    Args:
+        queue (Queue.Queue or multiprocessing.Queue): queue to put item on
+        item (tuple): (kind (str), payload) item to put
+        stop (threading.Event or multiprocessing.Event): set when the consumer stops
+    
+    Returns:
+        put (bool): True if the item was put on the queue
+    '''
+    while not stop.is_set():
+        try:
+            queue.put(item,timeout=0.1)
+            return True
+        except Queue.Full:
+            pass
+    return False
+
+def _prefetch_produce(doc_iter,queue,stop,batch_size):
+    '''Stream records from doc_iter onto a queue in batches. Run in the
+    producer thread or process of a PrefetchIter
+    
+    Args:
+        doc_iter (DocumentIter): the iterator to read records from
+        queue (Queue.Queue or multiprocessing.Queue): bounded queue to fill
+        stop (threading.Event or multiprocessing.Event): set when the consumer stops
+        batch_size (int): number of records per batch put on the queue
+    '''
+    try:
+        batch=[]
+        for export in doc_iter:
+            batch.append(export)
+            if len(batch)>=batch_size:
+                if not _prefetch_put(queue,('batch',batch),stop):
+                    return
+                batch=[]
+        if batch and not _prefetch_put(queue,('batch',batch),stop):
+            return
+        _prefetch_put(queue,('done',None),stop)
+    except Exception as e:
+        _prefetch_put(queue,('error',e),stop)
+
+class PrefetchIter(WrapperIter):
+    '''Implements DocumentIter as a wrapper around another DocumentIter, reading
+    and decoding records in a background thread (or process) ahead of the consumer.
+    
+    Records are passed to the consumer in batches through a bounded queue, so the
+    producer can only get max_batches batches ahead. If the consumer stops early,
+    the producer is stopped too.
+    
+    Implemented iter_types:
+        all the iter_types of the wrapped DocumentIter
+    '''
+    batch_size=100
+    max_batches=10
+    use_process=False
+    poll_interval=1.
+    
+    def __init__(self,doc_iter,batch_size=100,max_batches=10,use_process=False):
+        '''build a PrefetchIter
+        
+        Args:
+            doc_iter (DocumentIter): the iterator to prefetch records from
+        
+        Kwargs:
+            batch_size (int): number of records per batch (defaults to 100)
+            max_batches (int): maximum number of batches waiting for the consumer
+                (defaults to 10)
+            use_process (bool): produce records in a separate process rather than
+                a thread (defaults to False). Useful when decoding and sanitising 
+                is CPU bound, as records are then produced outside the GIL
+        '''
+        self.doc_iter=doc_iter
+        self.batch_size=batch_size
+        self.max_batches=max_batches
+        self.use_process=use_process
+    
+    def __iter__(self):
+        '''Iterate over the DocumentIterator
+        
+        Yields:
+            export (list or dict): the record to return (dependent on iter_type) 
+        '''
+        if self.use_process:
+            queue=multiprocessing.Queue(self.max_batches)
+            stop=multiprocessing.Event()
+            worker=multiprocessing.Process(target=_prefetch_produce,
+                args=(self.doc_iter,queue,stop,self.batch_size))
+        else:
+            queue=Queue.Queue(self.max_batches)
+            stop=threading.Event()
+            worker=threading.Thread(target=_prefetch_produce,
+                args=(self.doc_iter,queue,stop,self.batch_size))
+        worker.daemon=True
+        worker.start()
+        try:
+            while True:
+                kind,payload=self._get(queue,worker)
+                if kind=='batch':
+                    for export in payload:
+                        yield export
+                elif kind=='error':
+                    raise payload
+                else:
+                    break
+        finally:#stop the producer, including when the consumer stops early
+            stop.set()
+            worker.join(1)
+            if self.use_process and worker.is_alive():
+                worker.terminate()
+    
+    def _get(self,queue,worker):
+        '''get the next message from the producer. A producer process is polled
+        every poll_interval seconds, so the consumer does not wait forever if it
+        dies without reporting (killed, or with an error that cannot be pickled).
+        A producer thread always reports, so its queue is read without polling
+        
+        Args:
+            queue (Queue.Queue or multiprocessing.Queue): the queue the producer fills
+            worker (threading.Thread or multiprocessing.Process): the producer
+        
+        Returns:
+            message (tuple): (kind (str), payload) put by :func:_prefetch_produce
+        '''
+        if not self.use_process:
+            return queue.get()
+        while True:
+            try:
+                return queue.get(timeout=self.poll_interval)
+            except Queue.Empty:
+                if worker.is_alive():
+                    continue
+            try:#the producer may have finished just after the timeout
+                return queue.get(timeout=self.poll_interval)
+            except Queue.Empty:
+                raise RuntimeError('the prefetch process exited without finishing the pass '
+                    '(exit code '+str(worker.exitcode)+')')
+
+def source_fingerprint(doc_iter):
+    '''get a string identifying the data source of a DocumentIter and its state,
+    used to invalidate caches of the records it streams
+    
+    Args:
+        doc_iter (DocumentIter): the iterator to fingerprint (wrappers are unwrapped)
+    
+    Returns:
+        fingerprint (str): description of the data source, changing when it is modified
+    '''
+    while isinstance(doc_iter,WrapperIter):
+        doc_iter=doc_iter.doc_iter
+    source=doc_iter.source
+    parts=[doc_iter.__class__.__name__]
+    if isinstance(source,basestring) and os.path.exists(source):
+        stat=os.stat(source)
+        parts.extend([os.path.abspath(source),stat.st_mtime,stat.st_size])
+    elif isinstance(doc_iter,MongoIter):
+        parts.extend([source.full_name if hasattr(source,'full_name') else id(source),
+            doc_iter.query,doc_iter.from_list,doc_iter.size])
+    else:
+        parts.extend([id(source),doc_iter.size])
+    fingerprint=json.dumps(parts,sort_keys=True,default=str)
+    return fingerprint
+
+class CacheIter(WrapperIter):
+    '''Implements DocumentIter as a wrapper around another DocumentIter, caching
+    the sanitised, tokenised documents on the first pass and replaying them on
+    later passes (e.g. dictionary building followed by many training epochs).
+    
+    The cache is kept in memory up to a size cap, beyond which it is spilled to
+    a file on disk. It is invalidated if the data source or the configuration of
+    its sanitiser changes. A pass that stops early does not complete the cache.
+    
+    Implemented iter_types:
+        'DOC', 'SIMPLE', 'SENTENCES', 'DOI' and 'LABELED_SENTENCES' are replayed
+        from the cache. Any other iter_type of the wrapped DocumentIter is 
+        streamed from it directly
+    '''
+    CACHED_TYPES=('DOC','SIMPLE','SENTENCES','DOI','LABELED_SENTENCES')
+    cache_file=None
+    max_memory=1<<28
+    
+    def __init__(self,doc_iter,cache_file=None,max_memory=1<<28,batch_size=1000):
+        '''build a CacheIter
+        
+        Args:
+            doc_iter (DocumentIter): the iterator to cache, must support the 'DOI' iter_type
+        
+        Kwargs:
+            cache_file (str): file to spill the cache to. If it already holds a
+                complete cache for the same data source and sanitiser, it is 
+                replayed from the first pass. Defaults to None, using a temporary 
+                file if the cache outgrows max_memory
+            max_memory (int): approximate size in bytes of cache to keep in memory
+                before spilling to disk (defaults to 256MB). 0 always spills to disk
+            batch_size (int): number of records pickled together in the cache file
+                (defaults to 1000)
+        '''
+        self.doc_iter=doc_iter
+        self.cache_file=cache_file
+        self.max_memory=max_memory
+        self.batch_size=batch_size
+        self.memory=None #list of (doi,doc) when cached in memory
+        self.spill_file=None #file holding the cache when spilled to disk
+        self.key=None #the key of the current cache
+    
+    def cache_key(self):
+        '''get the key identifying the wrapped data source and sanitiser configuration
+        
+        Returns:
+            key (str): md5 hex digest of the source and sanitiser fingerprints
+        '''
+        key=hashlib.md5(source_fingerprint(self.doc_iter)+self.sanitiser.fingerprint()).hexdigest()
+        return key
+    
+    def clear(self):
+        '''drop the cache, deleting any temporary spill file'''
+        if self.spill_file is not None and self.spill_file!=self.cache_file:
+            os.remove(self.spill_file)
+        self.memory=None
+        self.spill_file=None
+        self.key=None
+    
+    def _cache_valid(self,key):
+        '''check whether a complete cache exists for a key, picking up a
+        cache_file written by a previous run
+        
+        Args:
+            key (str): the current cache key
+        
+        Returns:
+            valid (bool): True if the cache can be replayed
+        '''
+        if self.key==key and (self.memory is not None or self.spill_file is not None):
+            return True
+        self.clear()
+        if self.cache_file is not None and os.path.exists(self.cache_file):
+            with open(self.cache_file,'rb') as f:
+                try:
+                    header=cPickle.load(f)
+                except (EOFError,cPickle.UnpicklingError):
+                    return False
+            if header.get('key')==key:
+                self.key=key
+                self.spill_file=self.cache_file
+                return True
+        return False
+    
+    def _replay(self):
+        '''stream the cached documents
+        
+        Yields:
+            (doi,doc) (tuple): doi and [[w,w...][w,w...],...] sentences of each document
+        '''
+        if self.memory is not None:
+            for rec in self.memory:
+                yield rec
+        else:
+            with open(self.spill_file,'rb') as f:
+                cPickle.load(f)#skip header
+                while True:
+                    try:
+                        batch=cPickle.load(f)
+                    except EOFError:
+                        break
+                    for rec in batch:
+                        yield rec
+    
+    def _fill(self,key):
+        '''stream documents from the wrapped iterator, caching them
+        
+        Args:
+            key (str): the cache key to store the cache under
+        
+        Yields:
+            (doi,doc) (tuple): doi and [[w,w...][w,w...],...] sentences of each document
+        '''
+        memory=[]
+        mem_size=0
+        spill=None
+        spill_name=None
+        batch=[]
+        iter_type=self.doc_iter.iter_type
+        self.doc_iter.iter_type='DOI'
+        complete=False
+        try:
+            for rec in self.doc_iter:
+                entry=(rec['doi'],rec['doc'])
+                if spill is None:
+                    memory.append(entry)
+                    mem_size+=sum(64*len(sent)+sum(len(w) for w in sent) for sent in entry[1])
+                    if mem_size>self.max_memory:#spill the cache to disk
+                        if self.cache_file is not None:
+                            spill_name=self.cache_file
+                        else:
+                            fd,spill_name=tempfile.mkstemp(suffix='.cache')
+                            os.close(fd)
+                        spill=open(spill_name+'.part','wb')
+                        cPickle.dump({'key':key},spill,cPickle.HIGHEST_PROTOCOL)
+                        for i in xrange(0,len(memory),self.batch_size):
+                            cPickle.dump(memory[i:i+self.batch_size],spill,cPickle.HIGHEST_PROTOCOL)
+                        memory=None
+                else:
+                    batch.append(entry)
+                if spill is not None and len(batch)>=self.batch_size:
+                    cPickle.dump(batch,spill,cPickle.HIGHEST_PROTOCOL)
+                    batch=[]
+                yield entry
+            complete=True
+        finally:
+            self.doc_iter.iter_type=iter_type
+            if spill is not None:
+                if batch:
+                    cPickle.dump(batch,spill,cPickle.HIGHEST_PROTOCOL)
+                spill.close()
+                if complete:
+                    os.rename(spill_name+'.part',spill_name)
+                else:
+                    os.remove(spill_name+'.part')
+        if self.cache_file is not None and spill is None:#persist small caches too
+            with open(self.cache_file+'.part','wb') as f:
+                cPickle.dump({'key':key},f,cPickle.HIGHEST_PROTOCOL)
+                for i in xrange(0,len(memory),self.batch_size):
+                    cPickle.dump(memory[i:i+self.batch_size],f,cPickle.HIGHEST_PROTOCOL)
+            os.rename(self.cache_file+'.part',self.cache_file)
+        self.memory=memory
+        self.spill_file=spill_name
+        self.key=key
+    
+    def __iter__(self):
+        '''Iterate over the DocumentIterator
+        
+        Yields:
+            export (list or dict): the record to return (dependent on iter_type) 
+        '''
+        iter_type=self.doc_iter.iter_type
+        if iter_type not in self.CACHED_TYPES:
+            for export in self.doc_iter:
+                yield export
+            return
+        key=self.cache_key()
+        if self._cache_valid(key):
+            stats=self.get_stats()#passes filling the cache report to the wrapped iterator's stats
+            stats.start(self.size)
+            for doi,doc in self._replay():
+                stats.tick()
+                for export in record_exports({'doi':doi},doc,iter_type):
+                    yield export
+            stats.finish()
+        else:
+            for doi,doc in self._fill(key):
+                for export in record_exports({'doi':doi},doc,iter_type):
+                    yield export
@@ -0,0 +1,144 @@
+'''
+.. module:: hashing
+   :platform: Unix, OSX
+   :synopsis: hashing dictionary giving words ids in a fixed size hash space,
+       so corpora can be represented without a dictionary building pass
+
+.. moduleauthor:: Patrick Lewis
+'''
+import zlib
+from gensim import utils
+
+def hash_token(word,id_range):
+    '''get the hashed id of a word
+
+    Args:
+        word (unicode): the word
+        id_range (int): size of the id space
+
+    Returns:
+        token_id (int): id of the word in [0,id_range)
+    '''
+    if isinstance(word,unicode):
+        word=word.encode('utf8')
+    token_id=(zlib.crc32(word)&0xffffffff)%id_range
+    return token_id
+
+class HashingDictionary(utils.SaveLoad):
+    '''Drop-in replacement for gensim.corpora.Dictionary that maps words to ids by
+    hashing them (crc32) into a fixed id space rather than by a dictionary built
+    in a pass over the corpus. Memory is bounded by id_range whatever the size of
+    the vocabulary, at the cost of unrelated words sharing ids when they collide.
+
+    Document frequencies (needed for tfidf) are counted as documents are added.
+    Optionally, a few of the words hashed to each id are kept as a reverse
+    lookup for debugging.
+    '''
+    id_range=0
+    sample_words=0
+
+    def __init__(self,documents=None,id_range=1<<20,sample_words=0):
+        '''Build a HashingDictionary
+
+        Kwargs:
+            documents (iterable): documents (lists of words) to count document
+                frequencies from (defaults to None, no documents)
+            id_range (int): size of the id space (defaults to 2**20)
+            sample_words (int): number of words to remember for each id as a
+                reverse lookup (defaults to 0, no reverse lookup)
+        '''
+        self.id_range=id_range
+        self.sample_words=sample_words
+        self.dfs={}
+        self.cfs={}
+        self.samples={}
+        self.num_docs=0
+        self.num_pos=0
+        self.num_nnz=0
+        if documents is not None:
+            self.add_documents(documents)
+
+    def __len__(self):
+        return self.id_range
+
+    def __getitem__(self,token_id):
+        '''get the sampled words hashed to an id
+
+        Args:
+            token_id (int): the id
+
+        Returns:
+            words (list): the words seen with this id (at most sample_words of them)
+        '''
+        words=self.samples.get(token_id,[])
+        return words
+
+    def keys(self):
+        '''get the ids that have been seen in added documents
+
+        Returns:
+            ids (list): sorted list of ids
+        '''
+        ids=sorted(self.dfs)
+        return ids
+
+    def iteritems(self):
+        '''iterate over the reverse lookup
+
+        Yields:
+            (token_id, words) (tuple): id and the sampled words hashed to it
+        '''
+        for token_id,words in self.samples.iteritems():
+            yield token_id,words
+
+    def token_id(self,word):
+        '''get the id of a word
+
+        Args:
+            word (unicode): the word
+
+        Returns:
+            token_id (int): id of the word in [0,id_range)
+        '''
+        token_id=hash_token(word,self.id_range)
+        return token_id
+
+    def doc2bow(self,document,allow_update=False):
+        '''get the bag-of-words representation of a document
+
+        Args:
+            document (list): list of words
+
+        Kwargs:
+            allow_update (bool): count the document in the document frequencies
+                (defaults to False)
+
+        Returns:
+            bow (list): list of (token_id (int), frequency (int)) tuples, in id order
+        '''
+        counter={}
+        for w in document:
+            token_id=hash_token(w,self.id_range)
+            counter[token_id]=counter.get(token_id,0)+1
+            if allow_update and self.sample_words:
+                words=self.samples.setdefault(token_id,[])
+                if len(words)<self.sample_words and w not in words:
+                    words.append(w)
+        if allow_update:
+            self.num_docs+=1
+            self.num_pos+=len(document)
+            self.num_nnz+=len(counter)
+            for token_id,freq in counter.iteritems():
+                self.dfs[token_id]=self.dfs.get(token_id,0)+1
+                self.cfs[token_id]=self.cfs.get(token_id,0)+freq
+        bow=sorted(counter.iteritems())
+        return bow
+
+    def add_documents(self,documents):
+        '''count the document frequencies of documents
+
+        Args:
+            documents (iterable): documents as lists of words
+        '''
+        for document in documents:
+            self.doc2bow(document,allow_update=True)
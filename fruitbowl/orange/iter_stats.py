@@ -0,0 +1,175 @@
+'''
+.. module:: iter_stats
+   :platform: Unix, OSX
+   :synopsis: throughput and timing statistics reported by DocumentIter objects
+       as they stream records
+
+.. moduleauthor:: Patrick Lewis
+'''
+import json
+import sys
+import time
+
+STAGES=('read','decode','sanitise')
+
+def progress(ind,size):
+    '''Prints a Progress Bar for a Document Iterator to the command line
+
+    Args:
+        ind (int): the index of the current record
+        size (int): the maximum possible record
+    '''
+    percent = int(100*float(ind)/size) if size else 100
+    sys.stdout.write('\r[{0}{1}] {2}% {3}'.format('#'*(percent/10),' '*(10-percent/10), percent, ind))
+    sys.stdout.flush()
+
+class IterStats(object):
+    '''Statistics for the passes of a DocumentIter over its data source.
+
+    Counts records and bytes, and accumulates the time spent in each stage of
+    streaming: 'read' (I/O), 'decode' (utf8 and json decoding) and 'sanitise'
+    (building and sanitising documents). Callbacks can be registered to run every
+    'every' records and at the end of each pass, and a json summary of each
+    pass can be appended to a file.
+    '''
+    size=0
+    records=0
+    bytes=0
+    every=1000
+    verbose=True
+
+    def __init__(self,verbose=True,every=1000,summary_file=None,timing=True):
+        '''Build an IterStats
+
+        Kwargs:
+            verbose (bool): print a progress bar to stdout (defaults to True).
+                False silences all output
+            every (int): number of records between progress callbacks (defaults to 1000)
+            summary_file (str): file to append a json summary of each pass to
+                (defaults to None, no file written)
+            timing (bool): time the read, decode and sanitise stages (defaults to True)
+        '''
+        self.verbose=verbose
+        self.every=every
+        self.summary_file=summary_file
+        self.timing=timing
+        self.progress_callbacks=[]
+        self.finish_callbacks=[]
+        self.history=[]
+        self.start()
+
+    def add_callback(self,func,on='progress'):
+        '''register a function to call with this IterStats during iteration
+
+        Args:
+            func (function): function taking the IterStats object as its argument
+
+        Kwargs:
+            on (str): 'progress' to call func every 'every' records, or 'finish'
+                to call it at the end of each pass (defaults to 'progress')
+        '''
+        if on=='finish':
+            self.finish_callbacks.append(func)
+        else:
+            self.progress_callbacks.append(func)
+
+    def start(self,size=0):
+        '''reset the counters at the start of a pass
+
+        Kwargs:
+            size (int): number of records expected in the pass (defaults to 0)
+        '''
+        self.size=size
+        self.records=0
+        self.bytes=0
+        self.times=dict.fromkeys(STAGES,0.)
+        self.start_time=time.time()
+        self.end_time=None
+
+    def add_time(self,stage,seconds):
+        '''add time spent in a streaming stage
+
+        Args:
+            stage (str): 'read', 'decode' or 'sanitise'
+            seconds (float): time spent
+        '''
+        self.times[stage]+=seconds
+
+    def tick(self,n_bytes=0,n_records=1):
+        '''count streamed records, running the progress callbacks every 'every' records
+
+        Kwargs:
+            n_bytes (int): bytes read for the records (defaults to 0)
+            n_records (int): number of records (defaults to 1)
+        '''
+        before=self.records
+        self.records+=n_records
+        self.bytes+=n_bytes
+        if before//self.every!=self.records//self.every:
+            if self.verbose:
+                progress(self.records,self.size)
+            for func in self.progress_callbacks:
+                func(self)
+
+    def finish(self):
+        '''end the pass, recording and reporting its summary
+
+        Returns:
+            summary (dict): the summary of the pass (see :method: summary)
+        '''
+        self.end_time=time.time()
+        summary=self.summary()
+        self.history.append(summary)
+        if self.verbose:
+            print('\n')
+        if self.summary_file is not None:
+            with open(self.summary_file,'a') as f:
+                f.write(json.dumps(summary)+'\n')
+        for func in self.finish_callbacks:
+            func(self)
+        return summary
+
+    def report_times(self,times):
+        '''report the time spent by the consumers of a pass (such as the 
+        accumulators of an orange.pass_engine.PassEngine), printed if verbose
+
+        Args:
+            times (list): (name (str), seconds (float)) of each consumer
+        '''
+        if self.verbose:
+            for name,seconds in times:
+                print(name+' : '+'%.2f'%seconds+'s')
+
+    def elapsed(self):
+        '''get the time since the start of the pass (or its duration if finished)
+
+        Returns:
+            seconds (float): elapsed time
+        '''
+        end=self.end_time if self.end_time is not None else time.time()
+        seconds=end-self.start_time
+        return seconds
+
+    def summary(self):
+        '''get the statistics of the current (or last finished) pass
+
+        Returns:
+            summary (dict): records, bytes, elapsed seconds, records_per_sec,
+                bytes_per_sec and the seconds spent in each stage
+        '''
+        elapsed=self.elapsed()
+        summary={'records':self.records,
+            'bytes':self.bytes,
+            'elapsed':elapsed,
+            'records_per_sec':self.records/elapsed if elapsed>0 else 0.,
+            'bytes_per_sec':self.bytes/elapsed if elapsed>0 else 0.,
+            'times':dict(self.times)}
+        return summary
+
+    def summary_json(self):
+        '''get the statistics of the current pass as json
+
+        Returns:
+            summary (str): json encoded summary (see :method: summary)
+        '''
+        return json.dumps(self.summary())
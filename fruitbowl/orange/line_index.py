@@ -0,0 +1,601 @@
+'''
+.. module:: line_index
+   :platform: Unix, OSX
+   :synopsis: persistent sidecar indices of line byte offsets, allowing
+       line-delimited data sources on disk (plain, gzip or zstd compressed)
+       to be sized and read from any record
+
+.. moduleauthor:: Patrick Lewis
+'''
+import os
+import cPickle
+import gzip
+import hashlib
+import io
+import struct
+import zlib
+import numpy as np
+try:
+    import zstandard
+except ImportError:#zstd compressed sources are unavailable
+    zstandard=None
+
+INDEX_VERSION=3
+CHUNK_SIZE=1<<20
+TAIL_BYTES=4096 #bytes checked to detect a rewrite of an appended-to data source
+ZSTD_MAGIC=0xFD2FB528
+
+def index_file_name(txf):
+    '''get the name of the sidecar index file for a data source
+
+    Args:
+        txf (str): the text file data source
+
+    Returns:
+        idx_name (str): name of the sidecar index file
+    '''
+    idx_name = txf+'.idx'
+    return idx_name
+
+def codec_of(txf):
+    '''get the compression of a data source from its file extension
+
+    Args:
+        txf (str): the text file data source
+
+    Returns:
+        codec (str): 'gzip' for .gz files, 'zstd' for .zst files, None otherwise
+    '''
+    if txf.endswith('.gz'):
+        codec='gzip'
+    elif txf.endswith('.zst'):
+        if zstandard is None:
+            raise ImportError('the zstandard package is needed to read '+txf)
+        codec='zstd'
+    else:
+        codec=None
+    return codec
+
+def open_at(txf,offset=0,blocks=None):
+    '''open a data source for reading, positioned at an uncompressed byte offset
+
+    Args:
+        txf (str): the text file data source
+
+    Kwargs:
+        offset (int): uncompressed byte offset to start reading from (defaults to 0)
+        blocks (numpy.2darray): block table of a compressed source (see
+            LineIndex.blocks), used to start decompressing from the block holding
+            offset. Defaults to None, decompressing from the start of the file
+
+    Returns:
+        f (file): binary file object positioned at offset
+    '''
+    codec=codec_of(txf)
+    if codec is None:
+        f=open(txf,'rb')
+        f.seek(offset)
+        return f
+    raw=open(txf,'rb')
+    ustart=0
+    if blocks is not None and len(blocks):
+        b=np.searchsorted(blocks[:,0],offset,side='right')-1
+        ustart=int(blocks[b,0])
+        raw.seek(int(blocks[b,1]))
+    if codec=='gzip':
+        f=gzip.GzipFile(fileobj=raw,mode='rb')
+    else:
+        reader=zstandard.ZstdDecompressor().stream_reader(raw,read_across_frames=True)
+        f=io.BufferedReader(reader,CHUNK_SIZE)
+    skip=offset-ustart
+    while skip>0:#decompress up to the requested offset
+        skipped=len(f.read(min(skip,CHUNK_SIZE)))
+        if skipped==0:
+            break
+        skip-=skipped
+    return f
+
+def iter_lines(txf,index=None,start=0,stop=None,decode=True):
+    '''Stream the raw lines of a text file, optionally starting part way through
+
+    Args:
+        txf (str): the text file data source
+
+    Kwargs:
+        index (LineIndex): index of txf used to seek straight to line start.
+            Defaults to None, in which case the lines before start are read and skipped
+        start (int): position of the first line to yield (defaults to 0)
+        stop (int): position to stop before (defaults to None, read to end of file)
+        decode (bool): decode the lines from utf8 (defaults to True)
+
+    Yields:
+        line (unicode): the line, including its line ending (str if decode is False)
+    '''
+    ind=0
+    if index is not None and start>0:
+        f=open_at(txf,int(index.offsets[min(start,index.size)]),index.blocks)
+        ind=start
+    else:
+        f=open_at(txf)
+    with f:
+        for line in f:
+            if stop is not None and ind>=stop:
+                break
+            if ind>=start:
+                yield line.decode('utf8') if decode else line
+            ind+=1
+
+def iter_byte_range(txf,start,end,blocks=None,decode=True):
+    '''Stream the raw lines of a text file that start within a byte range
+
+    Args:
+        txf (str): the text file data source
+        start (int): uncompressed byte offset of the first line (must be a line start)
+        end (int): uncompressed byte offset to stop before (must be a line start)
+
+    Kwargs:
+        blocks (numpy.2darray): block table of a compressed source (see open_at)
+        decode (bool): decode the lines from utf8 (defaults to True)
+
+    Yields:
+        line (unicode): the line, including its line ending (str if decode is False)
+    '''
+    with open_at(txf,start,blocks) as f:
+        pos=start
+        for line in f:
+            if pos>=end:
+                break
+            pos+=len(line)
+            yield line.decode('utf8') if decode else line
+
+def shard_ranges(txf,n_shards,index=None):
+    '''split a text file into byte ranges of roughly equal size, aligned to line boundaries
+
+    Args:
+        txf (str): the text file data source
+        n_shards (int): the number of shards to split into
+
+    Kwargs:
+        index (LineIndex): index of txf used to find line boundaries. Defaults to None,
+            in which case boundaries are found by reading on to the next newline.
+            Compressed sources must have an index
+
+    Returns:
+        ranges (list): list of (start (int), end (int)) uncompressed byte ranges covering the file
+    '''
+    if index is not None:
+        fsize=int(index.offsets[-1])
+        targets=[fsize*i//n_shards for i in range(1,n_shards)]
+        bounds=[int(index.offsets[i]) for i in np.searchsorted(index.offsets,targets)]
+    elif codec_of(txf) is not None:
+        raise ValueError('compressed data sources need a LineIndex to be sharded')
+    else:
+        fsize=os.path.getsize(txf)
+        targets=[fsize*i//n_shards for i in range(1,n_shards)]
+        bounds=[]
+        with open(txf,'rb') as f:
+            for t in targets:
+                f.seek(t-1)
+                f.readline()#move on to the start of the next line
+                bounds.append(f.tell())
+    starts=[0]+bounds
+    ends=bounds+[fsize]
+    ranges=[(s,e) for s,e in zip(starts,ends) if s<e]
+    return ranges
+
+def _iter_gzip_chunks(f):
+    '''decompress a gzip file, reporting where each gzip member starts
+
+    Args:
+        f (file): the compressed file, opened in binary mode
+
+    Yields:
+        member_start (int): compressed offset of the member this chunk starts,
+            None if the chunk continues the current member
+        data (str): decompressed bytes
+    '''
+    cpos=0 #compressed offset of the start of pending
+    pending=''
+    d=zlib.decompressobj(16+zlib.MAX_WBITS)
+    member_start=0
+    while True:
+        if not pending:
+            pending=f.read(CHUNK_SIZE)
+            if not pending:
+                break
+        data=d.decompress(pending)
+        yield member_start,data
+        member_start=None
+        if d.unused_data:#the member ended in this chunk
+            cpos+=len(pending)-len(d.unused_data)
+            pending=d.unused_data.lstrip('\x00')#skip any padding between members
+            cpos+=len(d.unused_data)-len(pending)
+            if pending:
+                member_start=cpos
+                d=zlib.decompressobj(16+zlib.MAX_WBITS)
+        else:
+            cpos+=len(pending)
+            pending=''
+    tail=d.flush()
+    if tail:
+        yield None,tail
+
+def _zstd_frame_length(f):
+    '''get the compressed length of the zstd frame starting at the current
+    position of f, by walking its block headers. f is left where it started
+
+    Args:
+        f (file): the compressed file, opened in binary mode
+
+    Returns:
+        length (int): length of the frame in bytes, 0 at the end of the file
+        skippable (bool): True if the frame is a skippable frame (holds no data)
+    '''
+    start=f.tell()
+    header=f.read(4)
+    if len(header)<4:
+        return 0,False
+    magic=struct.unpack('<I',header)[0]
+    if 0x184D2A50<=magic<=0x184D2A5F:#skippable frame
+        size=struct.unpack('<I',f.read(4))[0]
+        f.seek(start)
+        return 8+size,True
+    if magic!=ZSTD_MAGIC:
+        raise ValueError('corrupt zstd frame at byte '+str(start))
+    descriptor=ord(f.read(1))
+    fcs_flag=descriptor>>6
+    single_segment=(descriptor>>5)&1
+    checksum=(descriptor>>2)&1
+    did_size=[0,1,2,4][descriptor&3]
+    fcs_size=[1 if single_segment else 0,2,4,8][fcs_flag]
+    f.seek((0 if single_segment else 1)+did_size+fcs_size,1)
+    last=0
+    while not last:
+        block_header=struct.unpack('<I',f.read(3)+'\x00')[0]
+        last=block_header&1
+        block_type=(block_header>>1)&3
+        block_size=block_header>>3
+        f.seek(1 if block_type==1 else block_size,1)#RLE blocks hold a single byte
+    if checksum:
+        f.seek(4,1)
+    length=f.tell()-start
+    f.seek(start)
+    return length,False
+
+def _iter_zstd_chunks(f):
+    '''decompress a zstd file frame by frame, reporting where each frame starts
+
+    Args:
+        f (file): the compressed file, opened in binary mode
+
+    Yields:
+        frame_start (int): compressed offset of the frame this chunk starts,
+            None if the chunk continues the current frame
+        data (str): decompressed bytes
+    '''
+    dctx=zstandard.ZstdDecompressor()
+    while True:
+        frame_start=f.tell()
+        length,skippable=_zstd_frame_length(f)
+        if length==0:
+            break
+        if skippable:
+            f.seek(length,1)
+            continue
+        d=dctx.decompressobj()
+        while length>0:
+            compressed=f.read(min(length,CHUNK_SIZE))
+            length-=len(compressed)
+            yield frame_start,d.decompress(compressed)
+            frame_start=None
+
+def compress_source(txf,out_file,block_lines=10000,codec='gzip',level=6):
+    '''Compress a line-delimited data source as a series of independent blocks
+    (gzip members or zstd frames), so that a LineIndex of the compressed file can
+    seek to any record by decompressing only the block holding it. The output
+    is an ordinary gzip/zstd file readable by any tool.
+
+    Args:
+        txf (str): the text file data source to compress
+        out_file (str): name of the compressed file to write (.gz or .zst)
+
+    Kwargs:
+        block_lines (int): number of lines per compressed block (defaults to 10000)
+        codec (str): 'gzip' or 'zstd' (defaults to 'gzip')
+        level (int): compression level (defaults to 6)
+    '''
+    if codec=='zstd':
+        compress=zstandard.ZstdCompressor(level=level).compress
+    else:
+        def compress(data):
+            buf=io.BytesIO()
+            with gzip.GzipFile(fileobj=buf,mode='wb',compresslevel=level) as g:
+                g.write(data)
+            return buf.getvalue()
+    with open(txf,'rb') as f, open(out_file,'wb') as out:
+        block=[]
+        for line in f:
+            block.append(line)
+            if len(block)>=block_lines:
+                out.write(compress(''.join(block)))
+                block=[]
+        if block:
+            out.write(compress(''.join(block)))
+
+class LineIndex(object):
+    '''Sidecar index of byte offsets (and optionally dois) for each line of a
+    line-delimited file on disk.
+
+    The index is saved next to the data source (see :func:index_file_name) and
+    is reused for as long as the modification time and size of the data source
+    are unchanged, so the data source only has to be scanned once. When records
+    have been appended to an uncompressed data source, only the new lines (and 
+    the previous last line, whose ending may have changed) are scanned.
+
+    Gzip (.gz) and zstd (.zst) compressed data sources are indexed by their
+    uncompressed byte offsets, and the index also holds a block table of where
+    each gzip member or zstd frame starts, so reading from a record only
+    decompresses from the start of its block (see :func:compress_source).
+    '''
+    source=''
+    offsets=None
+    blocks=None
+    dois=None
+    mtime=0
+    fsize=0
+    appended=0
+
+    def __init__(self,txf,doi_func=None,rebuild=False):
+        '''Load the index for a data source, building it if it is missing or stale
+
+        Args:
+            txf (str): the text file data source
+
+        Kwargs:
+            doi_func (function): function mapping a raw line to the doi of the
+                record on that line. Defaults to None, in which case no doi
+                lookup table is built
+            rebuild (bool): force the index to be rebuilt even if the
+                sidecar file is up to date (defaults to False)
+        '''
+        self.source=txf
+        stat=os.stat(txf)
+        self.mtime=stat.st_mtime
+        self.fsize=stat.st_size
+        if rebuild or not self.load(doi_func is not None,doi_func):
+            self.build(doi_func)
+            self.save()
+        elif self.appended:
+            self.save()
+
+    @property
+    def size(self):
+        '''Number of lines in the data source'''
+        return len(self.offsets)-1
+
+    def load(self,need_dois=False,doi_func=None):
+        '''load the sidecar index file if it matches the data source, extending
+        it if records have been appended to the data source since it was saved
+
+        Kwargs:
+            need_dois (bool): treat an index without a doi table as stale
+            doi_func (function): function mapping a raw line to its doi, used to
+                index appended records
+
+        Returns:
+            loaded (bool): True if an up-to-date index was loaded
+        '''
+        try:
+            with open(index_file_name(self.source),'rb') as f:
+                stored=cPickle.load(f)
+        except (IOError,EOFError,cPickle.UnpicklingError):
+            return False
+        if stored.get('version')!=INDEX_VERSION:
+            return False
+        if need_dois and stored['dois'] is None:
+            return False
+        self.offsets=stored['offsets']
+        self.blocks=stored['blocks']
+        self.dois=stored['dois']
+        if stored['mtime']==self.mtime and stored['fsize']==self.fsize:
+            return True
+        if (stored['fsize']<self.fsize and codec_of(self.source) is None
+                and stored['tail']==self._tail_hash()):
+            self._extend(doi_func)
+            return True
+        return False
+
+    def _tail_hash(self):
+        '''hash the bytes before the start of the last indexed line, which are
+        unchanged when records are appended to the data source
+
+        Returns:
+            tail (str): md5 hex digest
+        '''
+        end=int(self.offsets[max(self.size-1,0)])
+        start=max(end-TAIL_BYTES,0)
+        with open(self.source,'rb') as f:
+            f.seek(start)
+            tail=hashlib.md5(f.read(end-start)).hexdigest()
+        return tail
+
+    def _extend(self,doi_func=None):
+        '''index the lines appended to an uncompressed data source, re-scanning
+        from the start of the last indexed line
+
+        Kwargs:
+            doi_func (function): function mapping a raw line to its doi
+        '''
+        first=max(self.size-1,0)
+        offsets=self.offsets[:first+1].tolist()
+        if doi_func is None:
+            self.dois=None
+        else:
+            self.dois={doi:pos for doi,pos in self.dois.iteritems() if pos<first}
+        pos=offsets[-1]
+        with open(self.source,'rb') as f:
+            f.seek(pos)
+            for line in f:
+                if self.dois is not None:
+                    self.dois[doi_func(line.decode('utf8'))]=len(offsets)-1
+                pos+=len(line)
+                offsets.append(pos)
+        self.appended=len(offsets)-1-self.size
+        self.offsets=np.array(offsets,dtype=np.int64)
+
+    def _iter_chunks(self):
+        '''read the data source in chunks, decompressing it if necessary
+
+        Yields:
+            block_start (int): compressed offset of the block this chunk starts,
+                None if the chunk continues the current block
+            data (str): (decompressed) bytes
+        '''
+        codec=codec_of(self.source)
+        with open(self.source,'rb') as f:
+            if codec=='gzip':
+                chunks=_iter_gzip_chunks(f)
+            elif codec=='zstd':
+                chunks=_iter_zstd_chunks(f)
+            else:
+                chunks=((None,data) for data in iter(lambda:f.read(CHUNK_SIZE),''))
+            for block_start,data in chunks:
+                yield block_start,data
+
+    def build(self,doi_func=None):
+        '''scan the data source, recording the byte offset of every line
+        (and the start of every compressed block)
+
+        Kwargs:
+            doi_func (function): function mapping a raw line to its doi
+        '''
+        print('Indexing '+self.source)
+        offsets=[0]
+        blocks=[]
+        dois={} if doi_func else None
+        pos=0
+        partial=''
+        for block_start,data in self._iter_chunks():
+            if block_start is not None:
+                blocks.append((pos+len(partial),block_start))
+            lines=(partial+data).split('\n')
+            partial=lines.pop()
+            for line in lines:
+                if dois is not None:
+                    dois[doi_func(line.decode('utf8')+u'\n')]=len(offsets)-1
+                pos+=len(line)+1
+                offsets.append(pos)
+        if partial:#last line without a line ending
+            if dois is not None:
+                dois[doi_func(partial.decode('utf8'))]=len(offsets)-1
+            offsets.append(pos+len(partial))
+        self.offsets=np.array(offsets,dtype=np.int64)
+        if codec_of(self.source):
+            self.blocks=np.array(blocks,dtype=np.int64).reshape(-1,2)
+        self.dois=dois
+
+    def save(self):
+        '''write the index to its sidecar file.
+
+        A data source in a read-only location keeps its index in memory only
+        '''
+        stored={
+            'version':INDEX_VERSION,
+            'mtime':self.mtime,
+            'fsize':self.fsize,
+            'offsets':self.offsets,
+            'blocks':self.blocks,
+            'dois':self.dois,
+            'tail':self._tail_hash() if codec_of(self.source) is None else None}
+        try:
+            with open(index_file_name(self.source),'wb') as f:
+                cPickle.dump(stored,f,cPickle.HIGHEST_PROTOCOL)
+        except IOError:
+            print('Could not write index file for '+self.source)
+
+    def position(self,doi):
+        '''get the line position of the record with a given doi
+
+        Args:
+            doi (str): doi of the record
+
+        Returns:
+            pos (int): line position of the record, None if the doi is not indexed
+        '''
+        pos = self.dois.get(doi)
+        return pos
+
+    def doi_list(self):
+        '''get the indexed dois in the order of their records in the data source
+
+        Returns:
+            dois (list): list of dois
+        '''
+        dois=sorted(self.dois,key=self.dois.get)
+        return dois
+
+    def read_line(self,pos):
+        '''read a single line of the data source
+
+        Args:
+            pos (int): line position to read
+
+        Returns:
+            line (unicode): the decoded line
+        '''
+        if not 0<=pos<self.size:
+            raise IndexError('line '+str(pos)+' out of range for '+self.source)
+        with open_at(self.source,int(self.offsets[pos]),self.blocks) as f:
+            line=f.read(int(self.offsets[pos+1]-self.offsets[pos]))
+        return line.decode('utf8')
+
+    def iter_lines_at(self,positions,decode=True):
+        '''read the lines at a sequence of positions, keeping the data source open
+        between them. Sorted positions are fastest: compressed sources are then
+        decompressed forwards within a block rather than re-opened for each line
+
+        Args:
+            positions (list): line positions to read
+
+        Kwargs:
+            decode (bool): decode the lines from utf8 (defaults to True)
+
+        Yields:
+            line (unicode): the line at each position (str if decode is False)
+        '''
+        codec=codec_of(self.source)
+        f=None
+        cur=0 #uncompressed offset f is at
+        try:
+            for pos in positions:
+                if not 0<=pos<self.size:
+                    raise IndexError('line '+str(pos)+' out of range for '+self.source)
+                offset=int(self.offsets[pos])
+                if codec is None:
+                    if f is None:
+                        f=open(self.source,'rb')
+                    f.seek(offset)
+                else:
+                    if f is not None and offset<cur:
+                        f.close()
+                        f=None
+                    elif f is not None and self.blocks is not None:
+                        starts=self.blocks[:,0]
+                        if np.searchsorted(starts,offset,side='right')!=np.searchsorted(starts,cur,side='right'):
+                            f.close()#quicker to re-open at the start of the block
+                            f=None
+                    if f is None:
+                        f=open_at(self.source,offset,self.blocks)
+                    else:
+                        skip=offset-cur
+                        while skip>0:
+                            skipped=len(f.read(min(skip,CHUNK_SIZE)))
+                            if skipped==0:
+                                break
+                            skip-=skipped
+                line=f.read(int(self.offsets[pos+1])-offset)
+                cur=offset+len(line)
+                yield line.decode('utf8') if decode else line
+        finally:
+            if f is not None:
+                f.close()
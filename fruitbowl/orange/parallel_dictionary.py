@@ -0,0 +1,277 @@
+'''
+.. module:: parallel_dictionary
+   :platform: Unix, OSX
+   :synopsis: map-reduce construction of gensim dictionaries, counting shards of
+       a data source in worker processes, optionally in bounded memory
+
+.. moduleauthor:: Patrick Lewis
+'''
+import copy
+import multiprocessing
+import os
+from gensim import corpora
+import docIterators
+import line_index
+from iter_stats import IterStats
+from sketches import SpaceSaving
+
+def count_documents(docs):
+    '''count the words of a stream of documents, remembering the order in which
+    gensim would give the words ids
+
+    Args:
+        docs (iterable): documents as lists of words
+
+    Returns:
+        counts (dict): {'order': words in order of first appearance (sorted
+            within each document, as gensim.corpora.Dictionary.doc2bow does),
+            'dfs': {word: document frequency}, 'cfs': {word: collection frequency},
+            'num_docs', 'num_pos', 'num_nnz': corpus totals}
+    '''
+    order=[]
+    dfs={}
+    cfs={}
+    num_docs=0
+    num_pos=0
+    num_nnz=0
+    for doc in docs:
+        counter={}
+        for w in doc:
+            if not isinstance(w,unicode):
+                w=unicode(w,'utf-8')
+            counter[w]=counter.get(w,0)+1
+        order.extend(sorted(w for w in counter if w not in dfs))
+        for w,freq in counter.iteritems():
+            dfs[w]=dfs.get(w,0)+1
+            cfs[w]=cfs.get(w,0)+freq
+        num_docs+=1
+        num_pos+=sum(counter.itervalues())
+        num_nnz+=len(counter)
+    counts={'order':order,'dfs':dfs,'cfs':cfs,
+        'num_docs':num_docs,'num_pos':num_pos,'num_nnz':num_nnz}
+    return counts
+
+def sketch_documents(docs,max_vocab):
+    '''count the words of a stream of documents in bounded memory, keeping
+    approximate frequencies of (at least) the max_vocab most frequent words
+    in a :class:sketches.SpaceSaving sketch
+
+    Args:
+        docs (iterable): documents as lists of words
+        max_vocab (int): number of words to keep
+
+    Returns:
+        counts (dict): {'sketch': SpaceSaving sketch of the document frequencies,
+            with collection frequencies as its totals, 'num_docs', 'num_pos',
+            'num_nnz': corpus totals}
+    '''
+    counts={'sketch':SpaceSaving(max_vocab),'num_docs':0,'num_pos':0,'num_nnz':0}
+    for doc in docs:
+        sketch_document(counts,doc)
+    return counts
+
+def sketch_document(counts,doc):
+    '''add a document to bounded memory counts (see :func:sketch_documents)
+
+    Args:
+        counts (dict): the counts to add to
+        doc (list): the document as a list of words
+    '''
+    counter={}
+    for w in doc:
+        if not isinstance(w,unicode):
+            w=unicode(w,'utf-8')
+        counter[w]=counter.get(w,0)+1
+    sketch=counts['sketch']
+    for w in sorted(counter):#sorted, so pruning ties are stable
+        sketch.add(w,1,counter[w])
+    counts['num_docs']+=1
+    counts['num_pos']+=sum(counter.itervalues())
+    counts['num_nnz']+=len(counter)
+
+def _count(docs,max_vocab):
+    '''count a stream of documents exactly, or in bounded memory if max_vocab is given'''
+    if max_vocab:
+        return sketch_documents(docs,max_vocab)
+    return count_documents(docs)
+
+def _count_json_shard(args):
+    '''count the words of the records in one byte range shard of a json list file.
+    Run in a worker process by :func:build_dictionary
+
+    Args:
+        args (tuple): (source, start, end, blocks, sanitiser, max_vocab) the json
+            list file, the uncompressed byte range of the shard, the block table
+            of a compressed source, the sanitiser to build documents with and
+            the vocabulary budget (None to count exactly)
+
+    Returns:
+        counts (dict): the shard's counts (see :func:count_documents and :func:sketch_documents)
+    '''
+    source,start,end,blocks,sanitiser,max_vocab=args
+    def docs():
+        for line in line_index.iter_byte_range(source,start,end,blocks):
+            record=docIterators.parse_json_line(line)
+            doc=docIterators.record_doc(record,sanitiser,'SIMPLE')
+            yield [w for sent in doc for w in sent]
+    counts=_count(docs(),max_vocab)
+    docIterators.flush_sanitiser(sanitiser)
+    return counts
+
+def _count_iter_shard(args):
+    '''count the words of the documents in one shard of a DocumentIter.
+    Run in a worker process by :func:build_dictionary
+
+    Args:
+        args (tuple): (doc_iter, index, n_shards, max_vocab) the iterator (set to
+            the 'SIMPLE' iter_type), the shard to count and the vocabulary budget
+            (None to count exactly)
+
+    Returns:
+        counts (dict): the shard's counts (see :func:count_documents and :func:sketch_documents)
+    '''
+    doc_iter,index,n_shards,max_vocab=args
+    doc_iter.stats=IterStats(verbose=False)
+    counts=_count(doc_iter.shard(index,n_shards),max_vocab)
+    docIterators.flush_sanitiser(getattr(doc_iter,'sanitiser',None))
+    return counts
+
+def merge_counts(shard_counts,dictionary=None):
+    '''merge the counts of consecutive shards of a corpus into a dictionary.
+    Words are given ids in the order the shards first use them, so the ids are
+    those gensim would give building the dictionary in a single pass
+
+    Args:
+        shard_counts (iterable): counts of each shard (see :func:count_documents),
+            in data source order
+
+    Kwargs:
+        dictionary (gensim.corpora.Dictionary): dictionary to merge the counts into
+            (defaults to None, a new dictionary)
+
+    Returns:
+        dictionary (gensim.corpora.Dictionary): the merged dictionary
+    '''
+    if dictionary is None:
+        dictionary=corpora.Dictionary()
+    token2id=dictionary.token2id
+    dfs=dictionary.dfs
+    cfs=dictionary.cfs
+    for counts in shard_counts:
+        for w in counts['order']:
+            if w not in token2id:
+                token2id[w]=len(token2id)
+        for w,df in counts['dfs'].iteritems():
+            i=token2id[w]
+            dfs[i]=dfs.get(i,0)+df
+        for w,cf in counts['cfs'].iteritems():
+            i=token2id[w]
+            cfs[i]=cfs.get(i,0)+cf
+        dictionary.num_docs+=counts['num_docs']
+        dictionary.num_pos+=counts['num_pos']
+        dictionary.num_nnz+=counts['num_nnz']
+    dictionary.id2token={} #rebuilt on next lookup
+    return dictionary
+
+def merge_sketches(shard_counts,max_vocab):
+    '''merge the counts of shards of a corpus into a dictionary of its max_vocab
+    most frequent words. Exact shard counts and sketches can be mixed. Words are
+    given ids in order of (estimated) document frequency, most frequent first,
+    and their frequencies are estimates that may be too high by the sketch's error
+
+    Args:
+        shard_counts (iterable): counts of each shard (see :func:count_documents
+            and :func:sketch_documents)
+        max_vocab (int): number of words to keep
+
+    Returns:
+        dictionary (gensim.corpora.Dictionary): the dictionary
+    '''
+    sketch=SpaceSaving(max_vocab)
+    dictionary=corpora.Dictionary()
+    for counts in shard_counts:
+        if 'sketch' in counts:
+            sketch.merge(counts['sketch'])
+        else:
+            for w in counts['order']:
+                sketch.add(w,counts['dfs'][w],counts['cfs'][w])
+        dictionary.num_docs+=counts['num_docs']
+        dictionary.num_pos+=counts['num_pos']
+        dictionary.num_nnz+=counts['num_nnz']
+    for i,(w,df) in enumerate(sketch.top(max_vocab)):
+        dictionary.token2id[w]=i
+        dictionary.dfs[i]=df
+        dictionary.cfs[i]=sketch.total(w)
+    return dictionary
+
+def _merge(shard_counts,max_vocab):
+    '''merge shard counts into a dictionary, bounded by max_vocab if it is given'''
+    if max_vocab:
+        return merge_sketches(shard_counts,max_vocab)
+    return merge_counts(shard_counts)
+
+def build_dictionary(doc_iter,processes=None,shard_bytes=1<<23,max_vocab=None):
+    '''build a gensim dictionary of the documents of a DocumentIter in parallel.
+
+    JsonDiskIters are split into byte range shards that workers read, decode and
+    sanitise themselves. Other iterators that can seek to record positions
+    (SimpleDiskIter, CompiledIter) are split with DocumentIter.shard. Any other
+    iterator, and any iterator with a single process, is counted in this 
+    process. The word ids are the same whatever
+    the number of processes, and match corpora.Dictionary(doc_iter) when the
+    vocabulary stays under gensim's prune_at limit (no pruning is done here).
+
+    With max_vocab, memory is bounded instead: each shard is counted in a
+    :class:sketches.SpaceSaving sketch that is pruned as it fills, and the
+    dictionary keeps the max_vocab most frequent words (see :func:merge_sketches).
+
+    Args:
+        doc_iter (DocumentIter): iterator over the corpus
+
+    Kwargs:
+        processes (int): number of worker processes (defaults to None, one per cpu)
+        shard_bytes (int): target size of each json list file shard (defaults to 8MB)
+        max_vocab (int): vocabulary budget (defaults to None, count every word exactly)
+
+    Returns:
+        dictionary (gensim.corpora.Dictionary): the dictionary of the corpus
+    '''
+    if processes is None:
+        processes=multiprocessing.cpu_count()
+    if isinstance(doc_iter,docIterators.JsonDiskIter) and processes>1:
+        index=doc_iter.index
+        if index is None and line_index.codec_of(doc_iter.source) is not None:
+            index=doc_iter._get_index()#compressed sources need the block table to seek
+        if index is not None:
+            n_bytes=int(index.offsets[-1])
+            blocks=index.blocks
+        else:
+            n_bytes=os.path.getsize(doc_iter.source)
+            blocks=None
+        n_shards=max(processes,n_bytes//shard_bytes)
+        tasks=[(doc_iter.source,start,end,blocks,doc_iter.sanitiser,max_vocab)
+            for start,end in line_index.shard_ranges(doc_iter.source,n_shards,index)]
+        worker=_count_json_shard
+    elif docIterators.can_seek(doc_iter) and processes>1:
+        shard_iter=copy.copy(doc_iter)
+        shard_iter.iter_type='SIMPLE'
+        shard_iter.stats=None #IterStats callbacks may not pickle
+        tasks=[(shard_iter,i,processes,max_vocab) for i in range(processes)]
+        worker=_count_iter_shard
+    else:
+        iter_type=doc_iter.iter_type
+        doc_iter.iter_type='SIMPLE'
+        try:
+            counts=[_count(doc_iter,max_vocab)]
+        finally:
+            doc_iter.iter_type=iter_type
+        return _merge(counts,max_vocab)
+    print('Counting '+str(len(tasks))+' shards in '+str(processes)+' processes')
+    pool=multiprocessing.Pool(processes)
+    try:
+        dictionary=_merge(pool.imap(worker,tasks),max_vocab)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    return dictionary
@@ -0,0 +1,230 @@
+'''
+.. module:: pass_engine
+   :platform: Unix, OSX
+   :synopsis: single streaming passes over a DocumentIter that feed several
+       accumulators at once (dictionaries, counters, samples...)
+
+.. moduleauthor:: Patrick Lewis
+'''
+import abc
+import random
+import time
+from collections import Counter
+from gensim import corpora
+import docIterators
+import parallel_dictionary
+from sketches import SpaceSaving
+
+class Accumulator(object):
+    '''Abstract class for the consumers of a :class:PassEngine pass.
+
+    The engine calls add with every record of the pass, and result at the end.
+    '''
+    __metaclass__ = abc.ABCMeta
+    name='accumulator'
+
+    @abc.abstractmethod
+    def add(self,record,words):
+        '''consume a record
+
+        Args:
+            record: the record, as exported for the pass's iter_type
+            words (list): the words of the record's document
+        '''
+        return
+
+    @abc.abstractmethod
+    def result(self):
+        '''get the result of the pass'''
+        return
+
+class DictionaryAccumulator(Accumulator):
+    '''Builds a dictionary (with the document frequencies a tfidf model needs).
+    The words get the same ids as gensim.corpora.Dictionary(doc_iter) gives them,
+    or the ids of :func:parallel_dictionary.merge_sketches with a max_vocab budget
+    '''
+    name='dictionary'
+
+    def __init__(self,dictionary=None,max_vocab=None):
+        '''Create a DictionaryAccumulator
+
+        Kwargs:
+            dictionary (gensim.corpora.Dictionary or hashing.HashingDictionary): the
+                dictionary to add to (defaults to None, a new gensim dictionary)
+            max_vocab (int): vocabulary budget (defaults to None, every word is kept)
+        '''
+        self.max_vocab=max_vocab
+        if max_vocab:
+            self.counts={'sketch':SpaceSaving(max_vocab),'num_docs':0,'num_pos':0,'num_nnz':0}
+        elif dictionary is None:
+            dictionary=corpora.Dictionary()
+        self.dictionary=dictionary
+
+    def add(self,record,words):
+        if self.max_vocab:
+            parallel_dictionary.sketch_document(self.counts,words)
+        else:
+            self.dictionary.doc2bow(words,allow_update=True)
+
+    def result(self):
+        if self.max_vocab:
+            return parallel_dictionary.merge_sketches([self.counts],self.max_vocab)
+        return self.dictionary
+
+class WordFreqAccumulator(Accumulator):
+    '''Counts the occurrences of every word'''
+    name='word_freq'
+
+    def __init__(self):
+        self.counter=Counter()
+
+    def add(self,record,words):
+        self.counter.update(words)
+
+    def result(self):
+        return self.counter
+
+class DocFreqAccumulator(Accumulator):
+    '''Counts the number of documents each word occurs in'''
+    name='doc_freq'
+
+    def __init__(self):
+        self.counter=Counter()
+
+    def add(self,record,words):
+        self.counter.update(set(words))
+
+    def result(self):
+        return self.counter
+
+class DocLengthAccumulator(Accumulator):
+    '''Counts the number of documents of each length (in words)'''
+    name='doc_lengths'
+
+    def __init__(self):
+        self.counter=Counter()
+
+    def add(self,record,words):
+        self.counter[len(words)]+=1
+
+    def result(self):
+        return self.counter
+
+class SampleAccumulator(Accumulator):
+    '''Draws a uniform random sample of the records with a reservoir'''
+    name='sample'
+
+    def __init__(self,sample_size,seed=None):
+        '''Create a SampleAccumulator
+
+        Args:
+            sample_size (int): number of records to sample
+
+        Kwargs:
+            seed (int): seed for the random number generator (defaults to None, unseeded)
+        '''
+        self.sample_size=sample_size
+        self.rng=random.Random(seed)
+        self.reservoir=[]
+        self.n=0
+
+    def add(self,record,words):
+        if self.n<self.sample_size:
+            self.reservoir.append((self.n,record))
+        else:
+            j=self.rng.randint(0,self.n)
+            if j<self.sample_size:
+                self.reservoir[j]=(self.n,record)
+        self.n+=1
+
+    def result(self):
+        return [record for ind,record in sorted(self.reservoir,key=lambda x:x[0])]
+
+def record_words(record,iter_type):
+    '''get the words of a record exported for an iter_type
+
+    Args:
+        record: the record
+        iter_type (str): 'SIMPLE', 'DOC', 'DOI' or 'EVERYTHING'
+
+    Returns:
+        words (list): the words of the record's document
+    '''
+    if iter_type=='SIMPLE':
+        return record
+    if iter_type=='DOC':
+        doc=record
+    else:
+        doc=record['doc']
+    words=[w for sent in doc for w in sent]
+    return words
+
+class PassEngine(object):
+    '''Streams a DocumentIter once, feeding every record to several registered
+    accumulators, so a corpus needs one read of its data source however many
+    things are computed from it. The time each accumulator takes is kept in
+    summary alongside the iterator's own read, decode and sanitise times, and
+    reported through the iterator's IterStats (printed if it is verbose).
+    '''
+    iter_type='SIMPLE'
+
+    def __init__(self,doc_iter,accumulators=(),iter_type='SIMPLE'):
+        '''Create a PassEngine
+
+        Args:
+            doc_iter (DocumentIter): the iterator to stream
+
+        Kwargs:
+            accumulators (list): accumulators to register (defaults to none)
+            iter_type (str): iter_type to stream, one export per record: 'SIMPLE',
+                'DOC', 'DOI' or 'EVERYTHING' (defaults to 'SIMPLE')
+        '''
+        if iter_type in docIterators.MULTI_EXPORT_ITER_TYPES:
+            raise ValueError('PassEngine needs one export per record, not '+iter_type)
+        self.doc_iter=doc_iter
+        self.iter_type=iter_type
+        self.accumulators=[]
+        self.times={}
+        self.summary=None
+        for accumulator in accumulators:
+            self.add(accumulator)
+
+    def add(self,accumulator):
+        '''register an accumulator
+
+        Args:
+            accumulator (Accumulator): the accumulator. Its name must be unique
+        '''
+        if any(a.name==accumulator.name for a in self.accumulators):
+            raise ValueError('an accumulator named '+accumulator.name+' is already registered')
+        self.accumulators.append(accumulator)
+
+    def run(self):
+        '''stream the iterator once through the accumulators
+
+        Returns:
+            results (dict): {name (str): result} of each accumulator
+        '''
+        accumulators=self.accumulators
+        times=[0.]*len(accumulators)
+        n_records=0
+        iter_type=self.doc_iter.iter_type
+        self.doc_iter.iter_type=self.iter_type
+        start=time.time()
+        try:
+            for record in self.doc_iter:
+                words=record_words(record,self.iter_type)
+                for i,accumulator in enumerate(accumulators):
+                    t=time.time()
+                    accumulator.add(record,words)
+                    times[i]+=time.time()-t
+                n_records+=1
+        finally:
+            self.doc_iter.iter_type=iter_type
+        self.times={a.name:t for a,t in zip(accumulators,times)}
+        stats=self.doc_iter.get_stats()
+        self.summary={'records':n_records,'elapsed':time.time()-start,
+            'times':dict(stats.times),'accumulators':dict(self.times)}
+        stats.report_times([(a.name,t) for a,t in zip(accumulators,times)])
+        results={a.name:a.result() for a in accumulators}
+        return results
@@ -0,0 +1,218 @@
+'''
+.. module:: sampling
+   :platform: Unix, OSX
+   :synopsis: seeded random and stratified sampling of records from DocumentIters,
+       in a single pass or by jumping straight to the sampled records
+
+.. moduleauthor:: Patrick Lewis
+'''
+import itertools
+import math
+import random
+from operator import itemgetter
+import docIterators
+
+def _uniform(rng):
+    '''draw a uniform random number in the open interval (0,1)
+
+    Args:
+        rng (random.Random): the random number generator
+
+    Returns:
+        u (float): the random number
+    '''
+    u=0.
+    while u==0.:
+        u=rng.random()
+    return u
+
+def sample_positions(size,sample_size,seed=None):
+    '''choose sorted random positions from a population
+
+    Args:
+        size (int): number of items in the population
+        sample_size (int): number of positions to choose (all of them if larger than size)
+
+    Kwargs:
+        seed (int): seed for the random number generator (defaults to None, unseeded)
+
+    Returns:
+        positions (list): sorted list of distinct positions in [0,size)
+    '''
+    rng=random.Random(seed)
+    positions=sorted(rng.sample(xrange(size),min(sample_size,size)))
+    return positions
+
+def reservoir_sample(items,sample_size,seed=None):
+    '''uniformly sample from a stream of unknown length in a single pass, holding
+    only the sample in memory. Uses reservoir sampling with geometric skips
+    (Li's Algorithm L), so random numbers are drawn only for items that enter
+    the reservoir
+
+    Args:
+        items (iterable): the stream to sample from
+        sample_size (int): number of items to sample (all of them if the stream is shorter)
+
+    Kwargs:
+        seed (int): seed for the random number generator (defaults to None, unseeded)
+
+    Returns:
+        sample (list): the sampled items, in stream order
+    '''
+    rng=random.Random(seed)
+    items=iter(items)
+    reservoir=list(enumerate(itertools.islice(items,sample_size)))
+    if sample_size>0 and len(reservoir)==sample_size:
+        w=math.exp(math.log(_uniform(rng))/sample_size)
+        ind=sample_size-1
+        while True:
+            skip=int(math.log(_uniform(rng))/math.log(1-w))
+            ind+=skip+1
+            for item in itertools.islice(items,skip,skip+1):
+                break
+            else:#stream exhausted
+                break
+            reservoir[rng.randrange(sample_size)]=(ind,item)
+            w*=math.exp(math.log(_uniform(rng))/sample_size)
+    reservoir.sort(key=lambda x:x[0])
+    sample=[item for ind,item in reservoir]
+    return sample
+
+def _allocate(counts,sample_size,allocation):
+    '''split a sample size between strata
+
+    Args:
+        counts (list): number of items in each stratum
+        sample_size (int): total number of items to sample
+        allocation (str): 'proportional' to the stratum sizes or 'equal'
+
+    Returns:
+        quotas (list): number of items to sample from each stratum
+    '''
+    total=sum(counts)
+    sample_size=min(sample_size,total)
+    if allocation=='equal':
+        weights=[1.]*len(counts)
+    else:
+        weights=[float(c) for c in counts]
+    quotas=[0]*len(counts)
+    remaining=sample_size
+    open_strata=[i for i,c in enumerate(counts) if c>0]
+    while remaining>0 and open_strata:#strata smaller than their share pass on the excess
+        weight=sum(weights[i] for i in open_strata)
+        shares=[(remaining*weights[i]/weight,i) for i in open_strata]
+        given=0
+        for share,i in shares:
+            q=min(int(share),counts[i]-quotas[i])
+            quotas[i]+=q
+            given+=q
+        #hand out the remainder by largest fractional share
+        for share,i in sorted(shares,key=lambda x:(-(x[0]-int(x[0])),x[1])):
+            if given>=remaining:
+                break
+            if quotas[i]<counts[i]:
+                quotas[i]+=1
+                given+=1
+        remaining-=given
+        open_strata=[i for i in open_strata if quotas[i]<counts[i]]
+    return quotas
+
+def stratified_sample(items,sample_size,key,seed=None,allocation='proportional'):
+    '''sample from a stream in a single pass, splitting the sample between strata
+    (e.g. publishers or years). A reservoir of up to sample_size items is kept
+    for each stratum, and each stratum's quota is drawn from its reservoir at the end
+
+    Args:
+        items (iterable): the stream to sample from
+        sample_size (int): total number of items to sample
+        key (function): function mapping an item to its stratum
+
+    Kwargs:
+        seed (int): seed for the random number generator (defaults to None, unseeded)
+        allocation (str): 'proportional' to split the sample in proportion to
+            the stratum sizes, or 'equal' to sample the same number from each
+            stratum (defaults to 'proportional')
+
+    Returns:
+        sample (list): the sampled items, in stream order
+    '''
+    rng=random.Random(seed)
+    strata=[] #stratum keys in order of first appearance
+    reservoirs={}
+    counts={}
+    for ind,item in enumerate(items):
+        s=key(item)
+        n=counts.get(s)
+        if n is None:
+            strata.append(s)
+            reservoirs[s]=[]
+            n=0
+        counts[s]=n+1
+        if n<sample_size:
+            reservoirs[s].append((ind,item))
+        else:
+            j=rng.randint(0,n)
+            if j<sample_size:
+                reservoirs[s][j]=(ind,item)
+    quotas=_allocate([counts[s] for s in strata],sample_size,allocation)
+    chosen=[]
+    for s,quota in zip(strata,quotas):
+        chosen.extend(rng.sample(reservoirs[s],quota))
+    chosen.sort(key=lambda x:x[0])
+    sample=[item for ind,item in chosen]
+    return sample
+
+def sample_documents(doc_iter,sample_size,seed=None,stratify=None,allocation='proportional'):
+    '''Get a random sample of the records of a DocumentIter, as exports of its iter_type.
+
+    Iterators with an iter_positions method (JsonDiskIter, SimpleDiskIter,
+    CompiledIter and MongoIter) jump straight to the sampled records using the
+    line index or the database. Other iterators are sampled in a single pass.
+    
+    Stratified samples need a pass over the whole records to find their strata.
+    Iterators with iter_positions keep only the position and stratum of the 
+    records in the reservoirs and fetch the chosen records afterwards; others
+    keep only the exports of the records for the iter_type.
+
+    Args:
+        doc_iter (DocumentIter): the iterator to sample from
+        sample_size (int): number of records to sample
+
+    Kwargs:
+        seed (int): seed for the random number generator, so the same sample is
+            drawn from the same data source (defaults to None, unseeded)
+        stratify (str or function): record field (e.g. 'publisher') or function
+            of a record to stratify the sample by. Defaults to None, no stratification
+        allocation (str): how to split a stratified sample between strata,
+            'proportional' or 'equal' (see :func:stratified_sample)
+
+    Returns:
+        sample (list): the exports of the sampled records, in data source order
+    '''
+    iter_type=doc_iter.iter_type
+    can_jump=hasattr(doc_iter,'iter_positions') and not isinstance(doc_iter,docIterators.WrapperIter)
+    if stratify is not None:
+        if callable(stratify):
+            key=stratify
+        else:
+            key=lambda record: record.get(stratify)
+        doc_iter.iter_type='EVERYTHING'#one export (the whole record) per position
+        try:
+            if can_jump:#(position, stratum) pairs
+                items=((pos,key(record)) for pos,record in enumerate(doc_iter))
+            else:#(stratum, exports) pairs
+                items=((key(record),list(docIterators.record_exports(record,record.get('doc'),iter_type)))
+                    for record in doc_iter)
+            chosen=stratified_sample(items,sample_size,itemgetter(1 if can_jump else 0),seed,allocation)
+        finally:
+            doc_iter.iter_type=iter_type
+        if can_jump:
+            sample=list(doc_iter.iter_positions([pos for pos,stratum in chosen]))
+        else:
+            sample=[export for stratum,exports in chosen for export in exports]
+    elif can_jump:
+        positions=sample_positions(doc_iter.size,sample_size,seed)
+        sample=list(doc_iter.iter_positions(positions))
+    else:
+        sample=reservoir_sample(doc_iter,sample_size,seed)
+    return sample
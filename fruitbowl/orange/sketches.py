@@ -0,0 +1,345 @@
+'''
+.. module:: sketches
+   :platform: Unix, OSX
+   :synopsis: bounded memory, mergeable summaries of streams (heavy hitters,
+       distinct counts and frequencies), for counting the vocabulary of corpora
+       too large to count exactly
+
+.. moduleauthor:: Patrick Lewis
+'''
+import hashlib
+import heapq
+import math
+import struct
+from operator import itemgetter
+import numpy as np
+
+def hash64(item):
+    '''get a 64 bit hash of an item that is the same in every process and run,
+    so sketches built separately can be merged
+
+    Args:
+        item (unicode or str): the item
+
+    Returns:
+        h (int): the hash
+    '''
+    if isinstance(item,unicode):
+        item=item.encode('utf8')
+    h=struct.unpack('<Q',hashlib.md5(item).digest()[:8])[0]
+    return h
+
+class SpaceSaving(object):
+    '''Space-Saving heavy hitters sketch, counting the most frequent items of a
+    stream in memory bounded by its capacity.
+
+    Up to capacity*slack items are counted. When there are more, the sketch is
+    pruned back to the capacity most frequent, and the largest evicted count
+    becomes the floor that items entering the sketch start counting from. Counts
+    are therefore overestimates by at most the item's error (the floor when it
+    entered), and any item seen more than floor times is still in the sketch.
+
+    Each item can carry a second total (e.g. collection frequency alongside
+    document frequency) that is kept and estimated the same way.
+    '''
+    capacity=0
+    max_size=0
+    floor=0
+    total_floor=0
+    n=0
+
+    def __init__(self,capacity,slack=2.):
+        '''Create an empty SpaceSaving sketch
+
+        Args:
+            capacity (int): number of items to keep when pruning
+
+        Kwargs:
+            slack (float): how many times capacity items to count before pruning
+                (defaults to 2., so pruning costs O(log capacity) per item, amortised)
+        '''
+        self.capacity=capacity
+        self.max_size=max(capacity+1,int(capacity*slack))
+        self.counts={}
+        self.errors={}
+        self.totals={}
+        self.floor=0
+        self.total_floor=0
+        self.n=0
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __contains__(self,item):
+        return item in self.counts
+
+    def __getitem__(self,item):
+        '''get the estimated count of an item
+
+        Args:
+            item: the item
+
+        Returns:
+            count (int): the estimated count (an upper bound), 0 if the item
+                is not in the sketch
+        '''
+        count=self.counts.get(item,0)
+        return count
+
+    def add(self,item,count=1,total=0):
+        '''count an item
+
+        Args:
+            item: the item
+
+        Kwargs:
+            count (int): number of times to count the item (defaults to 1)
+            total (int): amount to add to the item's second total (defaults to 0)
+        '''
+        c=self.counts.get(item)
+        if c is None:
+            self.counts[item]=self.floor+count
+            self.errors[item]=self.floor
+            self.totals[item]=self.total_floor+total
+            if len(self.counts)>self.max_size:
+                self.prune()
+        else:
+            self.counts[item]=c+count
+            self.totals[item]+=total
+        self.n+=count
+
+    def update(self,items):
+        '''count each item of an iterable once
+
+        Args:
+            items (iterable): the items
+        '''
+        for item in items:
+            self.add(item)
+
+    def prune(self,size=None):
+        '''evict all but the most frequent items
+
+        Kwargs:
+            size (int): number of items to keep (defaults to None, the capacity)
+        '''
+        if size is None:
+            size=self.capacity
+        if len(self.counts)<=size:
+            return
+        keep=set(item for item,count in heapq.nlargest(size,self.counts.iteritems(),key=itemgetter(1)))
+        for item in self.counts.keys():
+            if item not in keep:
+                self.floor=max(self.floor,self.counts.pop(item))
+                self.total_floor=max(self.total_floor,self.totals.pop(item))
+                del self.errors[item]
+
+    def merge(self,other):
+        '''merge in a sketch of another stream, so this sketch summarises both.
+        Items missing from one sketch are counted as that sketch's floor, the
+        most they can have been seen there
+
+        Args:
+            other (SpaceSaving): the other sketch
+        '''
+        for item in set(self.counts).union(other.counts):
+            self.counts[item]=self.counts.get(item,self.floor)+other.counts.get(item,other.floor)
+            self.errors[item]=self.errors.get(item,self.floor)+other.errors.get(item,other.floor)
+            self.totals[item]=self.totals.get(item,self.total_floor)+other.totals.get(item,other.total_floor)
+        self.floor+=other.floor
+        self.total_floor+=other.total_floor
+        self.n+=other.n
+        if len(self.counts)>self.max_size:
+            self.prune()
+
+    def error(self,item):
+        '''get the maximum overestimate of an item's count
+
+        Args:
+            item: the item
+
+        Returns:
+            error (int): the maximum error (0 if the count is exact), the floor
+                if the item is not in the sketch
+        '''
+        error=self.errors.get(item,self.floor)
+        return error
+
+    def total(self,item):
+        '''get the estimated second total of an item
+
+        Args:
+            item: the item
+
+        Returns:
+            total (int): the estimated total, 0 if the item is not in the sketch
+        '''
+        total=self.totals.get(item,0)
+        return total
+
+    def top(self,n=None):
+        '''get the most frequent items
+
+        Kwargs:
+            n (int): number of items (defaults to None, the capacity)
+
+        Returns:
+            top (list): list of (item, estimated count) tuples, most frequent
+                first, ties broken by item
+        '''
+        if n is None:
+            n=self.capacity
+        top=sorted(self.counts.iteritems(),key=lambda x:(-x[1],x[0]))[:n]
+        return top
+
+class HyperLogLog(object):
+    '''HyperLogLog sketch, estimating the number of distinct items of a stream
+    in 2**precision bytes, with a relative error of about 1.04/sqrt(2**precision)
+    (0.8% at the default precision of 14)
+    '''
+    precision=14
+
+    def __init__(self,precision=14):
+        '''Create an empty HyperLogLog sketch
+
+        Kwargs:
+            precision (int): base 2 log of the number of registers (defaults to 14)
+        '''
+        self.precision=precision
+        self.registers=np.zeros(1<<precision,dtype=np.uint8)
+
+    def update(self,items):
+        '''add items to the sketch
+
+        Args:
+            items (iterable): the items
+        '''
+        self.update_hashes([hash64(item) for item in items])
+
+    def update_hashes(self,hashes):
+        '''add items to the sketch by their hashes (see :func:hash64)
+
+        Args:
+            hashes (list): the hashes of the items
+        '''
+        rest=64-self.precision
+        mask=(1<<rest)-1
+        indices=[]
+        ranks=[]
+        for h in hashes:
+            indices.append(h>>rest)
+            ranks.append(rest-(h&mask).bit_length()+1)#position of the first 1 bit
+        if indices:
+            np.maximum.at(self.registers,np.array(indices,dtype=np.int64),np.array(ranks,dtype=np.uint8))
+
+    def merge(self,other):
+        '''merge in a sketch of another stream, so this sketch summarises both
+
+        Args:
+            other (HyperLogLog): the other sketch, with the same precision
+        '''
+        if other.precision!=self.precision:
+            raise ValueError('can only merge HyperLogLog sketches of the same precision')
+        np.maximum(self.registers,other.registers,out=self.registers)
+
+    def count(self):
+        '''estimate the number of distinct items
+
+        Returns:
+            n (int): the estimate
+        '''
+        m=float(len(self.registers))
+        alpha=0.7213/(1+1.079/m)
+        estimate=alpha*m*m/np.sum(np.ldexp(1.,-self.registers.astype(np.int64)))
+        zeros=int(np.count_nonzero(self.registers==0))
+        if estimate<=2.5*m and zeros:#small range correction (linear counting)
+            estimate=m*math.log(m/zeros)
+        n=int(round(estimate))
+        return n
+
+class CountMinSketch(object):
+    '''Count-Min sketch, estimating the frequencies of the items of a stream in
+    a fixed (depth-by-width) table of counters. Estimates are overestimates, by
+    at most 2n/width with probability 1-(1/2)**depth for a stream of n items
+    '''
+    width=0
+    depth=0
+
+    def __init__(self,width=1<<18,depth=4):
+        '''Create an empty CountMinSketch
+
+        Kwargs:
+            width (int): number of counters in each row (defaults to 2**18)
+            depth (int): number of rows (defaults to 4)
+        '''
+        self.width=width
+        self.depth=depth
+        self.table=np.zeros((depth,width),dtype=np.int64)
+
+    def _columns(self,hashes):
+        '''get the counter of each item in each row, by double hashing
+
+        Args:
+            hashes (list): the hashes of the items (see :func:hash64)
+
+        Returns:
+            columns (numpy.2darray): (depth-by-n) array of counter indices
+        '''
+        hashes=np.array(hashes,dtype=np.uint64)
+        h1=(hashes&np.uint64(0xffffffff)).astype(np.int64)
+        h2=(hashes>>np.uint64(32)).astype(np.int64)|1
+        columns=(h1+np.arange(self.depth,dtype=np.int64)[:,None]*h2)%self.width
+        return columns
+
+    def add(self,items,counts=None):
+        '''count items
+
+        Args:
+            items (list): the items
+
+        Kwargs:
+            counts (list): number of times to count each item (defaults to None, once each)
+        '''
+        self.add_hashes([hash64(item) for item in items],counts)
+
+    def add_hashes(self,hashes,counts=None):
+        '''count items by their hashes (see :func:hash64)
+
+        Args:
+            hashes (list): the hashes of the items
+
+        Kwargs:
+            counts (list): number of times to count each item (defaults to None, once each)
+        '''
+        if not len(hashes):
+            return
+        if counts is None:
+            counts=np.ones(len(hashes),dtype=np.int64)
+        columns=self._columns(hashes)
+        rows=np.repeat(np.arange(self.depth),len(hashes))
+        np.add.at(self.table,(rows,columns.ravel()),np.tile(np.asarray(counts,dtype=np.int64),self.depth))
+
+    def estimate(self,items):
+        '''estimate the frequencies of items
+
+        Args:
+            items (list): the items
+
+        Returns:
+            estimates (numpy.array): the estimated frequency of each item
+        '''
+        if not len(items):
+            return np.zeros(0,dtype=np.int64)
+        columns=self._columns([hash64(item) for item in items])
+        estimates=self.table[np.arange(self.depth)[:,None],columns].min(axis=0)
+        return estimates
+
+    def merge(self,other):
+        '''merge in a sketch of another stream, so this sketch summarises both
+
+        Args:
+            other (CountMinSketch): the other sketch, with the same width and depth
+        '''
+        if (other.width,other.depth)!=(self.width,self.depth):
+            raise ValueError('can only merge CountMinSketches of the same width and depth')
+        self.table+=other.table
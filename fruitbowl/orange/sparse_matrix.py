@@ -0,0 +1,231 @@
+'''
+.. module:: sparse_matrix
+   :platform: Unix, OSX
+   :synopsis: corpora as scipy.sparse CSR bag-of-words and tfidf matrices with a
+       doi row index, saved as .npz files that are memory mapped when loaded
+
+.. moduleauthor:: Patrick Lewis
+'''
+import struct
+import zipfile
+import numpy as np
+import scipy.sparse
+from tfidf_export import EPS
+
+def _mmap_npz(file_name):
+    '''memory map the arrays of an uncompressed .npz file (as written by numpy.savez)
+
+    Args:
+        file_name (str): the .npz file
+
+    Returns:
+        arrays (dict): {name (str): read-only numpy.memmap} of the arrays in the file.
+            Arrays stored compressed are loaded into memory instead
+    '''
+    arrays={}
+    with zipfile.ZipFile(file_name) as z:
+        members=z.infolist()
+    loaded=None
+    with open(file_name,'rb') as f:
+        for member in members:
+            name=member.filename[:-4] if member.filename.endswith('.npy') else member.filename
+            if member.compress_type!=zipfile.ZIP_STORED:
+                if loaded is None:
+                    loaded=np.load(file_name)
+                arrays[name]=loaded[name]
+                continue
+            #the member's data follows its local file header
+            f.seek(member.header_offset)
+            local=f.read(30)
+            name_len,extra_len=struct.unpack('<HH',local[26:30])
+            offset=member.header_offset+30+name_len+extra_len
+            f.seek(offset)
+            version=np.lib.format.read_magic(f)
+            if version==(1,0):
+                shape,fortran,dtype=np.lib.format.read_array_header_1_0(f)
+            else:
+                shape,fortran,dtype=np.lib.format.read_array_header_2_0(f)
+            if dtype.hasobject or not np.prod(shape):
+                if loaded is None:
+                    loaded=np.load(file_name)
+                arrays[name]=loaded[name]
+                continue
+            arrays[name]=np.memmap(file_name,dtype=dtype,mode='r',shape=shape,
+                order='F' if fortran else 'C',offset=f.tell())
+    return arrays
+
+class CorpusMatrix(object):
+    '''A corpus as a scipy.sparse CSR matrix with one row per document (bag-of-words
+    counts or tfidf weights) and one column per token id, with a doi row index.
+
+    Saved matrices are .npz files readable by scipy.sparse.load_npz. They are
+    stored uncompressed, so :method: load can memory map them.
+    '''
+    matrix=None
+
+    def __init__(self,matrix,dois):
+        '''Create a CorpusMatrix
+
+        Args:
+            matrix (scipy.sparse.csr_matrix): (n-by-v) matrix, one row per document
+            dois (list): doi of each row
+        '''
+        self.matrix=matrix
+        self.dois=list(dois)
+        self.rows={doi:i for i,doi in enumerate(self.dois)}
+
+    def __len__(self):
+        return len(self.dois)
+
+    def __contains__(self,doi):
+        return doi in self.rows
+
+    def get(self,doi):
+        '''get the row of a single document
+
+        Args:
+            doi (str): doi of the document
+
+        Returns:
+            row (scipy.sparse.csr_matrix): (1-by-v) row of the document, None if it is
+                not in the matrix
+        '''
+        row=self.rows.get(doi)
+        if row is None:
+            return None
+        return self.matrix[row]
+
+    def get_matrix(self,dois):
+        '''get the rows of a set of documents
+
+        Args:
+            dois (list): dois of the documents
+
+        Returns:
+            matrix (scipy.sparse.csr_matrix): the rows of the documents
+            found (list): the dois in row order (dois not in the matrix are dropped)
+        '''
+        found=[doi for doi in dois if doi in self.rows]
+        matrix=self.matrix[[self.rows[doi] for doi in found]]
+        return matrix,found
+
+    def most_similar(self,doi,topn=10):
+        '''find the documents most similar to a document, by the dot product of
+        their rows (cosine similarity for tfidf rows, which have unit length)
+
+        Args:
+            doi (str): doi of the document
+
+        Kwargs:
+            topn (int): number of documents to return (defaults to 10)
+
+        Returns:
+            sims (list): list of (doi (str), similarity (float)) tuples, most similar
+                first, excluding the document itself
+        '''
+        row=self.get(doi)
+        if row is None:
+            return []
+        scores=np.asarray(self.matrix.dot(row.T).todense()).ravel()
+        scores[self.rows[doi]]=-np.inf
+        topn=min(topn,len(scores)-1)
+        if topn<=0:
+            return []
+        best=np.argpartition(-scores,topn-1)[:topn]
+        best=best[np.argsort(-scores[best],kind='mergesort')]
+        sims=[(self.dois[i],float(scores[i])) for i in best]
+        return sims
+
+    def save(self,file_name):
+        '''save the matrix and its dois as an uncompressed .npz file
+
+        Args:
+            file_name (str): name of the .npz file
+        '''
+        m=self.matrix
+        with open(file_name,'wb') as f:#a file object, so numpy does not add .npz
+            np.savez(f,format=np.array('csr'),shape=np.array(m.shape),data=m.data,
+                indices=m.indices,indptr=m.indptr,dois=np.array(self.dois,dtype=np.unicode_))
+
+    @classmethod
+    def load(cls,file_name,mmap=True):
+        '''load a matrix saved with :method: save
+
+        Args:
+            file_name (str): name of the .npz file
+
+        Kwargs:
+            mmap (bool): memory map the matrix arrays rather than reading them
+                into memory (defaults to True)
+
+        Returns:
+            corpus_matrix (CorpusMatrix): the matrix
+        '''
+        arrays=_mmap_npz(file_name) if mmap else np.load(file_name)
+        shape=tuple(int(n) for n in arrays['shape'])
+        matrix=scipy.sparse.csr_matrix((arrays['data'],arrays['indices'],arrays['indptr']),
+            shape=shape,copy=False)
+        corpus_matrix=cls(matrix,np.array(arrays['dois']).tolist())
+        return corpus_matrix
+
+def tfidf_matrix(bow,idfs):
+    '''weight a bag-of-words matrix by idf and normalise its rows to unit length,
+    as the default gensim.models.TfidfModel does
+
+    Args:
+        bow (scipy.sparse.csr_matrix): bag-of-words counts, one row per document
+        idfs (numpy.array): idf of each token id
+
+    Returns:
+        tfidf (scipy.sparse.csr_matrix): float32 tfidf weights, one row per document
+    '''
+    data=bow.data*idfs[bow.indices]
+    doc_of_entry=np.repeat(np.arange(bow.shape[0]),np.diff(bow.indptr))
+    norms=np.sqrt(np.bincount(doc_of_entry,weights=data**2,minlength=bow.shape[0]))
+    entry_norms=norms[doc_of_entry]
+    data=np.where(entry_norms>0,data/np.where(entry_norms>0,entry_norms,1.),0.)
+    data[np.abs(data)<=EPS]=0.
+    tfidf=scipy.sparse.csr_matrix((data.astype(np.float32),bow.indices.copy(),bow.indptr.copy()),
+        shape=bow.shape)
+    tfidf.eliminate_zeros()
+    return tfidf
+
+def build_matrices(doc_iter,weighter):
+    '''build the bag-of-words and tfidf matrices of a corpus in a single pass
+
+    Args:
+        doc_iter (DocumentIter): iterator supporting the 'DOI' iter_type
+            (JsonDiskIter, MongoIter or CompiledIter)
+        weighter (orange.tfidf_export.TfidfWeighter): maps words to token ids and
+            holds the idfs
+
+    Returns:
+        bow (CorpusMatrix): int32 bag-of-words counts (words not in the dictionary are dropped)
+        tfidf (CorpusMatrix): float32 tfidf weights
+    '''
+    iter_type=doc_iter.iter_type
+    doc_iter.iter_type='DOI'
+    dois=[]
+    indices=[]
+    data=[]
+    indptr=[0]
+    n_entries=0
+    try:
+        for rec in doc_iter:
+            ids=weighter.token_ids([w for sent in rec['doc'] for w in sent])
+            ids,counts=np.unique(ids[ids>=0],return_counts=True)
+            indices.append(ids)
+            data.append(counts.astype(np.int32))
+            n_entries+=len(ids)
+            indptr.append(n_entries)
+            dois.append(rec['doi'])
+    finally:
+        doc_iter.iter_type=iter_type
+    shape=(len(dois),len(weighter.idfs))
+    index_dtype=np.int32 if n_entries<2**31 else np.int64
+    indices=np.concatenate(indices).astype(index_dtype) if indices else np.zeros(0,dtype=index_dtype)
+    data=np.concatenate(data) if data else np.zeros(0,dtype=np.int32)
+    matrix=scipy.sparse.csr_matrix((data,indices,np.array(indptr,dtype=index_dtype)),shape=shape)
+    bow=CorpusMatrix(matrix,dois)
+    tfidf=CorpusMatrix(tfidf_matrix(matrix,weighter.idfs),dois)
+    return bow,tfidf
@@ -0,0 +1,298 @@
+'''
+.. module:: tfidf_export
+   :platform: Unix, OSX
+   :synopsis: batched export of corpora to json with document and sentence tfidf
+       weights, computed with numpy and written by a pool of worker processes
+
+.. moduleauthor:: Patrick Lewis
+'''
+import copy
+import json
+import multiprocessing
+import os
+import shutil
+import numpy as np
+from gensim import matutils, utils
+import docIterators
+import hashing
+import line_index
+from iter_stats import IterStats
+
+EPS=1e-12 #weights this small are dropped by gensim.models.TfidfModel
+
+class TfidfWeighter(object):
+    '''Computes the tfidf weight of every word of a document, for the whole
+    document and for each of its sentences, with the same weights as
+    gensim.models.TfidfModel. Each word is looked up in the dictionary once, and
+    the weights are computed from the resulting array of token ids with numpy.
+
+    Only the default tfidf model (identity term frequency, idf from the
+    dictionary and unit length normalisation) is vectorised. Other models are
+    applied through gensim, one document and sentence at a time.
+    '''
+    token2id=None
+    id_range=0
+
+    def __init__(self,corpus):
+        '''Create a TfidfWeighter for a Corpus
+
+        Args:
+            corpus (orange.corpus.Corpus): the corpus, with a tfidf model
+        '''
+        model=corpus.tfidf_model
+        if corpus.hashing:
+            self.id_range=corpus.dictionary.id_range
+        else:
+            self.token2id=corpus.inv_dict
+        self.vectorised=(model.smartirs is None and model.pivot is None and
+            model.normalize in (True,matutils.unitvec) and
+            model.wlocal is utils.identity)
+        n_ids=max(len(model.idfs) and max(model.idfs)+1,self.id_range)
+        self.idfs=np.zeros(n_ids)
+        for token_id,idf in model.idfs.iteritems():
+            self.idfs[token_id]=idf if abs(idf)>EPS else 0.
+        self.model=None if self.vectorised else model
+        self.corpus=None if self.vectorised else corpus
+
+    def token_ids(self,words):
+        '''get the token ids of a list of words
+
+        Args:
+            words (list): the words
+
+        Returns:
+            ids (numpy.array): the token id of each word, -1 for words not in the dictionary
+        '''
+        if self.token2id is None:
+            ids=[hashing.hash_token(w,self.id_range) for w in words]
+        else:
+            get=self.token2id.get
+            ids=[get(w,-1) for w in words]
+        ids=np.array(ids,dtype=np.int64)
+        return ids
+
+    def _weigh_groups(self,ids,groups,n_groups):
+        '''get the tfidf weight of each word in its group (document or sentence)
+
+        Args:
+            ids (numpy.array): token id of each word (-1 if unknown)
+            groups (numpy.array): group of each word
+            n_groups (int): number of groups
+
+        Returns:
+            weights (numpy.array): the weight of each word
+        '''
+        n_ids=len(self.idfs)+1
+        keys,inverse,tfs=np.unique(groups*n_ids+ids+1,return_inverse=True,return_counts=True)
+        key_ids=keys%n_ids-1
+        idfs=np.where(key_ids>=0,self.idfs[np.maximum(key_ids,0)],0.)
+        vals=tfs*idfs
+        #bincount sums the squares in token id order, as gensim.matutils.unitvec does
+        norms=np.sqrt(np.bincount(keys//n_ids,weights=vals**2,minlength=n_groups))
+        key_norms=norms[keys//n_ids]
+        vals=np.where(key_norms>0,vals/np.where(key_norms>0,key_norms,1.),0.)
+        vals[np.abs(vals)<=EPS]=0.
+        weights=vals[inverse]
+        return weights
+
+    def weigh(self,doc):
+        '''get the tfidf weights of the words of a document
+
+        Args:
+            doc (list): the document, a list of sentences (lists of words)
+
+        Returns:
+            doc_weights (list): for each sentence, the weight of each word in the whole document
+            sent_weights (list): for each sentence, the weight of each word in the sentence
+        '''
+        if not self.vectorised:
+            return self._weigh_gensim(doc)
+        lengths=[len(sent) for sent in doc]
+        ids=self.token_ids([w for sent in doc for w in sent])
+        if not len(ids):
+            return [[] for sent in doc],[[] for sent in doc]
+        doc_vals=self._weigh_groups(ids,np.zeros(len(ids),dtype=np.int64),1).tolist()
+        sents=np.repeat(np.arange(len(doc),dtype=np.int64),lengths)
+        sent_vals=self._weigh_groups(ids,sents,len(doc)).tolist()
+        doc_weights=[]
+        sent_weights=[]
+        start=0
+        for length in lengths:
+            doc_weights.append(doc_vals[start:start+length])
+            sent_weights.append(sent_vals[start:start+length])
+            start+=length
+        return doc_weights,sent_weights
+
+    def _weigh_gensim(self,doc):
+        '''get the tfidf weights of the words of a document with the gensim model
+        (see :method:weigh)'''
+        words=[w for sent in doc for w in sent]
+        doc_tfdict=dict(self.model[self.corpus.get_bow_doc(words)])
+        doc_weights=[[doc_tfdict.get(self.corpus.token_id(w),0.) for w in sent] for sent in doc]
+        sent_weights=[]
+        for sent in doc:
+            sent_tfdict=dict(self.model[self.corpus.get_bow_doc(sent)])
+            sent_weights.append([sent_tfdict.get(self.corpus.token_id(w),0.) for w in sent])
+        return doc_weights,sent_weights
+
+def export_records(records,f,weighter=None,batch_size=1000):
+    '''write records to a file as json lines, with tfidf weights
+
+    Args:
+        records (iterable): records with a 'doc' field (the 'EVERYTHING' iter_type)
+        f (file): file to write to
+
+    Kwargs:
+        weighter (TfidfWeighter): weighter to add 'tfidf-weights' with (defaults
+            to None, records are written as they are)
+        batch_size (int): number of lines to write at a time (defaults to 1000)
+
+    Returns:
+        n_records (int): number of records written
+    '''
+    lines=[]
+    n_records=0
+    for record in records:
+        if weighter is not None:
+            doc_weights,sent_weights=weighter.weigh(record['doc'])
+            record['tfidf-weights']={'doc-weights':doc_weights,'sent-weights':sent_weights}
+        lines.append(json.dumps(record))
+        n_records+=1
+        if len(lines)>=batch_size:
+            lines.append('')
+            f.write('\n'.join(lines))
+            lines=[]
+    if lines:
+        lines.append('')
+        f.write('\n'.join(lines))
+    return n_records
+
+_weighter=None #TfidfWeighter of the worker processes, set by _init_worker
+
+def _init_worker(weighter):
+    '''keep the weighter in a worker process, so it is sent to each worker once'''
+    global _weighter
+    _weighter=weighter
+
+def _export_json_shard(args):
+    '''export the records in one byte range shard of a json list file to a part
+    file. Run in worker processes by :func:export_corpus
+
+    Args:
+        args (tuple): (source, start, end, blocks, sanitiser, part_file) the json
+            list file, the uncompressed byte range of the shard, the block table
+            of a compressed source, the sanitiser to build documents with and
+            the file to write
+
+    Returns:
+        n_records (int): number of records exported
+    '''
+    source,start,end,blocks,sanitiser,part_file=args
+    def records():
+        for line in line_index.iter_byte_range(source,start,end,blocks):
+            record=docIterators.parse_json_line(line)
+            doc=docIterators.record_doc(record,sanitiser,'EVERYTHING')
+            for export in docIterators.record_exports(record,doc,'EVERYTHING'):
+                yield export
+    with open(part_file,'w') as f:
+        n_records=export_records(records(),f,_weighter)
+    docIterators.flush_sanitiser(sanitiser)
+    return n_records
+
+def _export_iter_shard(args):
+    '''export the records in one shard of a DocumentIter to a part file.
+    Run in worker processes by :func:export_corpus
+
+    Args:
+        args (tuple): (doc_iter, index, n_shards, part_file) the iterator (set to
+            the 'EVERYTHING' iter_type), the shard to export and the file to write
+
+    Returns:
+        n_records (int): number of records exported
+    '''
+    doc_iter,index,n_shards,part_file=args
+    doc_iter.stats=IterStats(verbose=False)
+    with open(part_file,'w') as f:
+        n_records=export_records(doc_iter.shard(index,n_shards),f,_weighter)
+    docIterators.flush_sanitiser(getattr(doc_iter,'sanitiser',None))
+    return n_records
+
+def merge_files(part_files,file_name):
+    '''concatenate part files into one file, deleting them
+
+    Args:
+        part_files (list): the part files, in order
+        file_name (str): name of the merged file
+    '''
+    with open(file_name,'wb') as f:
+        for part_file in part_files:
+            with open(part_file,'rb') as part:
+                shutil.copyfileobj(part,f,1<<20)
+            os.remove(part_file)
+
+def export_corpus(doc_iter,file_name,weighter=None,processes=1,merge=True,shard_bytes=1<<23):
+    '''export the records of a DocumentIter to json lines, with tfidf weights.
+
+    JsonDiskIters are split into byte range shards, and other iterators that can
+    seek to record positions with DocumentIter.shard, which worker processes
+    export to part files named file_name.00000, file_name.00001... in data source
+    order. Other iterators are exported in this process.
+
+    Args:
+        doc_iter (DocumentIter): iterator over the records
+        file_name (str): name of the file to write
+
+    Kwargs:
+        weighter (TfidfWeighter): weighter to add 'tfidf-weights' with (defaults
+            to None, no weights)
+        processes (int): number of worker processes (defaults to 1, export in this process)
+        merge (bool): concatenate the part files into file_name (defaults to True)
+        shard_bytes (int): target size of each json list file shard (defaults to 8MB)
+
+    Returns:
+        files (list): names of the files written
+    '''
+    iter_type=doc_iter.iter_type
+    doc_iter.iter_type='EVERYTHING'
+    try:
+        if isinstance(doc_iter,docIterators.JsonDiskIter) and processes>1:
+            index=doc_iter.index
+            if index is None and line_index.codec_of(doc_iter.source) is not None:
+                index=doc_iter._get_index()#compressed sources need the block table to seek
+            if index is not None:
+                n_bytes=int(index.offsets[-1])
+                blocks=index.blocks
+            else:
+                n_bytes=os.path.getsize(doc_iter.source)
+                blocks=None
+            n_shards=max(processes,n_bytes//shard_bytes)
+            ranges=line_index.shard_ranges(doc_iter.source,n_shards,index)
+            part_files=[file_name+'.%05d'%i for i in range(len(ranges))]
+            tasks=[(doc_iter.source,start,end,blocks,doc_iter.sanitiser,part_file)
+                for (start,end),part_file in zip(ranges,part_files)]
+            worker=_export_json_shard
+        elif docIterators.can_seek(doc_iter) and processes>1:
+            shard_iter=copy.copy(doc_iter)
+            shard_iter.stats=None #IterStats callbacks may not pickle
+            part_files=[file_name+'.%05d'%i for i in range(processes)]
+            tasks=[(shard_iter,i,processes,part_file) for i,part_file in enumerate(part_files)]
+            worker=_export_iter_shard
+        else:
+            with open(file_name,'w') as f:#json.dumps escapes non-ascii characters
+                export_records(doc_iter,f,weighter)
+            return [file_name]
+    finally:
+        doc_iter.iter_type=iter_type
+    print('Exporting '+str(len(tasks))+' shards in '+str(processes)+' processes')
+    pool=multiprocessing.Pool(processes,_init_worker,(weighter,))
+    try:
+        for n_records in pool.imap(worker,tasks):
+            pass
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    if merge:
+        merge_files(part_files,file_name)
+        return [file_name]
+    return part_files
@@ -15,24 +15,38 @@ from fruitbowl.apple import analysis_tools
 import collections
 import csv
 
-def get_vecs(doi_records,required_dois):
+def get_vecs(doi_records,required_dois,store=None):
     '''get matrix of vectors for some/all records supplied in 'doi_records'
     
     Args:
         doi_records (list): list of meta-data record dictionaries
-            Must have vector representations under keyword 'vector'
+            Must have vector representations under keyword 'vector'.
+            Not used (may be None) if store is given
         required_dois (list): list of dois from doi_records to build 
             matrix of vectors fro
     
+    Kwargs:
+        store (apple.vector_store.VectorStore): store to read the vectors from,
+            in the order of required_dois. Every doi must be in the store (a 
+            KeyError is raised otherwise, as the matrix columns would no longer 
+            line up with required_dois). Defaults to None (use doi_records)
+    
     Returns:
         matrix (np.2darray): (d-by-n) matrix of document vectors from dois in required_dois
     '''
+    if store is not None:
+        matrix,found=store.get_matrix(required_dois)
+        if len(found)<len(required_dois):
+            missing=set(required_dois).difference(found)
+            raise KeyError(str(len(missing))+' dois are not in the vector store, e.g. '+str(sorted(missing)[0]))
+        return matrix
+    required=set(required_dois)
     vecs=[]
     for doi,value in doi_records.iteritems():
-        if doi in required_dois:
+        if doi in required:
             vecs.append(np.array(value['vector']))
     matrix=np.transpose(np.array(vecs))
-    return Matrix 
+    return matrix
     
 def get_communities(csv_file_name,cleanup=True):
     '''imports document communities detailed in csv_file_name.
@@ -104,7 +118,8 @@ def get_modularity(
     doi_dict= get_communities(subfile+'/'+outfilename)
     return doi_dict
 
-def generate_communities(mat,sample,max_no_communities=100,min_community_pop=10,max_community_pop=100):
+def generate_communities(mat,sample,max_no_communities=100,min_community_pop=10,max_community_pop=100,
+        store=None):
     '''Divide set of documents into modularity communities.
     
     Args:
@@ -115,6 +130,8 @@ def generate_communities(mat,sample,max_no_communities=100,min_community_pop=10,
         max_no_communities (int): target number of communities to divide into (default 100)
         min_community_pop (int): lower bound target for community populations to divide into (default 10)
         max_community_pop (int): upper bound target for community populations to divide into (default 100)
+        store (apple.vector_store.VectorStore): store to read the document vectors 
+            from when subdividing (default None, the vectors in sample are used)
         
     Return:
         communtities_expo (dict): community index keys with lists of dois 
@@ -147,7 +164,7 @@ def generate_communities(mat,sample,max_no_communities=100,min_community_pop=10,
             comm=super_communities.pop()
             dois=[k for k,v in sample.iteritems() if comm in v['communities']]
         #get next vectors
-        vecs=get_vecs(sample,dois)
+        vecs=get_vecs(sample,dois,store=store)
         #create next matrix
         mat=analysis_tools.cosine_mat(vecs,vecs)
         print('Reducing community '+str(comm))
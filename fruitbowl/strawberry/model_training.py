@@ -14,7 +14,8 @@ def train_doc2vec(doc_iter,epochs=24,save=False,save_name='doc2vec',dimensionali
     Args:
         doc_iterator (orange.doc_iterator.DocumentIter): document iterator for 
             streaming documents into the model sentence by sentece. Needs 
-            to be JsonDiskIter or MongoIter
+            to be JsonDiskIter, MongoIter or CompiledIter (see
+            orange.docIterators.compile_corpus for fast repeated epochs)
     
     Kwargs:
         epochs (int): number of epochs to train for. Defaults to 24
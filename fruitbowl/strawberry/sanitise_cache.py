@@ -0,0 +1,216 @@
+'''
+.. module:: sanitise_cache
+   :platform: Unix, OSX
+   :synopsis: persistent cache of sanitised sentences, keyed by sanitiser
+       configuration and sentence content
+.. moduleauthor:: Patrick Lewis
+'''
+import atexit
+import hashlib
+import os
+import sqlite3
+import threading
+import weakref
+
+_open_caches=weakref.WeakSet() #caches with a connection in this process
+
+def _flush_open_caches():
+    '''flush the caches still open when the interpreter exits'''
+    for cache in list(_open_caches):
+        cache.flush()
+
+atexit.register(_flush_open_caches)
+
+class SanitiseCache(object):
+    '''On-disk cache of sanitised sentences, stored in an sqlite database.
+
+    Entries are keyed by a hash of the sanitiser fingerprint (its class,
+    punctuation, stopwords and stemming algorithm) and the input sentence, so one
+    cache can be shared by several sanitisers and re-used between corpus builds.
+    The number of entries is bounded, evicting the least recently used entries.
+
+    Attach to a sanitiser with the sanitiser's cache keyword or
+    :method: Sanitiser.set_cache
+
+    The database is opened lazily in each process that uses the cache, and the
+    connection is shared by its threads under a lock. New entries are written
+    every flush_every lookups, on :method: flush or :method: close (or leaving
+    a with block), and when the interpreter exits. Pickled copies (e.g. in
+    worker processes) start with no pending entries, and must be flushed
+    before they are discarded, as the workers of the orange package do at
+    the end of each shard.
+    '''
+    db_file=''
+    max_entries=0
+    hits=0
+    misses=0
+    evictions=0
+
+    def __init__(self,db_file,max_entries=1000000,flush_every=10000):
+        '''Open (or create) a SanitiseCache
+
+        Args:
+            db_file (str): sqlite database file to store the cache in
+
+        Kwargs:
+            max_entries (int): maximum number of sentences to keep (defaults to 1000000)
+            flush_every (int): number of lookups between commits of new entries
+                and recency updates to disk (defaults to 10000)
+        '''
+        self.db_file=db_file
+        self.max_entries=max_entries
+        self.flush_every=flush_every
+        self.hits=0
+        self.misses=0
+        self.evictions=0
+        self.n_entries=0
+        self.clock=0
+        self._reset()
+        with self.lock:
+            self._connection()
+
+    def _reset(self):
+        '''forget the database connection and pending writes'''
+        self.conn=None
+        self.pid=None #process the connection was opened in
+        self.lock=threading.RLock()
+        self.new={} #key:value entries not yet written
+        self.used={} #key:clock recency updates not yet written
+
+    def _connection(self):
+        '''get the database connection of this process, opening it on first
+        use (call with self.lock held)
+
+        Returns:
+            conn (sqlite3.Connection): the connection
+        '''
+        if self.pid!=os.getpid():
+            self.new={} #writes pending in the parent process are the parent's to make
+            self.used={}
+            self.conn=sqlite3.connect(self.db_file,timeout=60,check_same_thread=False)
+            self.conn.execute('CREATE TABLE IF NOT EXISTS sanitised '
+                '(key TEXT PRIMARY KEY, value TEXT, last_used INTEGER)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS lru ON sanitised (last_used)')
+            self.conn.commit()
+            self.n_entries,last=self.conn.execute(
+                'SELECT COUNT(*), MAX(last_used) FROM sanitised').fetchone()
+            self.clock=max(self.clock,last or 0)
+            self.pid=os.getpid()
+            _open_caches.add(self)
+        return self.conn
+
+    def __getstate__(self):
+        '''pickle without the database connection, lock or pending writes
+        (for worker processes)'''
+        state=self.__dict__.copy()
+        for k in ('conn','pid','lock','new','used'):
+            del state[k]
+        return state
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        self._reset()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.close()
+
+    def sanitise(self,sanitiser,sentence):
+        '''get the sanitised form of a sentence from the cache, sanitising
+        and storing it if it is not cached
+
+        Args:
+            sanitiser (Sanitiser): sanitiser to sanitise sentence with
+            sentence (str): sentence to sanitise
+
+        Returns:
+            export (str): the sanitised sentence
+        '''
+        if isinstance(sentence,unicode):
+            encoded=sentence.encode('utf8')
+        else:
+            encoded=sentence
+        key=hashlib.md5(sanitiser.fingerprint()+encoded).hexdigest()
+        with self.lock:
+            conn=self._connection()
+            export=self.new.get(key)
+            if export is None:
+                row=conn.execute('SELECT value FROM sanitised WHERE key=?',(key,)).fetchone()
+                if row is not None:
+                    export=row[0]
+        if export is None:
+            export=sanitiser.sanitise(sentence)#outside the lock, so threads sanitise concurrently
+            with self.lock:
+                self.new[key]=export
+                self.misses+=1
+        else:
+            with self.lock:
+                self.hits+=1
+        with self.lock:
+            self.clock+=1
+            self.used[key]=self.clock
+            if len(self.used)>=self.flush_every:
+                self.flush()
+        return export
+
+    def flush(self):
+        '''write new entries and recency updates to disk, evicting the least
+        recently used entries if the cache is over size'''
+        with self.lock:
+            if self.pid!=os.getpid():#nothing written in this process
+                return
+            conn=self.conn
+            if self.new:
+                conn.executemany('INSERT OR REPLACE INTO sanitised VALUES (?,?,?)',
+                    ((k,v,self.used.get(k,self.clock)) for k,v in self.new.iteritems()))
+                self.n_entries+=len(self.new)
+            conn.executemany('UPDATE sanitised SET last_used=? WHERE key=?',
+                ((c,k) for k,c in self.used.iteritems() if k not in self.new))
+            self.new={}
+            self.used={}
+            if self.n_entries>self.max_entries:#recount, other processes may share the database
+                self.n_entries=conn.execute('SELECT COUNT(*) FROM sanitised').fetchone()[0]
+            if self.n_entries>self.max_entries:
+                excess=self.n_entries-self.max_entries
+                conn.execute('DELETE FROM sanitised WHERE key IN '
+                    '(SELECT key FROM sanitised ORDER BY last_used LIMIT ?)',(excess,))
+                self.evictions+=excess
+                self.n_entries=self.max_entries
+            conn.commit()
+
+    def close(self):
+        '''flush the cache to disk and close the database. The database is
+        opened again if the cache is used after closing'''
+        with self.lock:
+            if self.pid!=os.getpid():
+                return
+            self.flush()
+            self.conn.close()
+            self.conn=None
+            self.pid=None
+            _open_caches.discard(self)
+
+    def hit_rate(self):
+        '''get the fraction of lookups answered from the cache
+
+        Returns:
+            rate (float): hits/(hits+misses), 0. if there have been no lookups
+        '''
+        lookups=self.hits+self.misses
+        rate=float(self.hits)/lookups if lookups else 0.
+        return rate
+
+    def stats(self):
+        '''get the cache counters
+
+        Returns:
+            stats (dict): hits, misses, evictions, hit_rate and entries of the cache
+        '''
+        stats={'hits':self.hits,
+            'misses':self.misses,
+            'evictions':self.evictions,
+            'hit_rate':self.hit_rate(),
+            'entries':self.n_entries+len(self.new)}
+        return stats
@@ -6,19 +6,59 @@
 '''
 
 from abc import ABCMeta, abstractmethod,abstractproperty
+import hashlib
 import json
 import re
 import codecs
 import nltk.stem
+from stem_cache import StemCache
 
 class Sanitiser(object):
     '''Abstract class for all Sanitiser objects to implement'''
     __metaclass__=ABCMeta
+    cache=None
+    _punct_table=None #built by compile
+    _punct_regex=None
+    _stopword_set=None
+    _fingerprint=None
+    
     @abstractmethod
     def sanitise():
         '''Sanitise the inputted sentence'''
         return None
     
+    def cached_sanitise(self,sentence):
+        '''Sanitise the inputted sentence, looking it up in the sanitisation
+        cache if one has been set (and calling :method: sanitise if not)
+        
+        Args:
+            sentence (str): sentence to sanitise
+        
+        Returns:
+            export (str): sanitised sentence
+        '''
+        if self.cache is None:
+            export = self.sanitise(sentence)
+        else:
+            export = self.cache.sanitise(self,sentence)
+        return export
+    
+    def set_cache(self,cache):
+        '''set the cache to store sanitised sentences in
+        
+        Args:
+            cache (strawberry.sanitise_cache.SanitiseCache): the cache to use,
+                or None to stop caching
+        '''
+        self.cache=cache
+    
+    def flush_cache(self):
+        '''write the sanitisation cache's pending entries to disk, if a cache
+        has been set. Called by worker processes when they finish a shard
+        '''
+        if self.cache is not None:
+            self.cache.flush()
+    
     def remove_unicode_punct(self,sentence, chars):
         '''remove punctuation from a sentence
         
@@ -31,6 +71,65 @@ class Sanitiser(object):
         '''
         scrubbed=re.sub(u'(?u)[' + re.escape(''.join(chars)) + ']', ' ', sentence)
         return scrubbed
+    
+    def compile(self):
+        '''build the punctuation translation table and stopword set used by 
+        :method: words, and the :method: fingerprint, once rather than for every 
+        sentence. Called on first use; call again after changing punct_filter, 
+        stopwords or stem_type
+        '''
+        chars=u''.join(getattr(self,'punct_filter',None) or [])
+        self._punct_table=dict.fromkeys((ord(c) for c in chars),u' ')
+        self._punct_regex=re.compile(u'(?u)[' + re.escape(chars) + ']') if chars else None
+        self._stopword_set=frozenset(getattr(self,'stopwords',None) or [])
+        config=[self.__class__.__name__]
+        for attr in ('punct_filter','stopwords','stem_type'):
+            config.append(getattr(self,attr,None))
+        self._fingerprint=hashlib.md5(json.dumps(config,sort_keys=True)).hexdigest()
+    
+    def words(self,sentence,stopwords=False):
+        '''split a sentence into words, casting to lower case and removing 
+        punctuation (and stopwords). Gives the same words as lower casing, 
+        stripping, remove_unicode_punct and splitting, in one pass each over 
+        the sentence with the tables built by :method: compile
+        
+        Args:
+            sentence (str): sentence to split
+        
+        Kwargs:
+            stopwords (bool): whether to remove stopwords (defaults to False)
+        
+        Returns:
+            words (list): the words of the sentence
+        '''
+        if self._punct_table is None:
+            self.compile()
+        lt=sentence.lower()
+        if isinstance(lt,unicode):
+            words=lt.translate(self._punct_table).split()
+        elif self._punct_regex is not None:#byte strings cannot be translated with unicode tables
+            words=self._punct_regex.sub(' ',lt).split()
+        else:
+            words=lt.split()
+        if stopwords:
+            stopword_set=self._stopword_set
+            words=[i for i in words if i not in stopword_set]
+        return words
+
+    def fingerprint(self):
+        '''get a hash identifying the sanitiser and its configuration, so
+        that cached sanitised output can be invalidated when either changes.
+        Computed by :method: compile, so like the punctuation table it is only 
+        updated when compile is called again
+        
+        Returns:
+            digest (str): md5 hex digest of the sanitiser class, punctuation, 
+                stopwords and stemming algorithm
+        '''
+        if self._fingerprint is None:
+            self.compile()
+        digest=self._fingerprint
+        return digest
 
 class NullSanitiser(Sanitiser):
     '''implementation of Sanitiser that just acts as a wrapper.
@@ -53,14 +152,20 @@ class NullSanitiser(Sanitiser):
 class MinimalSanitiser(Sanitiser):
     '''Implementation of Sanitiser, casts to lower case and removes punctuation.'''
     
-    def __init__(self,punct_file):
+    def __init__(self,punct_file,cache=None):
         '''Build a MinimalSanitiser
         
         Args:
             punct_file (str): json file containing list of characters to remove
+        
+        Kwargs:
+            cache (strawberry.sanitise_cache.SanitiseCache): cache of sanitised
+                sentences to use (defaults to None, no caching)
         '''
+        self.cache=cache
         with codecs.open(punct_file,'r',encoding='utf8') as f:
             self.punct_filter = json.load(f)#load punctuation to filter
+        self.compile()
     
     def sanitise(self,sentence):
         '''implements Sanitiser.Sanitise. remove punctuation characters from sentence
@@ -76,25 +181,28 @@ class MinimalSanitiser(Sanitiser):
             2) remove whitespace and newlines
             3) remove unwanted punctuation
         '''
-        lt = sentence.lower()
-        slt = lt.strip()
-        tslt = self.remove_unicode_punct(slt,self.punct_filter)
-        export = u' '.join(tslt.strip().split())
+        export = u' '.join(self.words(sentence))
         return export
     
 class StopWordSanitiser(Sanitiser):
     '''Implementation of Sanitiser, removes stopwords and punctuation from sentences'''
-    def __init__(self,stopwords_file,punct_file):
+    def __init__(self,stopwords_file,punct_file,cache=None):
         '''build a StopWordSanitiser
         
         Args:
             stopwords_file (str): json file containing list of stopwords to remove
             punct_file (str): json file containing list of characters to remove
+        
+        Kwargs:
+            cache (strawberry.sanitise_cache.SanitiseCache): cache of sanitised
+                sentences to use (defaults to None, no caching)
         '''
+        self.cache=cache
         with codecs.open(stopwords_file,'r',encoding='utf8') as f:
             self.stopwords = json.load(f)#load stopwords
         with codecs.open(punct_file,'r',encoding='utf8') as f:
             self.punct_filter = json.load(f)#load characters to remove
+        self.compile()
     
     def sanitise(self,sentence):
         '''implements Sanitiser.Sanitise. remove characters and stopwords from sentence
@@ -111,19 +219,19 @@ class StopWordSanitiser(Sanitiser):
             3) remove unwanted punctuation
             4) remove stopwords    
         '''
-        lt = sentence.lower()
-        slt = lt.strip()
-        tslt = self.remove_unicode_punct(slt,self.punct_filter)
-        stop_filtered = [i for i in tslt.split() if i not in self.stopwords]
-        export = u' '.join(stop_filtered)
+        export = u' '.join(self.words(sentence,stopwords=True))
         return export
 
 class StemmingSanitiser(Sanitiser):
     '''Implementation of Sanitiser, removes stopwords and punctuation
      from sentences and stems words using one of four stemming algorithms 
-     from NLTK.'''
+     from NLTK.
+     
+     The stem of each distinct word is memoised in a StemCache, so the
+     stemmer runs once per word rather than once per occurrence.'''
+    stem_cache=None
 
-    def __init__(self,stopwords_file,punct_file,stem_type='SNOWBALL'):
+    def __init__(self,stopwords_file,punct_file,stem_type='SNOWBALL',cache=None,stem_cache=None):
         '''Build a StemmingSanitiser 
         
         Args:
@@ -134,12 +242,22 @@ class StemmingSanitiser(Sanitiser):
             stem_type (str): 'SNOWBALL' or 'PORTER' or 'LANCASTER' or 'WORDNET'
                 specify 1 of 4 stemming algorithms to use in stemming.
                 Defaults to 'SNOWBALL'
+            cache (strawberry.sanitise_cache.SanitiseCache): cache of sanitised
+                sentences to use (defaults to None, no caching)
+            stem_cache (strawberry.stem_cache.StemCache): cache of word stems to use,
+                which may be shared with other StemmingSanitisers of the same 
+                stem_type (defaults to None, a new in-memory StemCache)
         '''
+        self.cache=cache
+        if stem_cache is not None and stem_cache.stem_type!=stem_type:
+            raise ValueError('StemCache holds '+stem_cache.stem_type+' stems, not '+stem_type)
+        self.stem_cache=stem_cache
         with codecs.open(stopwords_file,'r',encoding='utf8') as f:
             self.stopwords = json.load(f)
         with codecs.open(punct_file,'r',encoding='utf8') as f:
             self.punct_filter = json.load(f)
         self.stem_type=stem_type
+        self.compile()
         if stem_type=='SNOWBALL':
             self.stemmer = nltk.stem.snowball.EnglishStemmer()
         elif stem_type=='PORTER':
@@ -168,16 +286,15 @@ class StemmingSanitiser(Sanitiser):
             2) remove whitespace and newlines
             3) remove unwanted punctuation
             4) remove stopwords 
-            5) Perform Stemming on surviving words   
+            5) Perform Stemming on surviving words (looked up in the stem cache)
         '''
-        lt = sentence.lower()
-        slt = lt.strip()
-        tslt = self.remove_unicode_punct(slt,self.punct_filter)
-        stop_filtered = [i for i in tslt.split() if i not in self.stopwords]
+        stop_filtered = self.words(sentence,stopwords=True)
+        if self.stem_cache is None:#also sanitisers pickled without one
+            self.stem_cache=StemCache(self.stem_type)
         if self.stem_type=='WORDNET':
-            stem_filtered = [self.stemmer.lemmatize(i) for i in stop_filtered]
+            stem_filtered = self.stem_cache.stem_words(stop_filtered,self.stemmer.lemmatize)
         else:
-            stem_filtered = [self.stemmer.stem(i) for i in stop_filtered]
+            stem_filtered = self.stem_cache.stem_words(stop_filtered,self.stemmer.stem)
         export = u' '.join(stem_filtered)
         return export
     
\ No newline at end of file
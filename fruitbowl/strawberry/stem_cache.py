@@ -0,0 +1,155 @@
+'''
+.. module:: stem_cache
+   :platform: Unix, OSX
+   :synopsis: bounded memo of the stems of tokens, shared by the calls of a
+       stemming sanitiser and optionally saved between runs
+.. moduleauthor:: Patrick Lewis
+'''
+import codecs
+import json
+import os
+
+class StemCache(object):
+    '''In-memory cache of the stems (or lemmas) of tokens for one stemming
+    algorithm, so each distinct token is stemmed once rather than at every
+    occurrence.
+
+    The number of entries is bounded. Entries are kept in two generations:
+    new stems go in the current generation, and when it holds max_entries/2
+    tokens it becomes the old generation and the previous old generation is
+    dropped. Tokens found in the old generation are moved back to the current
+    one, so frequently used tokens are never evicted.
+
+    Used by strawberry.sanitisers.StemmingSanitiser, which makes one unless it
+    is given one to share.
+    '''
+    stem_type=''
+    cache_file=None
+    max_entries=0
+    hits=0
+    misses=0
+    evictions=0
+
+    def __init__(self,stem_type,max_entries=200000,cache_file=None):
+        '''Create a StemCache, loading its entries from cache_file if it exists
+
+        Args:
+            stem_type (str): name of the stemming algorithm the cache is for
+
+        Kwargs:
+            max_entries (int): maximum number of tokens to keep (defaults to 200000)
+            cache_file (str): json file to load entries from and to save them to
+                with :method: save (defaults to None, not saved)
+        '''
+        self.stem_type=stem_type
+        self.max_entries=max_entries
+        self.cache_file=cache_file
+        self.hits=0
+        self.misses=0
+        self.evictions=0
+        self.current={}
+        self.old={}
+        if cache_file is not None and os.path.exists(cache_file):
+            self.load(cache_file)
+
+    def __len__(self):
+        return len(self.current)+len(self.old)
+
+    def stem_words(self,words,stem):
+        '''get the stems of a list of tokens, stemming those not in the cache
+
+        Args:
+            words (list): the tokens
+            stem (function): the stemmer, taking a token and returning its stem
+
+        Returns:
+            stems (list): the stem of each token
+        '''
+        current=self.current
+        get=current.get
+        stems=[]
+        misses=0
+        for w in words:
+            s=get(w)
+            if s is None:
+                s=self.old.pop(w,None)
+                if s is None:
+                    s=stem(w)
+                    misses+=1
+                self._add(w,s)
+                current=self.current #_add may start a new generation
+                get=current.get
+            stems.append(s)
+        self.misses+=misses
+        self.hits+=len(words)-misses
+        return stems
+
+    def _add(self,word,stem):
+        '''put a token in the current generation, starting a new generation if
+        it is full'''
+        if len(self.current)>=max(1,self.max_entries//2):
+            self.evictions+=len(self.old)
+            self.old=self.current
+            self.current={}
+        self.current[word]=stem
+
+    def load(self,cache_file):
+        '''add the entries of a file saved with :method: save
+
+        Args:
+            cache_file (str): the json file
+        '''
+        with codecs.open(cache_file,'r',encoding='utf8') as f:
+            saved=json.load(f)
+        if saved['stem_type']!=self.stem_type:
+            raise ValueError('cache file '+cache_file+' holds '+saved['stem_type']+
+                ' stems, not '+self.stem_type)
+        for word,stem in saved['stems'].iteritems():
+            if word not in self.current and word not in self.old:
+                self._add(word,stem)
+
+    def save(self,cache_file=None):
+        '''write the entries to a json file, replacing it
+
+        Kwargs:
+            cache_file (str): the json file (defaults to None, the cache_file
+                the cache was created with)
+        '''
+        if cache_file is None:
+            cache_file=self.cache_file
+        if cache_file is None:
+            raise ValueError('no cache file to save StemCache to')
+        stems=dict(self.old)
+        stems.update(self.current)
+        tmp_file=cache_file+'.tmp'
+        with codecs.open(tmp_file,'w',encoding='utf8') as f:
+            json.dump({'stem_type':self.stem_type,'stems':stems},f,ensure_ascii=False)
+        os.rename(tmp_file,cache_file)
+
+    def clear(self):
+        '''remove every entry'''
+        self.current={}
+        self.old={}
+
+    def hit_rate(self):
+        '''get the fraction of tokens answered from the cache
+
+        Returns:
+            rate (float): hits/(hits+misses), 0. if there have been no lookups
+        '''
+        lookups=self.hits+self.misses
+        rate=float(self.hits)/lookups if lookups else 0.
+        return rate
+
+    def stats(self):
+        '''get the cache counters
+
+        Returns:
+            stats (dict): hits, misses, evictions, hit_rate and entries of the cache
+        '''
+        stats={'hits':self.hits,
+            'misses':self.misses,
+            'evictions':self.evictions,
+            'hit_rate':self.hit_rate(),
+            'entries':len(self)}
+        return stats